@@ -3,3 +3,18 @@ from .nmap import *
 from .domain import *
 from .log import *
 from .proxy import *
+from .profile import *
+from .daemon import *
+from .results import *
+
+
+# Lazy settings of the submodules, they are built on the first access
+_lazy_attributes = {
+    "COMMON_SUBDOMAINS": domain,
+}
+
+
+def __getattr__(name):
+    if name in _lazy_attributes:
+        return getattr(_lazy_attributes[name], name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
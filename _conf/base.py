@@ -16,9 +16,16 @@ BANNER = """
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 TEMP_DIR = f"{BASE_DIR}/__temp__/"
-if not os.path.exists(TEMP_DIR):
-    os.mkdir(TEMP_DIR)
 
 SCAN_DIR = f"{TEMP_DIR}scan/"
-if not os.path.exists(SCAN_DIR):
-    os.mkdir(SCAN_DIR)
+
+
+def ensure_dir(path:str) -> str:
+    """
+    Creates the folder with its parents, if it doesn't exist. The output folders are created only when
+    something is written to them, so importing the configuration has no side effects.
+    :return: The same path
+    """
+    if path and not os.path.isdir(path):
+        os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,41 @@
+from _conf.base import TEMP_DIR
+
+
+DAEMON_SOCKET = f"{TEMP_DIR}vulnscan.sock"
+
+DAEMON_HTTP_HOST = "127.0.0.1"
+
+DAEMON_HTTP_PORT = None
+
+DAEMON_TOKEN_FILE = f"{TEMP_DIR}vulnscan.token"
+
+DAEMON_MAX_JOBS = 4
+
+DAEMON_NMAP_PROCESSES = 3
+
+DAEMON_DNS_THREADS = 64
+
+DAEMON_JOB_PRIORITY = 10
+
+DAEMON_RESOLVE_TIMEOUT = 300
+
+# nmap options of the jobs, True for an option with a value. Nothing, that writes files or reads them (-oX, -iL,
+# --script-args-file, --datadir) or runs a script by its path, is allowed
+DAEMON_NMAP_OPTIONS = {
+    "-sV": False, "-sC": False, "-sVC": False, "-sS": False, "-sT": False, "-sU": False, "-sn": False, "-Pn": False,
+    "-n": False, "-F": False, "-O": False, "--open": False, "--reason": False, "--version-light": False, "--version-all": False,
+    "-p": True, "-T": True, "--top-ports": True, "--exclude-ports": True, "--script": True, "-script": True,
+    "--version-intensity": True, "--host-timeout": True, "--max-retries": True, "--min-rate": True, "--max-rate": True,
+}
+
+DAEMON_FINISHED_JOBS = 1000
+
+DAEMON_DNS_CACHE_SIZE = 100000
+
+DAEMON_DNS_CACHE_TTL = 300
+
+DAEMON_PASSIVE_CACHE_SIZE = 1000
+
+DAEMON_PASSIVE_CACHE_TTL = 3600
+
+DAEMON_WORDLIST_CACHE_SIZE = 16
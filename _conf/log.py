@@ -1,21 +1,38 @@
 import logging
-import os
 
-from _conf.base import TEMP_DIR
+from _conf.base import TEMP_DIR, SCAN_DIR
 
 
 LOG_OUTPUT_FOLDER = f"{TEMP_DIR}log/"
-if not os.path.exists(LOG_OUTPUT_FOLDER):
-    os.mkdir(LOG_OUTPUT_FOLDER)
 
 LOG_MESSAGE_FORMAT = "[%(asctime)-15s | %(levelname)-8s] %(message)s"
 
 FILE_LOG_LEVEL = logging.DEBUG
 
+# The log file is rotated at this size and the rotated files are compressed with gzip
+LOG_MAX_BYTES = 50 * 1024 * 1024
+
+LOG_BACKUP_COUNT = 5
+
+# Records are written by a separate thread, DEBUG and INFO records are dropped, if its queue is full
+LOG_QUEUE_SIZE = 10000
+
+LOG_FLUSH_INTERVAL = 0.5
+
+LOG_FLUSH_BATCH = 256
+
 CONSOLE_LOG_LEVEL = logging.INFO
 
 DEFAULT_AUTOLOG_LEVEL = logging.DEBUG
 
+# Auto-logged arguments and results are cut to this length and collections to this number of items
+AUTOLOG_MAX_LENGTH = 300
+
+AUTOLOG_MAX_ITEMS = 5
+
+# Only every N-th call of a decorated function is auto-logged (errors are always logged)
+AUTOLOG_SAMPLE_EVERY = 1
+
 MODULE_WIDTH = 26
 
 IP_WIDTH = 22
@@ -23,3 +40,12 @@ IP_WIDTH = 22
 STATUS_WIDTH = 18
 
 SENSITIVE_KEYS = ['user', 'username', 'password', 'pkey']
+
+METRICS_OUTPUT_FOLDER = f"{SCAN_DIR}metrics/"
+
+# Upper bounds in seconds of the latency histograms
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+METRICS_HOST = "127.0.0.1"
+
+TRACE_OUTPUT_FOLDER = f"{SCAN_DIR}trace/"
@@ -1,12 +1,26 @@
-import os
-
 from _conf.base import SCAN_DIR
 
 
 NMAP_OUTPUT_FOLDER = f"{SCAN_DIR}nmap/"
-if not os.path.exists(NMAP_OUTPUT_FOLDER):
-    os.mkdir(NMAP_OUTPUT_FOLDER)
 
 NMAP_PARAMS = "-sVC -p- -Pn -script=vuln"
 
 NMAP_ASYNC_PROCESSES = 3
+
+NMAP_STATS_EVERY = "30s"
+
+NMAP_HOST_TIMEOUT = None
+
+NMAP_TIME_BUDGET = None
+
+NMAP_KILL_GRACE_PERIOD = 5
+
+NMAP_FLEET_SLOTS = 2
+
+NMAP_FLEET_PREFETCH = 2
+
+NMAP_FLEET_MAX_ATTEMPTS = 3
+
+NMAP_FLEET_REMOTE_FOLDER = "/tmp/vulnscan/nmap/"
+
+NMAP_BASELINE_SWEEP_PARAMS = "-Pn -sV --version-light --top-ports 1000"
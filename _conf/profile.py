@@ -0,0 +1,14 @@
+from _conf.base import SCAN_DIR
+
+
+PROFILE_OUTPUT_FOLDER = f"{SCAN_DIR}profile/"
+
+PROFILE_MODES = ("cprofile", "sampling")
+
+# Interval in seconds between the stack samples of the sampling profiler
+PROFILE_SAMPLE_INTERVAL = 0.005
+
+# Interval in seconds between the tracemalloc snapshots, None to disable
+PROFILE_TRACEMALLOC_INTERVAL = None
+
+PROFILE_TRACEMALLOC_TOP = 25
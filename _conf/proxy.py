@@ -4,3 +4,79 @@ from _conf.base import TEMP_DIR
 PROXY_HOST = 'localhost'
 
 PROXY_JSON_FILE = f"{TEMP_DIR}proxy.json"
+
+PROXY_BACKLOG = 1024
+
+PROXY_BUFFER_SIZE = 65536
+
+PROXY_CHANNEL_TIMEOUT = 10
+
+PROXY_CHANNEL_THREADS = 256
+
+PROXY_STOP_TIMEOUT = 5
+
+PROXY_BALANCER_STRATEGY = "least-load"
+
+PROXY_BALANCER_STRATEGIES = ("least-load", "latency")
+
+PROXY_BALANCER_HEALTH_INTERVAL = 30
+
+PROXY_BALANCER_HEALTH_TIMEOUT = 10
+
+PROXY_BALANCER_EWMA_ALPHA = 0.3
+
+PROXY_BALANCER_MAX_FAILURES = 3
+
+PROXY_BALANCER_MAX_ERROR_RATE = 0.6
+
+PROXY_BALANCER_EJECT_BACKOFF = 30
+
+PROXY_BALANCER_MAX_EJECT_BACKOFF = 600
+
+PROXY_BALANCER_ATTEMPTS = 2
+
+PROXY_CONNECT_TIMEOUT = 15
+
+PROXY_FLEET_WORKERS = 32
+
+PROXY_FLEET_TIMEOUT = 60
+
+PROXY_POOL_SIZE = 2
+
+PROXY_POOL_MAX_SESSIONS = 8
+
+PROXY_POOL_KEEPALIVE = 30
+
+PROXY_POOL_RECONNECT_BACKOFF = 1
+
+PROXY_POOL_MAX_RECONNECT_BACKOFF = 60
+
+PROXY_SFTP_CHUNK_SIZE = 1048576
+
+PROXY_SFTP_PREFETCH_REQUESTS = 256
+
+PROXY_SFTP_PARALLEL = 4
+
+PROXY_SFTP_IDLE_SESSIONS = 4
+
+PROXY_SFTP_TIMEOUT = 30
+
+PROXY_SFTP_ATTEMPTS = 3
+
+PROXY_EGRESS_STRATEGY = "round-robin"
+
+PROXY_EGRESS_STRATEGIES = ("round-robin", "per-target")
+
+PROXY_EGRESS_RATE = 10
+
+PROXY_EGRESS_BURST = 20
+
+PROXY_EGRESS_MAX_FAILURES = 3
+
+PROXY_EGRESS_BACKOFF = 30
+
+PROXY_EGRESS_MAX_BACKOFF = 600
+
+PROXY_EGRESS_ATTEMPTS = 3
+
+PROXY_EGRESS_TIMEOUT = 30
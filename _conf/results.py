@@ -0,0 +1,10 @@
+from _conf.base import SCAN_DIR
+
+
+RESULTS_DB = f"{SCAN_DIR}results.sqlite3"
+
+RESULTS_BATCH_SIZE = 1000
+
+RESULTS_REPORT_FOLDER = f"{SCAN_DIR}report/"
+
+RESULTS_REPORT_FORMATS = ("html", "csv", "json")
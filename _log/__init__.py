@@ -1,2 +1,4 @@
 from .logger import Logger, LogLevel
 from .decorator import *
+from .metrics import metrics, start_metrics_server
+from .tracing import tracer
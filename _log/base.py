@@ -1,8 +1,12 @@
+import atexit
 from datetime import datetime
 import logging
+import queue
 from enum import Enum
 
-from _conf import LOG_MESSAGE_FORMAT, FILE_LOG_LEVEL, CONSOLE_LOG_LEVEL, LOG_OUTPUT_FOLDER, MODULE_WIDTH, IP_WIDTH, STATUS_WIDTH, DEFAULT_AUTOLOG_LEVEL
+from _conf import LOG_MESSAGE_FORMAT, FILE_LOG_LEVEL, CONSOLE_LOG_LEVEL, LOG_OUTPUT_FOLDER, MODULE_WIDTH, IP_WIDTH, STATUS_WIDTH, DEFAULT_AUTOLOG_LEVEL, \
+    LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_QUEUE_SIZE, LOG_FLUSH_INTERVAL, LOG_FLUSH_BATCH
+from _log.pipeline import BatchStreamHandler, CompressedRotatingFileHandler, DroppingQueueHandler, BatchingQueueListener
 
 
 class LogLevel(Enum):
@@ -28,34 +32,55 @@ def _format_message(module, result, ip=None, status=None):
         return f"{module:<{MODULE_WIDTH + IP_WIDTH + STATUS_WIDTH}}{result}"
 
 
-class BaseLogger:
-    # File handler for debug-level logging
-    _file_log = logging.FileHandler(f"{LOG_OUTPUT_FOLDER}{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}.log", "w")
-    _file_log.setLevel(FILE_LOG_LEVEL)
+def _start_writer(queue_handler:DroppingQueueHandler) -> BatchingQueueListener:
+    """
+    Creates the handlers and starts the writer thread on the first record, so importing the logger opens no files.
+    """
+    # File handler for debug-level logging, rotated by size, the file is created by the first write
+    file_log = CompressedRotatingFileHandler(f"{LOG_OUTPUT_FOLDER}{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}.log",
+                                             maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, delay=True)
+    file_log.setLevel(FILE_LOG_LEVEL)
 
     # Console handler for info-level logging
-    _console_out = logging.StreamHandler()
-    _console_out.setLevel(CONSOLE_LOG_LEVEL)
+    console_out = BatchStreamHandler()
+    console_out.setLevel(CONSOLE_LOG_LEVEL)
 
     # Setting up the formatter for both handlers
     formatter = logging.Formatter(LOG_MESSAGE_FORMAT)
-    _file_log.setFormatter(formatter)
-    _console_out.setFormatter(formatter)
+    file_log.setFormatter(formatter)
+    console_out.setFormatter(formatter)
+
+    listener = BatchingQueueListener(queue_handler.queue, file_log, console_out, queue_handler=queue_handler,
+                                     flush_interval=LOG_FLUSH_INTERVAL, flush_batch=LOG_FLUSH_BATCH)
+    listener.start()
+    # Writes the rest of the queue at exit
+    atexit.register(listener.stop)
+    return listener
+
+
+class BaseLogger:
+    # The handlers are written by a separate thread, so logging never blocks the event loop on disk or terminal
+    _queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE), on_first_record=_start_writer)
 
     # Creating and configuring the logger
     _logger = logging.getLogger()
-    _logger.setLevel(logging.DEBUG)
-    _logger.addHandler(_file_log)
-    _logger.addHandler(_console_out)
+    # The lowest level of the handlers, so records, that no handler would write, are rejected before formatting
+    _logger.setLevel(min(FILE_LOG_LEVEL, CONSOLE_LOG_LEVEL))
+    _logger.addHandler(_queue_handler)
 
     # Additional loggers
     logging.getLogger("paramiko").setLevel(logging.WARNING)
 
 
+    def is_enabled(self, level:LogLevel) -> bool:
+        return self._logger.isEnabledFor(level.value if level else LogLevel.NOTSET.value)
+
     def log_result(self, level:LogLevel, module:str, result:str, ip=None, status=None):
         """
         Logs a message at the specified log level with a structured format.
         """
+        if not self.is_enabled(level):
+            return
         log_message = _format_message(module, result, ip, status)
         self._logger.log(level.value if level else LogLevel.NOTSET, log_message)
 
@@ -81,4 +106,6 @@ class BaseLogger:
                                  f"\n\t- Log level (console):  {logging.getLevelName(CONSOLE_LOG_LEVEL)}"
                                  f"\n\t- Log level (file):  {logging.getLevelName(FILE_LOG_LEVEL)}"
                                  f"\n\t- Log format: {LOG_MESSAGE_FORMAT}"
-                                 f"\n\t- Log folder: {LOG_OUTPUT_FOLDER}\n")
+                                 f"\n\t- Log folder: {LOG_OUTPUT_FOLDER}"
+                                 f"\n\t- Log rotation: {LOG_MAX_BYTES} bytes, {LOG_BACKUP_COUNT} compressed files"
+                                 f"\n\t- Log queue: {LOG_QUEUE_SIZE} records\n")
@@ -1,60 +1,125 @@
 import inspect
+import itertools
+import time
 from functools import wraps
 from typing import Any
 
-from _conf import SENSITIVE_KEYS
+from _conf import SENSITIVE_KEYS, AUTOLOG_MAX_LENGTH, AUTOLOG_MAX_ITEMS, AUTOLOG_SAMPLE_EVERY
 from .logger import vsc_log, LogLevel
+from .metrics import metrics
 
 
-def logger(module_name:str = None, log_level:LogLevel = None, filter_sensitive:bool = True):
+def logger(module_name:str = None, log_level:LogLevel = None, filter_sensitive:bool = True, sample_every:int = None):
     """
     Decorator for logging input data and method execution results.
     Logs successful execution and the output result, as well as errors if they occur.
+    Nothing is filtered or formatted, if the level of auto-logging is disabled.
+    If the metrics registry is enabled, the number of calls, errors and the duration of each call are collected.
 
     :param module_name: Module name to use in logs.
     :param log_level: Level of auto-logging
     :param filter_sensitive: Specifies whether arguments should be filtered for sensitive information for logging purposes
+    :param sample_every: Log the arguments and results of only every N-th call, for hot functions (default is AUTOLOG_SAMPLE_EVERY)
     """
     module = f"auto.{module_name}" if module_name else "auto"
     level = log_level if log_level else LogLevel.DEFAULT_AUTOLOG_LEVEL
+    sample_every = max(1, sample_every if sample_every else AUTOLOG_SAMPLE_EVERY)
 
     def decorator(func):
+        calls = itertools.count()
+        metric_name = f"{module_name}.{func.__name__}" if module_name else func.__name__
+
+        def log_call(kind:str, args, kwargs) -> bool:
+            # Checked on each call, so the level can still be changed at runtime
+            if not vsc_log.is_enabled(level) or next(calls) % sample_every:
+                return False
+            f_args, f_kwargs = _summarize(args), _summarize(kwargs)
+            if filter_sensitive:
+                f_args, f_kwargs = _filter_args(f_args, f_kwargs)
+            vsc_log.log_result(level=level, module=module, status="INP",
+                               result=_truncate(f"Calling {kind} {func.__name__} with args: {f_args} kwargs: {f_kwargs}"))
+            return True
+
+        def log_return(kind:str, result):
+            vsc_log.log_result(level=level, module=module, status="OUT", result=_truncate(f"{kind.capitalize()} {func.__name__} returned {_summarize(result)}"))
+
+        def log_error(kind:str, e:Exception):
+            if vsc_log.is_enabled(level):
+                vsc_log.log_result(level=level, module=module, status="ERR", result=_truncate(f"Error in {kind} {func.__name__}: {e}"))
+
         @wraps(func)
         async def async_wrapper(*args, **kwargs):
-            f_args, f_kwargs = _filter_args(args, kwargs) if filter_sensitive else args, kwargs
             # Logging arguments
-            vsc_log.log_result(level=level, module=module, status="INP", result=f"Calling async {func.__name__} with args: {f_args} kwargs: {f_kwargs}")
+            logged = log_call("async", args, kwargs)
+            started = time.perf_counter() if metrics.enabled else None
+            failed = False
             try:
                 # Calling the function
                 result = await func(*args, **kwargs)
                 # Logging the result
-                vsc_log.log_result(level=level, module=module, status="OUT", result=f"Async {func.__name__} returned {result}")
+                if logged:
+                    log_return("async", result)
                 return result
             except Exception as e:
                 # Logging the error
-                vsc_log.log_result(level=level, module=module, status="ERR", result=f"Error in async {func.__name__}: {e}")
+                failed = True
+                log_error("async", e)
                 raise
+            finally:
+                if started is not None:
+                    metrics.observe(metric_name, time.perf_counter() - started, failed)
 
+        @wraps(func)
         def sync_wrapper(*args, **kwargs):
-            f_args, f_kwargs = _filter_args(args, kwargs) if filter_sensitive else args, kwargs
             # Logging arguments
-            vsc_log.log_result(level=level, module=module, status="INP", result=f"Calling sync {func.__name__} with args: {f_args} kwargs: {f_kwargs}")
+            logged = log_call("sync", args, kwargs)
+            started = time.perf_counter() if metrics.enabled else None
+            failed = False
             try:
                 # Calling the function
                 result = func(*args, **kwargs)
                 # Logging the result
-                vsc_log.log_result(level=level, module=module, status="OUT", result=f"Sync {func.__name__} returned {result}")
+                if logged:
+                    log_return("sync", result)
                 return result
             except Exception as e:
                 # Logging the error
-                vsc_log.log_result(level=level, module=module, status="ERR", result=f"Error in sync {func.__name__}: {e}")
+                failed = True
+                log_error("sync", e)
                 raise
+            finally:
+                if started is not None:
+                    metrics.observe(metric_name, time.perf_counter() - started, failed)
 
         # Determine if the function is asynchronous
         return async_wrapper if inspect.iscoroutinefunction(func) else sync_wrapper
     return decorator
 
 
+def _summarize(value:Any, depth:int = 2) -> Any:
+    """
+    Makes a short preview of the value for logging: long collections are cut to AUTOLOG_MAX_ITEMS items
+    with the number of the remaining ones, so the whole collection is never filtered and formatted.
+    """
+    if depth < 0:
+        return value
+    if isinstance(value, dict):
+        preview = {key: _summarize(val, depth - 1) for key, val in itertools.islice(value.items(), AUTOLOG_MAX_ITEMS)}
+        if len(value) > AUTOLOG_MAX_ITEMS:
+            preview["..."] = f"{len(value) - AUTOLOG_MAX_ITEMS} more"
+        return preview
+    if isinstance(value, (list, tuple, set, frozenset)):
+        preview = [_summarize(item, depth - 1) for item in itertools.islice(value, AUTOLOG_MAX_ITEMS)]
+        if len(value) > AUTOLOG_MAX_ITEMS:
+            preview.append(f"... {len(value) - AUTOLOG_MAX_ITEMS} more")
+        return tuple(preview) if isinstance(value, tuple) else preview
+    return value
+
+
+def _truncate(message:str, max_length:int = AUTOLOG_MAX_LENGTH) -> str:
+    return message if len(message) <= max_length else f"{message[:max_length]}... ({len(message)} chars)"
+
+
 def _filter_args(args: tuple[Any, ...], kwargs: dict[str, Any]) -> tuple[tuple[Any, ...], dict[str, Any]]:
     """
     Фильтрует значения в переданных аргументах, заменяя их на '*****' для защищённых ключей.
@@ -86,6 +151,6 @@ def _filter_args(args: tuple[Any, ...], kwargs: dict[str, Any]) -> tuple[tuple[A
     filtered_args = tuple(filter_value(arg) for arg in args)
 
     # Фильтрация именованных аргументов
-    filtered_kwargs = {key: filter_value(value) for key, value in kwargs.items()}
+    filtered_kwargs = filter_value(kwargs)
 
     return filtered_args, filtered_kwargs
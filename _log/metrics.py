@@ -0,0 +1,164 @@
+import bisect
+import json
+import threading
+from datetime import datetime
+
+from _conf import METRICS_BUCKETS, METRICS_HOST, METRICS_OUTPUT_FOLDER, ensure_dir
+
+
+class _FunctionMetrics:
+    __slots__ = ("calls", "errors", "total", "max", "buckets")
+
+    def __init__(self, bucket_count:int):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        # The last bucket is +Inf
+        self.buckets = [0] * (bucket_count + 1)
+
+
+class MetricsRegistry:
+    """
+    In-process registry of call counts, error counts and latency histograms of the functions decorated with @logger.
+    Nothing is collected until the registry is enabled.
+    """
+    def __init__(self, buckets:tuple = METRICS_BUCKETS):
+        self.enabled = False
+        self.buckets = tuple(sorted(buckets))
+        self._functions = {}
+        self._lock = threading.Lock()
+
+    def enable(self, buckets:tuple = None):
+        """
+        :param buckets: Upper bounds of the latency histograms instead of METRICS_BUCKETS, e.g. finer ones for
+            a benchmark, the collected metrics are dropped with them
+        """
+        if buckets:
+            with self._lock:
+                self.buckets = tuple(sorted(buckets))
+                self._functions.clear()
+        self.enabled = True
+
+    def observe(self, name:str, duration:float, error:bool = False):
+        """
+        :param name: Name of the function
+        :param duration: Duration of the call in seconds
+        :param error: The call raised an exception
+        """
+        with self._lock:
+            function = self._functions.get(name)
+            if function is None:
+                function = self._functions[name] = _FunctionMetrics(len(self.buckets))
+            function.calls += 1
+            function.errors += error
+            function.total += duration
+            function.max = max(function.max, duration)
+            function.buckets[bisect.bisect_left(self.buckets, duration)] += 1
+
+    def snapshot(self) -> dict:
+        """
+        :return: Dict of 'calls', 'errors', 'total', 'mean', 'max' and cumulative 'buckets' (by upper bound) by function
+        """
+        with self._lock:
+            functions = {name: (function.calls, function.errors, function.total, function.max, list(function.buckets))
+                         for name, function in self._functions.items()}
+        snapshot = {}
+        for name, (calls, errors, total, max_duration, buckets) in sorted(functions.items()):
+            cumulative, count = {}, 0
+            for bound, bucket in zip((*self.buckets, "+Inf"), buckets):
+                count += bucket
+                cumulative[str(bound)] = count
+            snapshot[name] = {"calls": calls, "errors": errors, "total": total, "mean": total / calls if calls else 0,
+                              "max": max_duration, "buckets": cumulative}
+        return snapshot
+
+    def quantile(self, name:str, q:float) -> float | None:
+        """
+        Estimates a quantile of the durations of the function from its histogram, within the bucket it falls into.
+        :param q: Quantile from 0 to 1, e.g. 0.99
+        :return: Duration in seconds, None if the function has no calls
+        """
+        with self._lock:
+            function = self._functions.get(name)
+            if not function or not function.calls:
+                return None
+            calls, max_duration, buckets = function.calls, function.max, list(function.buckets)
+        rank = q * calls
+        count, lower = 0, 0.0
+        for bound, bucket in zip((*self.buckets, max_duration), buckets):
+            if bucket and count + bucket >= rank:
+                # Linear interpolation between the bounds of the bucket, the last one ends at the longest call
+                return min(lower + (bound - lower) * (rank - count) / bucket, max_duration)
+            count += bucket
+            lower = bound
+        return max_duration
+
+    def render_prometheus(self) -> str:
+        """
+        :return: Metrics in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = ["# HELP vulnscan_calls_total Number of calls of the function",
+                 "# TYPE vulnscan_calls_total counter"]
+        lines += [f'vulnscan_calls_total{{function="{name}"}} {data["calls"]}' for name, data in snapshot.items()]
+        lines += ["# HELP vulnscan_errors_total Number of calls of the function, that raised an exception",
+                  "# TYPE vulnscan_errors_total counter"]
+        lines += [f'vulnscan_errors_total{{function="{name}"}} {data["errors"]}' for name, data in snapshot.items()]
+        lines += ["# HELP vulnscan_call_duration_seconds Duration of the calls of the function",
+                  "# TYPE vulnscan_call_duration_seconds histogram"]
+        for name, data in snapshot.items():
+            lines += [f'vulnscan_call_duration_seconds_bucket{{function="{name}",le="{bound}"}} {count}' for bound, count in data["buckets"].items()]
+            lines.append(f'vulnscan_call_duration_seconds_sum{{function="{name}"}} {data["total"]}')
+            lines.append(f'vulnscan_call_duration_seconds_count{{function="{name}"}} {data["calls"]}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, output_folder:str = METRICS_OUTPUT_FOLDER) -> str:
+        """
+        Saves the snapshot to the 'metrics <time>.json' file.
+        :return: Path to the file
+        """
+        output_file = f"{ensure_dir(output_folder)}metrics {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}.json"
+        with open(output_file, 'w') as file:
+            json.dump(self.snapshot(), file, indent=2)
+        return output_file
+
+    def summary(self, top:int = 10) -> str:
+        """
+        :return: Functions with the largest total time, one per line
+        """
+        snapshot = sorted(self.snapshot().items(), key=lambda item: item[1]["total"], reverse=True)[:top]
+        return '\n'.join(f"\t- {name}: {data['calls']} calls, {data['errors']} errors, {data['total']:.3f}s total, "
+                         f"{data['mean'] * 1000:.2f}ms mean, {data['max'] * 1000:.2f}ms max" for name, data in snapshot)
+
+
+metrics = MetricsRegistry()
+
+
+def start_metrics_server(port:int, host:str = METRICS_HOST):
+    """
+    Serves the metrics on http://<host>:<port>/metrics in a daemon thread.
+    :return: Started ThreadingHTTPServer, call shutdown() to stop it
+    """
+    # Imported here, http.server is only needed, if the metrics are served
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,171 @@
+import gzip
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+
+class _DeferredFlushMixin:
+    """
+    Handlers of the log writer don't flush after each record, the listener flushes them by batches.
+    """
+    def flush(self):
+        pass
+
+    def force_flush(self):
+        super().flush()
+
+
+class BatchStreamHandler(_DeferredFlushMixin, logging.StreamHandler):
+    pass
+
+
+class CompressedRotatingFileHandler(_DeferredFlushMixin, RotatingFileHandler):
+    """
+    Size-based rotating file handler, that compresses the rotated files with gzip.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.namer = lambda name: f"{name}.gz"
+        self.rotator = self._compress
+
+    @staticmethod
+    def _compress(source:str, dest:str):
+        with open(source, 'rb') as source_file, gzip.open(dest, 'wb') as dest_file:
+            shutil.copyfileobj(source_file, dest_file)
+        os.remove(source)
+
+    def _open(self):
+        # With delay=True the file and its folder are created by the first record
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+    def doRollover(self):
+        self.force_flush()
+        super().doRollover()
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Puts records into the bounded queue of the log writer without blocking the caller.
+    If the queue is full, records below `block_level` are dropped and counted, the others wait for a free place.
+    The writer is started by `on_first_record` (it takes this handler and returns the listener) on the first record.
+    """
+    def __init__(self, log_queue:queue.Queue, block_level:int = logging.WARNING, block_timeout:float = 1,
+                 on_first_record = None):
+        super().__init__(log_queue)
+        self.block_level = block_level
+        self.block_timeout = block_timeout
+        self.listener = None
+        self._on_first_record = on_first_record
+        self._start_lock = threading.Lock()
+        self._dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def _start_writer(self):
+        with self._start_lock:
+            # Reset before the call, so records logged while starting don't start it again
+            on_first_record, self._on_first_record = self._on_first_record, None
+            if on_first_record is not None:
+                self.listener = on_first_record(self)
+
+    def prepare(self, record:logging.LogRecord) -> logging.LogRecord:
+        # The record stays in this process, so only the message is merged here and formatting is left to the writer
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record:logging.LogRecord):
+        if self._on_first_record is not None:
+            self._start_writer()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno >= self.block_level:
+                try:
+                    self.queue.put(record, timeout=self.block_timeout)
+                    return
+                except queue.Full:
+                    pass
+            with self._dropped_lock:
+                self._dropped += 1
+
+    def pop_dropped(self) -> int:
+        with self._dropped_lock:
+            dropped, self._dropped = self._dropped, 0
+        return dropped
+
+
+class BatchingQueueListener(QueueListener):
+    """
+    Writer thread of the log queue. Records are passed to the handlers as they come and the handlers are flushed,
+    when the queue is drained, `flush_batch` records are written or `flush_interval` seconds are passed.
+    Repeated identical messages are merged into one 'repeated N times' record, dropped records are reported.
+    """
+    def __init__(self, log_queue:queue.Queue, *handlers, queue_handler:DroppingQueueHandler = None,
+                 flush_interval:float = 0.5, flush_batch:int = 256):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.queue_handler = queue_handler
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._last = None
+        self._repeated = 0
+        self._repeated_created = None
+
+    def enqueue_sentinel(self):
+        # Waits for a free place, the sentinel must not be dropped
+        self.queue.put(self._sentinel)
+
+    def handle(self, record:logging.LogRecord):
+        if self._last is not None and (record.levelno, record.name, record.msg) == (self._last.levelno, self._last.name, self._last.msg):
+            self._repeated += 1
+            self._repeated_created = record.created
+            return
+        self._flush_repeated()
+        self._last = record
+        super().handle(record)
+
+    def _flush_repeated(self):
+        if self._repeated:
+            record = logging.makeLogRecord({"name": self._last.name, "levelno": self._last.levelno, "levelname": self._last.levelname,
+                                            "msg": f"Last message repeated {self._repeated} times", "created": self._repeated_created,
+                                            "msecs": self._repeated_created % 1 * 1000})
+            self._repeated = 0
+            super().handle(record)
+
+    def _report_dropped(self):
+        dropped = self.queue_handler.pop_dropped() if self.queue_handler else 0
+        if dropped:
+            super().handle(logging.makeLogRecord({"levelno": logging.WARNING, "levelname": "WARNING",
+                                                  "msg": f"{dropped} log records were dropped, the log queue was full"}))
+
+    def _flush(self):
+        self._flush_repeated()
+        self._report_dropped()
+        for handler in self.handlers:
+            if hasattr(handler, "force_flush"):
+                handler.force_flush()
+            else:
+                handler.flush()
+
+    def _monitor(self):
+        pending = 0
+        flush_at = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                record = self.queue.get(timeout=max(0.0, flush_at - time.monotonic()) if pending else None)
+            except queue.Empty:
+                record = None
+            if record is self._sentinel:
+                break
+            if record is not None:
+                self.handle(record)
+                pending += 1
+            if pending and (record is None or self.queue.empty() or pending >= self.flush_batch or time.monotonic() >= flush_at):
+                self._flush()
+                pending = 0
+                flush_at = time.monotonic() + self.flush_interval
+        self._flush()
@@ -0,0 +1,110 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from _conf import TRACE_OUTPUT_FOLDER, ensure_dir
+
+
+# Lane (timeline row) of the current target, it is inherited by the asyncio tasks and threads started from the span
+_current_lane = contextvars.ContextVar("vsc_trace_lane", default="main")
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("_tracer", "_name", "_lane", "_args", "_start", "_token")
+
+    def __init__(self, tracer:'Tracer', name:str, lane:str | None, args:dict):
+        self._tracer = tracer
+        self._name = name
+        self._lane = lane
+        self._args = args
+        self._start = None
+        self._token = None
+
+    def __enter__(self):
+        if self._lane is not None:
+            self._token = _current_lane.set(self._lane)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        end = time.perf_counter()
+        lane = _current_lane.get()
+        if self._token is not None:
+            _current_lane.reset(self._token)
+        if exc_type is not None:
+            self._args["error"] = exc_type.__name__
+        self._tracer.add_span(self._name, self._start, end, lane, **self._args)
+        return False
+
+
+class Tracer:
+    """
+    Collects spans of the target lifecycle (loading, passive collection, DNS, queue wait, nmap, XML) and exports
+    them in the Chrome trace / Perfetto JSON format, one timeline row (lane) per target.
+    While the tracer is disabled, span() returns a shared no-op context manager.
+    """
+    def __init__(self):
+        self.enabled = False
+        self._origin = time.perf_counter()
+        self._events = []
+        self._lanes = {}
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def span(self, name:str, lane:str = None, **args):
+        """
+        :param name: Name of the span, e.g. 'dns' or 'nmap'
+        :param lane: Target of the span and its nested spans (default is the lane of the enclosing span)
+        :param args: Additional details shown with the span
+        :return: Context manager, that records the span on exit
+        """
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _Span(self, name, lane, args)
+
+    def add_span(self, name:str, start:float, end:float, lane:str = None, **args):
+        """
+        Records a span, that was measured outside of span(), e.g. the time a target waited in a queue.
+        :param start: Start time from time.perf_counter()
+        :param end: End time from time.perf_counter()
+        """
+        if not self.enabled:
+            return
+        lane = lane if lane is not None else _current_lane.get()
+        with self._lock:
+            tid = self._lanes.setdefault(lane, len(self._lanes))
+            self._events.append({"name": name, "cat": name.split(' ')[0], "ph": "X", "pid": os.getpid(), "tid": tid,
+                                 "ts": (start - self._origin) * 1e6, "dur": (end - start) * 1e6, "args": args})
+
+    def export(self, output_folder:str = TRACE_OUTPUT_FOLDER) -> str:
+        """
+        Saves the spans to the 'trace <time>.json' file, it can be opened in chrome://tracing or ui.perfetto.dev.
+        :return: Path to the file
+        """
+        with self._lock:
+            events = list(self._events)
+            lanes = dict(self._lanes)
+        metadata = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": lane}} for lane, tid in lanes.items()]
+        output_file = f"{ensure_dir(output_folder)}trace {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}.json"
+        with open(output_file, 'w') as file:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, file)
+        return output_file
+
+
+tracer = Tracer()
@@ -1,3 +1,9 @@
 from .load_from_file import *
 from .check_connection import *
 from .cleaner import *
+from .deadline import *
+from .task_runner import *
+from .profiler import *
+from .ttl_cache import *
+from .daemon_executor import *
+from .nameserver import *
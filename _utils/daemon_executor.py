@@ -0,0 +1,72 @@
+import concurrent.futures
+import queue
+import threading
+
+
+class DaemonExecutor(concurrent.futures.Executor):
+    """
+    Thread pool of daemon threads for blocking calls, that can't be interrupted, e.g. socket.gethostbyname().
+
+    A timed out call keeps its thread until it returns by itself, but unlike the default executor of asyncio
+    neither asyncio.run() nor the exit of the interpreter waits for it. The threads are started on demand.
+    """
+    def __init__(self, max_workers:int, thread_name_prefix:str = "daemon"):
+        """
+        :param max_workers: Maximum number of threads
+        :param thread_name_prefix: Prefix of the thread names
+        """
+        self.max_workers = max(1, max_workers)
+        self.thread_name_prefix = thread_name_prefix
+        self._work_queue = queue.SimpleQueue()
+        self._idle = threading.Semaphore(0)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def configure(self, max_workers:int):
+        """Changes the maximum number of threads, the started threads are kept."""
+        with self._lock:
+            self.max_workers = max(1, max_workers)
+
+    def submit(self, fn, /, *args, **kwargs) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("Cannot schedule new calls after shutdown")
+            self._work_queue.put((future, fn, args, kwargs))
+            # An idle thread takes the call, otherwise a new one is started while there is room for it
+            if not self._idle.acquire(timeout=0) and len(self._threads) < self.max_workers:
+                thread = threading.Thread(target=self._work, name=f"{self.thread_name_prefix}-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return future
+
+    def _work(self):
+        while (entry := self._work_queue.get()) is not None:
+            future, fn, args, kwargs = entry
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+            # The finished call isn't kept alive by the idle thread
+            del entry, future, fn, args, kwargs
+            self._idle.release()
+
+    def shutdown(self, wait:bool = True, *, cancel_futures:bool = False):
+        with self._lock:
+            self._shutdown = True
+            if cancel_futures:
+                while True:
+                    try:
+                        entry = self._work_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    entry[0].cancel()
+            for _ in self._threads:
+                self._work_queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
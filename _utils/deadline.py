@@ -0,0 +1,48 @@
+import time
+
+
+class Deadline:
+    """
+    Monotonic time budget of a run or one of its stages.
+
+    A stage budget is created with `child()` and never outlives its parent, so per-stage and per-target timeouts
+    always respect the global budget. A deadline without a budget never expires.
+    """
+    def __init__(self, budget:float | None = None, parent:'Deadline' = None):
+        """
+        :param budget: Budget in seconds, None for unlimited
+        :param parent: Deadline, that bounds this one
+        """
+        expires_at = time.monotonic() + budget if budget is not None else None
+        if parent is not None and parent.expires_at is not None:
+            expires_at = parent.expires_at if expires_at is None else min(expires_at, parent.expires_at)
+        self.expires_at = expires_at
+
+    def child(self, budget:float | None = None) -> 'Deadline':
+        return Deadline(budget, parent=self)
+
+    def remaining(self) -> float | None:
+        """
+        :return: Seconds left (never negative), None if unlimited
+        """
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def timeout(self, timeout:float | None = None) -> float | None:
+        """
+        Returns the timeout for a single operation, bounded by the deadline.
+        :param timeout: Own timeout of the operation in seconds, None for unlimited
+        :return: Timeout in seconds for asyncio.wait_for(), None if unlimited
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def __repr__(self):
+        remaining = self.remaining()
+        return f"Deadline({'unlimited' if remaining is None else f'{remaining:.1f}s left'})"
@@ -0,0 +1,10 @@
+def parse_nameserver(value:str) -> tuple[str, int]:
+    """
+    :param value: 'ip', 'ip:port' or '[ipv6]:port'
+    :return: Host and port of the nameserver, the port is 53 without one
+    """
+    host, separator, port = value.rpartition(':')
+    if not separator or (':' in host and not host.endswith(']')):
+        # Without a port, a bare IPv6 address has colons too
+        return value.strip('[]'), 53
+    return host.strip('[]'), int(port)
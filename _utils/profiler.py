@@ -0,0 +1,170 @@
+import collections
+import io
+import os
+import sys
+import threading
+import tracemalloc
+from datetime import datetime
+from typing import List
+
+from _conf import PROFILE_MODES, PROFILE_OUTPUT_FOLDER, PROFILE_SAMPLE_INTERVAL, PROFILE_TRACEMALLOC_INTERVAL, PROFILE_TRACEMALLOC_TOP, ensure_dir
+from _log import vsc_log
+
+
+_module_name = "utils.profiler"
+
+
+class _StackSampler:
+    """
+    Low-overhead sampling profiler: a thread takes the stacks of all other threads at a fixed interval.
+    The event loop thread shows the coroutine, that is running at the moment of the sample, idle waiting is
+    seen as the selector frame. The result is saved in the collapsed stack format of flamegraph.pl and speedscope.
+    """
+    def __init__(self, interval:float):
+        self.interval = interval
+        self.samples = 0
+        self._stacks = collections.Counter()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="vsc-stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def _run(self):
+        names = {}
+        while not self._stop_event.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                # The threads of the profiler itself are skipped
+                if names.get(thread_id, "").startswith("vsc-"):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self._stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def save(self, output_file:str):
+        with open(output_file, 'w') as file:
+            for stack, count in self._stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+
+class _MemorySnapshots:
+    """
+    Takes tracemalloc snapshots at a fixed interval and saves the top allocations and the growth since
+    the previous snapshot.
+    """
+    def __init__(self, interval:float, output_prefix:str, top:int = PROFILE_TRACEMALLOC_TOP):
+        self.interval = interval
+        self.output_prefix = output_prefix
+        self.top = top
+        self.files = []
+        self._previous = None
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="vsc-tracemalloc", daemon=True)
+
+    def start(self):
+        tracemalloc.start()
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+        self.snapshot()
+        tracemalloc.stop()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.snapshot()
+
+    def snapshot(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+        current, peak = tracemalloc.get_traced_memory()
+        output_file = f"{self.output_prefix}tracemalloc {len(self.files) + 1}.txt"
+        with open(output_file, 'w') as file:
+            file.write(f"Traced memory: {current / 1024 / 1024:.2f} MiB, peak {peak / 1024 / 1024:.2f} MiB\n\nTop allocations:\n")
+            file.writelines(f"{stat}\n" for stat in snapshot.statistics("lineno")[:self.top])
+            if self._previous:
+                file.write("\nGrowth since the previous snapshot:\n")
+                file.writelines(f"{stat}\n" for stat in snapshot.compare_to(self._previous, "lineno")[:self.top])
+        self._previous = snapshot
+        self.files.append(output_file)
+
+
+class Profiler:
+    """
+    Profiles the run of a command with cProfile or the sampling profiler and optionally takes tracemalloc snapshots.
+    cProfile sees only the thread, that started it (the event loop thread of the commands).
+    """
+    def __init__(self, mode:str = None, sample_interval:float = PROFILE_SAMPLE_INTERVAL,
+                 tracemalloc_interval:float = PROFILE_TRACEMALLOC_INTERVAL, output_folder:str = PROFILE_OUTPUT_FOLDER):
+        """
+        :param mode: 'cprofile', 'sampling' or None for memory snapshots only
+        :param sample_interval: Interval in seconds between the stack samples of the sampling profiler
+        :param tracemalloc_interval: Interval in seconds between the tracemalloc snapshots, None to disable
+        :param output_folder: Folder for the result files
+        """
+        if mode is not None and mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode '{mode}', expected one of: {', '.join(PROFILE_MODES)}")
+        self.mode = mode
+        self.output_prefix = f"{ensure_dir(output_folder)}profile {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} "
+        self._cprofile = None
+        if mode == "cprofile":
+            # Imported here, cProfile and pstats are only needed in this mode
+            import cProfile
+            self._cprofile = cProfile.Profile()
+        self._sampler = _StackSampler(sample_interval) if mode == "sampling" else None
+        self._memory = _MemorySnapshots(tracemalloc_interval, self.output_prefix) if tracemalloc_interval else None
+
+    def start(self) -> 'Profiler':
+        if self._memory:
+            self._memory.start()
+        if self._sampler:
+            self._sampler.start()
+        if self._cprofile:
+            self._cprofile.enable()
+        vsc_log.info_status_result(_module_name, "STARTED", f"Profiling with {self.mode or 'memory snapshots only'}")
+        return self
+
+    def stop(self) -> List[str]:
+        """
+        Stops profiling and saves the results.
+        :return: Paths to the result files
+        """
+        files = []
+        if self._cprofile:
+            self._cprofile.disable()
+            files.append(f"{self.output_prefix}cprofile.prof")
+            self._cprofile.dump_stats(files[-1])
+            # Text summary, the .prof file is for snakeviz, pstats and other viewers
+            import pstats
+            stream = io.StringIO()
+            pstats.Stats(self._cprofile, stream=stream).sort_stats("cumulative").print_stats(50)
+            files.append(f"{self.output_prefix}cprofile.txt")
+            with open(files[-1], 'w') as file:
+                file.write(stream.getvalue())
+        if self._sampler:
+            self._sampler.stop()
+            files.append(f"{self.output_prefix}sampling.folded")
+            self._sampler.save(files[-1])
+            vsc_log.info_status_result(_module_name, "SAMPLES", f"{self._sampler.samples} stack samples taken")
+        if self._memory:
+            self._memory.stop()
+            files.extend(self._memory.files)
+        vsc_log.info_status_result(_module_name, "SAVED", f"Profile results saved to: {', '.join(files)}")
+        return files
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,113 @@
+import asyncio
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, NamedTuple
+
+
+_DONE = object()
+
+# Seconds between the cancellations of a worker, that doesn't stop
+_CANCEL_INTERVAL = 0.1
+
+
+class TaskResult(NamedTuple):
+    index: int
+    item: Any
+    result: Any
+    error: BaseException | None
+
+
+async def _iterate(items:Iterable | AsyncIterable) -> AsyncIterator:
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def iter_bounded(func:Callable[[Any], Awaitable[Any]], items:Iterable | AsyncIterable, workers:int,
+                       queue_size:int = None) -> AsyncIterator[TaskResult]:
+    """
+    Runs func for every item with a fixed number of workers and yields the results as soon as they are ready.
+
+    Items are pulled lazily through a bounded queue, so only `workers` calls are alive at a time and a slow
+    consumer holds back the workers (backpressure) instead of piling up results. An exception of a call is
+    captured in its TaskResult. Closing the iterator (cancellation, an exception or contextlib.aclosing() around
+    an early break) cancels the remaining work.
+
+    :param func: Coroutine function, that takes one item
+    :param items: Iterable or async iterable of items, it is consumed lazily
+    :param workers: Number of parallel calls
+    :param queue_size: Size of the input and output queues (default is twice the number of workers)
+    :return: Async iterator of TaskResult(index, item, result, error) in order of completion
+    """
+    workers = max(1, workers)
+    queue_size = queue_size if queue_size else workers * 2
+    inbox = asyncio.Queue(queue_size)
+    outbox = asyncio.Queue(queue_size)
+
+    async def finish():
+        for _ in range(workers):
+            await inbox.put(_DONE)
+
+    async def produce():
+        # The workers are stopped by the end marks only after the last item or an error of the items iterator.
+        # A cancelled producer doesn't send them, the workers are cancelled too and a full inbox would block it forever
+        try:
+            index = 0
+            async for item in _iterate(items):
+                await inbox.put((index, item))
+                index += 1
+        except Exception:
+            await finish()
+            raise
+        await finish()
+
+    async def work():
+        while (entry := await inbox.get()) is not _DONE:
+            index, item = entry
+            try:
+                await outbox.put(TaskResult(index, item, await func(item), None))
+            except Exception as e:
+                await outbox.put(TaskResult(index, item, None, e))
+        await outbox.put(_DONE)
+
+    producer = asyncio.create_task(produce())
+    tasks = [asyncio.create_task(work()) for _ in range(workers)]
+    try:
+        running = workers
+        while running:
+            entry = await outbox.get()
+            if entry is _DONE:
+                running -= 1
+            else:
+                yield entry
+        # Re-raises an error of the items iterator
+        await producer
+    finally:
+        pending = {producer, *tasks}
+        cancelled = False
+        while pending:
+            for task in pending:
+                task.cancel()
+            # A call may swallow the cancellation (e.g. asyncio.wait_for() before Python 3.12, when its future finishes
+            # at the same time) and the worker blocks on a queue nobody serves any more, so it is cancelled again
+            try:
+                _, pending = await asyncio.wait(pending, timeout=_CANCEL_INTERVAL)
+            except asyncio.CancelledError:
+                # A cancellation of the consumer during the cleanup (e.g. by an outer iter_bounded()) doesn't leave
+                # the workers behind, it is raised after them
+                cancelled = True
+                pending = {task for task in pending if not task.done()}
+        await asyncio.gather(producer, *tasks, return_exceptions=True)
+        if cancelled:
+            raise asyncio.CancelledError()
+
+
+async def run_bounded(func:Callable[[Any], Awaitable[Any]], items:Iterable | AsyncIterable, workers:int,
+                      queue_size:int = None) -> list[TaskResult]:
+    """
+    Same as iter_bounded(), but collects all results ordered by the index of their items.
+    """
+    results = [result async for result in iter_bounded(func, items, workers, queue_size)]
+    results.sort(key=lambda result: result.index)
+    return results
@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+# Returned by TTLCache.get() for a miss, cached values may be None (e.g. an unresolved domain)
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with an expiration time of the entries.
+    It is disabled (every lookup is a miss and nothing is stored) while its size is 0, so short runs keep
+    the old behaviour and long-running processes (the daemon) turn it on with configure().
+    """
+    def __init__(self, maxsize:int = 0, ttl:float | None = None):
+        """
+        :param maxsize: Maximum number of entries, 0 disables the cache
+        :param ttl: Lifetime of an entry in seconds, None for unlimited
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize:int, ttl:float | None = None):
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            while len(self._entries) > max(0, maxsize):
+                self._entries.popitem(last=False)
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    def get(self, key:Hashable, default:Any = MISSING) -> Any:
+        """
+        :return: Cached value or `default` for a missing or expired key
+        """
+        if not self.maxsize:
+            return default
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > time.monotonic()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+        return default
+
+    def set(self, key:Hashable, value:Any):
+        if not self.maxsize:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl if self.ttl is not None else None, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "maxsize": self.maxsize, "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
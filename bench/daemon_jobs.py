@@ -0,0 +1,100 @@
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+from _log import vsc_log, logger
+from domain.dns_stand_in import StandInServerDNS
+
+
+_module_name = "bench.daemon_jobs"
+
+
+async def _cancel_and_stop(nameserver:str, domains:int, dns_workers:int, running_for:float) -> dict:
+    # Imported here, the daemon jobs import the nmap package
+    from daemon.jobs import JobManager
+    from domain import configure_nameservers
+
+    configure_nameservers([nameserver])
+    manager = JobManager(max_jobs=2)
+    manager.start()
+    params = {"domains": [f"bench-{index}.test" for index in range(domains)], "level": 1, "dns_workers": dns_workers}
+    cancelled = manager.submit("resolve", params)
+    stopped = manager.submit("resolve", params)
+    queued = manager.submit("resolve", params)
+    # Both jobs are suspended in their lookups, when they are cancelled
+    await asyncio.sleep(running_for)
+
+    started = time.perf_counter()
+    manager.cancel(cancelled.id)
+    async for _ in cancelled.stream():
+        pass
+    cancel_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    await manager.stop()
+    stop_elapsed = time.perf_counter() - started
+    configure_nameservers(None)
+    return {
+        "cancel_s": round(cancel_elapsed, 3),
+        "stop_s": round(stop_elapsed, 3),
+        "states": {"cancelled": cancelled.state, "stopped": stopped.state, "queued": queued.state},
+        "correct": cancelled.state == stopped.state == queued.state == "cancelled"
+                   and all(job.task is None or job.task.done() for job in (cancelled, stopped, queued)),
+    }
+
+
+@logger(_module_name)
+def bench_daemon_jobs(domains:int = 4, dns_workers:int = 32, delay:float = 0.05, running_for:float = 1, timeout:float = 10) -> dict:
+    """
+    Runs resolve jobs of daemon.jobs.JobManager against a slow stand-in DNS server, cancels one of them while it runs
+    and then stops the manager with a running and a queued job. Both have to end in time, a job, that ignores the
+    cancellation, holds up the shutdown of the daemon.
+
+    :param domains: Number of domains of each job, every domain brute-forces the built-in wordlist
+    :param dns_workers: Number of parallel lookups of each domain
+    :param delay: Seconds before each answer of the DNS server
+    :param running_for: Seconds the jobs run before the first cancellation
+    :param timeout: Seconds, after which the run counts as stuck
+    :return: Report with the seconds of the cancellation and of the stop, the states of the jobs and the correctness of the run
+    """
+    outcome = {}
+    with StandInServerDNS({}, delay=delay) as server:
+        # The event loop runs in a daemon thread, so a stuck job doesn't hold up the report or the exit
+        thread = threading.Thread(target=lambda: outcome.update(asyncio.run(_cancel_and_stop(server.nameserver, domains, dns_workers,
+                                                                                              running_for))),
+                                  name="daemon-jobs", daemon=True)
+        thread.start()
+        thread.join(running_for + timeout)
+    report = {"domains": domains, "dns_workers": dns_workers, "delay": delay, "running_for": running_for, **outcome,
+              "stuck": thread.is_alive(), "correct": outcome.get("correct", False)}
+    vsc_log.info_status_result(_module_name, "MEASURED", f"Cancelled in {report.get('cancel_s')}s, stopped in {report.get('stop_s')}s, "
+                                                         f"{'stuck' if report['stuck'] else 'correct' if report['correct'] else 'INCORRECT'}")
+    return report
+
+
+@logger(_module_name)
+def main(remaining_args):
+    parser = argparse.ArgumentParser(description="Cancellation and shutdown of running daemon jobs against a slow stand-in DNS server")
+    parser.add_argument('-d', '--domains', type=int, default=4,
+                        help="Number of domains of each job (default is 4)")
+    parser.add_argument('-w', '--dns-workers', type=int, default=32,
+                        help="Number of parallel lookups of each domain (default is 32)")
+    parser.add_argument('-s', '--delay', type=float, default=0.05,
+                        help="Seconds before each answer of the DNS server (default is 0.05)")
+    parser.add_argument('-r', '--running-for', type=float, default=1,
+                        help="Seconds the jobs run before the first cancellation (default is 1)")
+    parser.add_argument('-t', '--timeout', type=float, default=10,
+                        help="Seconds, after which the run counts as stuck (default is 10)")
+    parser.add_argument('-oF', '--output-file', default=None,
+                        help="Path to the JSON report (default is the standard output)")
+    args = parser.parse_args(remaining_args)
+
+    report = bench_daemon_jobs(args.domains, args.dns_workers, args.delay, args.running_for, args.timeout)
+    if args.output_file:
+        with open(args.output_file, 'w') as file:
+            json.dump(report, file, indent=2)
+        vsc_log.info_status_result(_module_name, "COMPLETE", f"Report saved to '{args.output_file}'")
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,318 @@
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import struct
+import sys
+import tempfile
+import time
+from typing import List
+
+from _conf import get_common_subdomains
+from _log import vsc_log, logger
+from domain.dns_stand_in import StandInServerDNS
+
+
+_module_name = "bench.dns_resolve"
+
+# Zones of the stand-in server: share of the brute-force names with a record, a wildcard for each domain,
+# seconds before each answer and share of the dropped queries
+BENCH_DNS_SCENARIOS = {
+    "baseline": {"hit_ratio": 0.5, "wildcard": False, "delay": 0, "loss": 0},
+    "nxdomain": {"hit_ratio": 0.01, "wildcard": False, "delay": 0, "loss": 0},
+    "wildcard": {"hit_ratio": 0, "wildcard": True, "delay": 0, "loss": 0},
+    "latency": {"hit_ratio": 0.1, "wildcard": False, "delay": 0.02, "loss": 0},
+    "loss": {"hit_ratio": 0.1, "wildcard": False, "delay": 0, "loss": 0.02},
+}
+
+# Lookup paths of resolve_domain(): the queries of dnspython to the configured nameservers, or the default blocking
+# socket.gethostbyname() in the lookup executor
+BENCH_DNS_RESOLVERS = ("dnspython", "gethostbyname")
+
+# Seconds a case with a domain timeout may take above the timeouts of its domains (start-up of the interpreter)
+BENCH_DNS_TIMEOUT_GRACE = 10
+
+# Fine latency buckets from 0.1ms to ~40s, each 10% above the previous one
+BENCH_DNS_BUCKETS = tuple(0.0001 * 1.1 ** index for index in range(136))
+
+
+def _build_zone(domains:List[str], words:List[str], scenario:dict) -> dict:
+    """
+    :return: Records of the domains and of a share of their subdomains, each record has its own IPv4 address
+    """
+    addresses = (socket.inet_ntoa(struct.pack(">I", (10 << 24) + index)) for index in itertools.count(1))
+    # Every n-th name has a record, so the zone is the same on every run
+    every = round(1 / scenario["hit_ratio"]) if scenario["hit_ratio"] else 0
+    records = {}
+    for domain in domains:
+        records[domain] = next(addresses)
+        if scenario["wildcard"]:
+            records[f"*.{domain}"] = next(addresses)
+        if every:
+            for word in words[::every]:
+                records[f"{word}.{domain}"] = next(addresses)
+    return records
+
+
+def _expected_ips(server:StandInServerDNS, domain:str, words:List[str], level:int) -> set:
+    """
+    :return: IPs, that resolve_ips() finds for the domain, it queries the words below every name of the previous level
+    """
+    names = [domain]
+    expected = set()
+    for current_level in range(level + 1):
+        expected.update(ip for ip in map(server.lookup, names) if ip)
+        if current_level < level:
+            names = [f"{word}.{name}" for name in names for word in words]
+    return expected
+
+
+def _blocking_gethostbyname(nameserver:str, timeout:float, attempts:int):
+    """
+    :return: Replacement of socket.gethostbyname(), that blocks its thread on a query to the stand-in server
+    """
+    import dns.exception
+    import dns.resolver
+    from _utils import parse_nameserver
+
+    resolver = dns.resolver.Resolver(configure=False)
+    host, port = parse_nameserver(nameserver)
+    resolver.nameservers = [host]
+    resolver.port = port
+    resolver.timeout = timeout
+    resolver.lifetime = timeout * max(1, attempts)
+
+    def gethostbyname(name:str) -> str:
+        try:
+            return resolver.resolve(name, "A", search=False)[0].address
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+            raise socket.gaierror(socket.EAI_NONAME, str(e))
+        except dns.exception.DNSException as e:
+            raise socket.gaierror(socket.EAI_AGAIN, str(e))
+    return gethostbyname
+
+
+def _run_case(domains:List[str], level:int, wordlist:str, nameserver:str, resolver:str, async_processes:int, dns_workers:int,
+              timeout:float, attempts:int, domain_timeout:float | None) -> dict:
+    """
+    Resolves the domains in a fresh interpreter, so the peak RSS and the threads belong to this case.
+    :return: Found IPs of each domain, the latencies of resolve_domain() and the resources of the process
+    """
+    # Imported in the case process, after the parent has spawned it
+    from _log.metrics import metrics
+    from domain import configure_nameservers
+    from domain.subdomain import limited_resolve_ips
+
+    if resolver == "dnspython":
+        configure_nameservers([nameserver], timeout, attempts)
+    else:
+        # The system resolver can't be pointed at the stand-in server, the lookups in the executor threads block on it instead
+        socket.gethostbyname = _blocking_gethostbyname(nameserver, timeout, attempts)
+    metrics.enable(BENCH_DNS_BUCKETS)
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    results = asyncio.run(limited_resolve_ips(domains, max_concurrent=async_processes, output_folder=None, level=level,
+                                              brute_force_file=wordlist, dns_workers=dns_workers, passive=False,
+                                              domain_timeout=domain_timeout))
+    elapsed = time.perf_counter() - started
+    lookups = metrics.snapshot().get("domain.resolve_domain.resolve_domain", {})
+    return {
+        "results": results,
+        "elapsed": elapsed,
+        "lookups": lookups.get("calls", 0),
+        "p50": metrics.quantile("domain.resolve_domain.resolve_domain", 0.5),
+        "p99": metrics.quantile("domain.resolve_domain.resolve_domain", 0.99),
+        "max": lookups.get("max"),
+        # ru_maxrss is in kilobytes on Linux
+        "baseline_rss_kb": baseline_rss,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+@logger(_module_name)
+def bench_dns(scenarios:List[str], levels:List[int], dns_workers:List[int], domains:int = 2, words:int = 1000,
+              async_processes:int = 2, timeout:float = 0.5, attempts:int = 3, resolvers:List[str] = BENCH_DNS_RESOLVERS,
+              domain_timeout:float | None = None) -> dict:
+    """
+    Resolves synthetic domains against the local stand-in DNS server for each lookup path, scenario, level and number
+    of DNS workers. Every case runs in a fresh interpreter.
+
+    :param scenarios: Names of BENCH_DNS_SCENARIOS
+    :param levels: Brute-force levels, the built-in wordlist is queried below every name of the previous level
+    :param dns_workers: Numbers of parallel lookups of each domain
+    :param domains: Number of synthetic domains
+    :param words: Number of synthetic words added to the built-in wordlist
+    :param async_processes: Number of domains resolved in parallel
+    :param timeout: Timeout in seconds of each query
+    :param attempts: Number of queries of a lookup
+    :param resolvers: Lookup paths of BENCH_DNS_RESOLVERS
+    :param domain_timeout: Timeout in seconds of each domain, a timed out domain has to return the IPs found so far
+        in time, the missing IPs are expected then
+    :return: Report with the lookups per second, the p50/p99 latencies in milliseconds, the peak RSS and the correctness of each case
+    """
+    domain_names = [f"bench-{index}.test" for index in range(domains)]
+    synthetic_words = [f"w{index}" for index in range(words)]
+    # resolve_ips() adds the built-in wordlist to the file, the filtered list has no duplicates
+    all_words = list(dict.fromkeys([*get_common_subdomains(), *synthetic_words]))
+    report = {"python": sys.version.split()[0], "domains": domains, "words": len(all_words), "async_processes": async_processes,
+              "timeout": timeout, "attempts": attempts, "domain_timeout": domain_timeout, "cases": []}
+    # A case, whose domains don't return after their timeouts, is stuck
+    case_timeout = domain_timeout * -(-domains // async_processes) + BENCH_DNS_TIMEOUT_GRACE if domain_timeout else None
+    # Fresh interpreters instead of forks, so a case doesn't inherit the memory and the threads of this process
+    context = multiprocessing.get_context("spawn")
+
+    with tempfile.NamedTemporaryFile('w', suffix=".txt", delete=False) as wordlist:
+        wordlist.write('\n'.join(synthetic_words) + '\n')
+    try:
+        for scenario_name in scenarios:
+            scenario = BENCH_DNS_SCENARIOS[scenario_name]
+            records = _build_zone(domain_names, all_words, scenario)
+            with StandInServerDNS(records, delay=scenario["delay"], loss=scenario["loss"]) as server:
+                for resolver, level, workers in itertools.product(resolvers, levels, dns_workers):
+                    queries = server.queries
+                    with context.Pool(1) as pool:
+                        pending = pool.apply_async(_run_case, (domain_names, level, wordlist.name, server.nameserver, resolver,
+                                                               async_processes, workers, timeout, attempts, domain_timeout))
+                        try:
+                            case = pending.get(case_timeout)
+                        except multiprocessing.TimeoutError:
+                            vsc_log.error_status_result(_module_name, "STUCK", f"{resolver} {scenario_name} level {level} with {workers} "
+                                                                               f"DNS workers didn't return {case_timeout}s after the start")
+                            report["cases"].append({"resolver": resolver, "scenario": scenario_name, "level": level,
+                                                    "dns_workers": workers, "stuck": True, "correct": False})
+                            continue
+                    expected = [_expected_ips(server, domain, all_words, level) for domain in domain_names]
+                    found = [set(ips or ()) for ips in case["results"]]
+                    missing = sum(len(expected_ips - found_ips) for expected_ips, found_ips in zip(expected, found))
+                    unexpected = sum(len(found_ips - expected_ips) for expected_ips, found_ips in zip(expected, found))
+                    result = {
+                        "resolver": resolver,
+                        "scenario": scenario_name,
+                        "level": level,
+                        "dns_workers": workers,
+                        "lookups": case["lookups"],
+                        "queries": server.queries - queries,
+                        "elapsed_s": round(case["elapsed"], 3),
+                        "lookups_per_second": round(case["lookups"] / case["elapsed"], 1) if case["elapsed"] else None,
+                        "p50_ms": round(case["p50"] * 1000, 3) if case["p50"] is not None else None,
+                        "p99_ms": round(case["p99"] * 1000, 3) if case["p99"] is not None else None,
+                        "max_ms": round(case["max"] * 1000, 3) if case["max"] is not None else None,
+                        "baseline_rss_mb": round(case["baseline_rss_kb"] / 1024, 1),
+                        "peak_rss_mb": round(case["peak_rss_kb"] / 1024, 1),
+                        "expected_ips": sum(map(len, expected)),
+                        "missing_ips": missing,
+                        "unexpected_ips": unexpected,
+                        # A timed out domain may miss IPs, but not find wrong ones
+                        "correct": not unexpected and (not missing or bool(domain_timeout)),
+                    }
+                    report["cases"].append(result)
+                    vsc_log.info_status_result(_module_name, "MEASURED", f"{resolver} {scenario_name} level {level} with {workers} DNS workers: "
+                                                                         f"{result['lookups_per_second']} lookups/s, "
+                                                                         f"p50 {result['p50_ms']}ms, p99 {result['p99_ms']}ms, "
+                                                                         f"{result['peak_rss_mb']}MB peak RSS, "
+                                                                         f"{'correct' if result['correct'] else f'{missing} missing IPs'}")
+    finally:
+        os.remove(wordlist.name)
+    return report
+
+
+def _case_key(case:dict) -> tuple:
+    # Reports without a lookup path were measured with dnspython
+    return case.get("resolver", "dnspython"), case["scenario"], case["level"], case["dns_workers"]
+
+
+@logger(_module_name)
+def compare_baseline(report:dict, baseline:dict, threshold:float = 0.2) -> List[dict]:
+    """
+    Compares the cases of a report with the same cases of an earlier report.
+
+    :param report: Report of bench_dns()
+    :param baseline: Earlier report of bench_dns()
+    :param threshold: Allowed share of the slowdown, e.g. 0.2 for 20% fewer lookups per second or a 20% higher p99
+    :return: Regressions, the cases with a lower throughput, a higher p99 latency or wrong IPs than the baseline
+    """
+    baseline_cases = {_case_key(case): case for case in baseline.get("cases", [])}
+    regressions = []
+    for case in report["cases"]:
+        before = baseline_cases.get(_case_key(case))
+        if not before:
+            continue
+        case["baseline_lookups_per_second"] = before.get("lookups_per_second")
+        case["baseline_p99_ms"] = before.get("p99_ms")
+        reasons = []
+        if case.get("stuck"):
+            reasons.append("didn't return after the domain timeouts")
+        elif not before.get("stuck"):
+            if before["lookups_per_second"] and case["lookups_per_second"] is not None \
+                    and case["lookups_per_second"] < before["lookups_per_second"] * (1 - threshold):
+                reasons.append(f"{case['lookups_per_second']} instead of {before['lookups_per_second']} lookups/s")
+            if before["p99_ms"] and case["p99_ms"] is not None and case["p99_ms"] > before["p99_ms"] * (1 + threshold):
+                reasons.append(f"p99 {case['p99_ms']}ms instead of {before['p99_ms']}ms")
+            if before["correct"] and not case["correct"]:
+                reasons.append(f"{case['missing_ips']} missing and {case['unexpected_ips']} unexpected IPs")
+        if reasons:
+            regressions.append({"case": dict(zip(("resolver", "scenario", "level", "dns_workers"), _case_key(case))), "reasons": reasons})
+            vsc_log.warn_status_result(_module_name, "REGRESSION", f"{' '.join(map(str, _case_key(case)))}: {', '.join(reasons)}")
+    return regressions
+
+
+@logger(_module_name)
+def main(remaining_args):
+    parser = argparse.ArgumentParser(description="DNS resolution benchmark against a local stand-in DNS server")
+    parser.add_argument('-s', '--scenarios', default=','.join(BENCH_DNS_SCENARIOS),
+                        help=f"Comma-separated list of scenarios (default is {','.join(BENCH_DNS_SCENARIOS)})")
+    parser.add_argument('-l', '--levels', default="0,1",
+                        help="Comma-separated list of brute-force levels, level 2 queries millions of names (default is 0,1)")
+    parser.add_argument('-w', '--dns-workers', default="32,128,512",
+                        help="Comma-separated list of numbers of parallel lookups of each domain (default is 32,128,512)")
+    parser.add_argument('-d', '--domains', type=int, default=2,
+                        help="Number of synthetic domains (default is 2)")
+    parser.add_argument('-W', '--words', type=int, default=1000,
+                        help="Number of synthetic words added to the built-in wordlist (default is 1000)")
+    parser.add_argument('-aP', '--async-processes', type=int, default=2,
+                        help="Number of domains resolved in parallel (default is 2)")
+    parser.add_argument('-t', '--timeout', type=float, default=0.5,
+                        help="Timeout in seconds of each query (default is 0.5)")
+    parser.add_argument('-a', '--attempts', type=int, default=3,
+                        help="Number of queries of a lookup (default is 3)")
+    parser.add_argument('-dT', '--domain-timeout', type=float, default=None,
+                        help="Timeout in seconds of each domain, a timed out domain has to return its IPs found so far (default is none)")
+    parser.add_argument('-r', '--resolvers', default=','.join(BENCH_DNS_RESOLVERS),
+                        help=f"Comma-separated list of lookup paths (default is {','.join(BENCH_DNS_RESOLVERS)})")
+    parser.add_argument('-bL', '--baseline', default=None,
+                        help="Path to an earlier JSON report, the cases are compared with it and a regression fails the run")
+    parser.add_argument('-rT', '--regression-threshold', type=float, default=0.2,
+                        help="Allowed share of the slowdown against the baseline (default is 0.2)")
+    parser.add_argument('-oF', '--output-file', default=None,
+                        help="Path to the JSON report (default is the standard output)")
+    args = parser.parse_args(remaining_args)
+
+    resolvers = [resolver.strip() for resolver in args.resolvers.split(',') if resolver.strip()]
+    unknown = [resolver for resolver in resolvers if resolver not in BENCH_DNS_RESOLVERS]
+    if unknown:
+        parser.error(f"Unknown lookup paths: {', '.join(unknown)}")
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+    scenarios = [scenario.strip() for scenario in args.scenarios.split(',') if scenario.strip()]
+    unknown = [scenario for scenario in scenarios if scenario not in BENCH_DNS_SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+    report = bench_dns(scenarios, [int(level) for level in args.levels.split(',')], [int(workers) for workers in args.dns_workers.split(',')],
+                       args.domains, args.words, args.async_processes, args.timeout, args.attempts, resolvers,
+                       args.domain_timeout)
+    if baseline:
+        report["regressions"] = compare_baseline(report, baseline, args.regression_threshold)
+    if args.output_file:
+        with open(args.output_file, 'w') as file:
+            json.dump(report, file, indent=2)
+        vsc_log.info_status_result(_module_name, "COMPLETE", f"Report saved to '{args.output_file}'")
+    else:
+        print(json.dumps(report, indent=2))
+    if baseline and report["regressions"]:
+        parser.exit(1, f"{len(report['regressions'])} cases regressed against '{args.baseline}'\n")
@@ -0,0 +1,126 @@
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from _log import vsc_log, logger
+from bench.nmap_orchestration import write_fake_bin, synthetic_targets
+from bench.ssh_stand_in import StandInServerSSH
+
+
+_module_name = "bench.fleet_scan"
+
+
+async def _scan_fleet(stand_ins:list, ips:list, output_folder:str, remote_folder:str, slots:int, max_attempts:int,
+                      kill_after:float | None) -> dict:
+    # Imported here, nmap.distributed_nmap imports paramiko through the proxy package
+    from nmap.distributed_nmap import distributed_scan
+    from proxy import ServerSSH
+
+    servers = [ServerSSH(stand_in.host, stand_in.port, stand_in.username, stand_in.password, local_port=0) for stand_in in stand_ins]
+    for server in servers:
+        await asyncio.to_thread(server.connect)
+
+    async def kill_node():
+        await asyncio.sleep(kill_after)
+        vsc_log.info_ip_status_result(_module_name, f"{stand_ins[0].host}:{stand_ins[0].port}", "KILLED", "Node is stopped during the scan")
+        await asyncio.to_thread(stand_ins[0].stop)
+
+    killer = asyncio.create_task(kill_node()) if kill_after is not None else None
+    try:
+        return await distributed_scan(servers, ips, "-sV", output_folder, slots=slots, max_attempts=max_attempts,
+                                      remote_folder=remote_folder)
+    finally:
+        if killer:
+            killer.cancel()
+        for server in servers:
+            server.close()
+
+
+@logger(_module_name)
+def bench_fleet(targets:int = 200, nodes:int = 3, slots:int = 2, sleep:float = 0.05, fail_rate:float = 0,
+                max_attempts:int = 1, kill_after:float | None = 1) -> dict:
+    """
+    Scans synthetic targets with nmap.distributed_nmap over local stand-in SSH nodes, that run a fake nmap
+    with the local shell. One node can be stopped during the scan, its jobs have to finish on the other nodes
+    without counting an attempt, so every target is finished even with a single attempt.
+
+    :param targets: Number of targets
+    :param nodes: Number of stand-in SSH nodes
+    :param slots: Number of parallel nmap processes on each node
+    :param sleep: Seconds each fake nmap sleeps
+    :param fail_rate: Share of the targets, for which the fake nmap fails
+    :param max_attempts: Number of attempts for each target
+    :param kill_after: Seconds after the start, when the first node is stopped, None to keep all nodes
+    :return: Report with the throughput, the finished, failed and unscheduled targets and the correctness of the run
+    """
+    fail_every = round(1 / fail_rate) if fail_rate else 0
+    ips = synthetic_targets(targets)
+    with tempfile.TemporaryDirectory(prefix="vsc-bench-bin-") as bin_folder, \
+            tempfile.TemporaryDirectory(prefix="vsc-bench-fleet-") as work_folder:
+        write_fake_bin(bin_folder)
+        # The nodes run the commands with the local shell, they inherit the fake nmap and its settings
+        os.environ["PATH"] = f"{bin_folder}{os.pathsep}{os.environ.get('PATH', '')}"
+        os.environ.update(FAKE_NMAP_SLEEP=str(sleep), FAKE_NMAP_XML_SIZE="256", FAKE_NMAP_FAIL_EVERY=str(fail_every), FAKE_NMAP_LINES="1")
+        stand_ins = [StandInServerSSH().start() for _ in range(nodes)]
+        try:
+            started = time.perf_counter()
+            result = asyncio.run(_scan_fleet(stand_ins, ips, os.path.join(work_folder, "local") + os.sep,
+                                             os.path.join(work_folder, "remote") + os.sep, slots, max_attempts, kill_after))
+            elapsed = time.perf_counter() - started
+        finally:
+            for stand_in in stand_ins:
+                stand_in.stop()
+
+    # The fake nmap fails by the index in the IP address, the failed jobs don't write a result
+    expected_failed = {ip for index, ip in enumerate(ips, 1) if fail_every and index % fail_every == 0}
+    report = {
+        "targets": targets,
+        "nodes": nodes,
+        "slots": slots,
+        "max_attempts": max_attempts,
+        "kill_after": kill_after,
+        "elapsed_s": round(elapsed, 3),
+        "targets_per_second": round(targets / elapsed, 1),
+        "finished": len(result["finished"]),
+        "failed": len(result["failed"]),
+        "unscheduled": len(result["unscheduled"]),
+        "correct": set(result["failed"]) == expected_failed and len(result["finished"]) == targets - len(expected_failed),
+    }
+    vsc_log.info_status_result(_module_name, "MEASURED", f"{targets} targets on {nodes} nodes: {report['targets_per_second']} targets/s, "
+                                                         f"{report['finished']} finished, {report['failed']} failed, "
+                                                         f"{report['unscheduled']} unscheduled, {'correct' if report['correct'] else 'INCORRECT'}")
+    return report
+
+
+@logger(_module_name)
+def main(remaining_args):
+    parser = argparse.ArgumentParser(description="Distributed nmap scan over local stand-in SSH nodes with a fake nmap")
+    parser.add_argument('-n', '--targets', type=int, default=200,
+                        help="Number of targets (default is 200)")
+    parser.add_argument('-N', '--nodes', type=int, default=3,
+                        help="Number of stand-in SSH nodes (default is 3)")
+    parser.add_argument('-sN', '--slots', type=int, default=2,
+                        help="Number of parallel nmap processes on each node (default is 2)")
+    parser.add_argument('-s', '--sleep', type=float, default=0.05,
+                        help="Seconds each fake nmap sleeps (default is 0.05)")
+    parser.add_argument('-f', '--fail-rate', type=float, default=0,
+                        help="Share of the targets, for which the fake nmap fails (default is 0)")
+    parser.add_argument('-mA', '--max-attempts', type=int, default=1,
+                        help="Number of attempts for each target (default is 1)")
+    parser.add_argument('-k', '--kill-after', type=float, default=1,
+                        help="Seconds after the start, when the first node is stopped, negative to keep all nodes (default is 1)")
+    parser.add_argument('-oF', '--output-file', default=None,
+                        help="Path to the JSON report (default is the standard output)")
+    args = parser.parse_args(remaining_args)
+
+    report = bench_fleet(args.targets, args.nodes, args.slots, args.sleep, args.fail_rate, args.max_attempts,
+                         args.kill_after if args.kill_after >= 0 else None)
+    if args.output_file:
+        with open(args.output_file, 'w') as file:
+            json.dump(report, file, indent=2)
+        vsc_log.info_status_result(_module_name, "COMPLETE", f"Report saved to '{args.output_file}'")
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,94 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from typing import List
+
+from _conf import BASE_DIR
+from _log import vsc_log, logger
+
+
+_module_name = "bench.import_time"
+
+BENCH_IMPORT_MODULES = ["_conf", "_log", "_utils", "domain", "nmap.async_nmap", "nmap.distributed_nmap", "proxy", "vulnscan"]
+
+
+def _measure(module:str) -> tuple[float, dict]:
+    """
+    Imports the module in a fresh interpreter with '-X importtime'.
+    :return: Wall time in seconds and the self and cumulative import times in microseconds by imported module
+    """
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}" if module else "pass"],
+                             cwd=BASE_DIR, capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    if process.returncode:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1] if process.stderr.strip() else f"exit code {process.returncode}")
+
+    imports = {}
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split('|')
+        imports[name.strip()] = {"self": int(self_us), "cumulative": int(cumulative_us)}
+    return wall, imports
+
+
+@logger(_module_name)
+def bench_imports(modules:List[str], repeat:int = 5, top:int = 10) -> dict:
+    """
+    :param modules: Modules to import
+    :param repeat: Number of fresh interpreters per module
+    :param top: Number of the slowest imports (by self time) to report per module
+    :return: Report with the interpreter startup and the wall and import times of each module in milliseconds
+    """
+    interpreter = statistics.median(_measure("")[0] for _ in range(repeat))
+    report = {"python": sys.version.split()[0], "repeat": repeat, "interpreter_ms": round(interpreter * 1000, 2), "modules": {}}
+    for module in modules:
+        try:
+            samples = [_measure(module) for _ in range(repeat)]
+        except RuntimeError as e:
+            vsc_log.error_status_result(_module_name, "FAILED", f"import {module}: {e}")
+            report["modules"][module] = {"error": str(e)}
+            continue
+        samples.sort(key=lambda sample: sample[0])
+        walls = [wall for wall, _ in samples]
+        # The slowest imports are taken from the median run
+        imports = samples[len(samples) // 2][1]
+        slowest = sorted(imports.items(), key=lambda item: item[1]["self"], reverse=True)[:top]
+        report["modules"][module] = {
+            "wall_ms": round(statistics.median(walls) * 1000, 2),
+            "wall_min_ms": round(walls[0] * 1000, 2),
+            "import_ms": round(imports[module]["cumulative"] / 1000, 2) if module in imports else None,
+            "imported_modules": len(imports),
+            "slowest": {name: round(times["self"] / 1000, 2) for name, times in slowest},
+        }
+        vsc_log.info_status_result(_module_name, "MEASURED", f"import {module}: {report['modules'][module]['wall_ms']}ms wall, "
+                                                             f"{report['modules'][module]['import_ms']}ms import, "
+                                                             f"{len(imports)} modules")
+    return report
+
+
+@logger(_module_name)
+def main(remaining_args):
+    parser = argparse.ArgumentParser(description="Import time benchmark of the VulnScan modules")
+    parser.add_argument('-m', '--modules', default=','.join(BENCH_IMPORT_MODULES),
+                        help=f"Comma-separated list of modules to import (default is {','.join(BENCH_IMPORT_MODULES)})")
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help="Number of fresh interpreters per module (default is 5)")
+    parser.add_argument('-t', '--top', type=int, default=10,
+                        help="Number of the slowest imports to report per module (default is 10)")
+    parser.add_argument('-oF', '--output-file', default=None,
+                        help="Path to the JSON report (default is the standard output)")
+    args = parser.parse_args(remaining_args)
+
+    report = bench_imports([module.strip() for module in args.modules.split(',') if module.strip()], args.repeat, args.top)
+    if args.output_file:
+        with open(args.output_file, 'w') as file:
+            json.dump(report, file, indent=2)
+        vsc_log.info_status_result(_module_name, "COMPLETE", f"Report saved to '{args.output_file}'")
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,190 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import stat
+import struct
+import sys
+import tempfile
+import time
+from typing import List
+
+from _conf import NMAP_STATS_EVERY
+from _log import vsc_log, logger
+from bench.resources import ResourceSampler
+
+
+_module_name = "bench.nmap_orchestration"
+
+# Stands in for nmap: nmap [params] -oX <file> <ip>. It sleeps, prints progress lines, fails for every n-th target
+# (by the index in the IP address) and writes an XML result of the given size.
+BENCH_FAKE_NMAP = r"""#!/bin/sh
+for arg; do
+    if [ "$previous" = "-oX" ]; then output="$arg"; fi
+    previous="$arg"
+done
+ip="$previous"
+old_ifs="$IFS"; IFS=.; set -- $ip; IFS="$old_ifs"
+index=$(( $2 * 65536 + $3 * 256 + $4 ))
+if [ "$FAKE_NMAP_SLEEP" != "0" ]; then sleep "$FAKE_NMAP_SLEEP"; fi
+line=0
+while [ "$line" -lt "$FAKE_NMAP_LINES" ]; do
+    echo "SYN Stealth Scan Timing: About $(( line * 100 / FAKE_NMAP_LINES )).00% done; ETC: 12:00 (0:00:01 remaining)"
+    line=$(( line + 1 ))
+done
+if [ "$FAKE_NMAP_FAIL_EVERY" -gt 0 ] && [ $(( index % FAKE_NMAP_FAIL_EVERY )) -eq 0 ]; then
+    echo "Failed to scan $ip" >&2
+    exit 1
+fi
+{
+    printf '<?xml version="1.0"?>\n<nmaprun scanner="nmap"><host><status state="up"/><address addr="%s" addrtype="ipv4"/><ports>' "$ip"
+    if [ "$FAKE_NMAP_XML_SIZE" -gt 0 ]; then head -c "$FAKE_NMAP_XML_SIZE" /dev/zero | tr '\0' ' '; fi
+    printf '</ports></host></nmaprun>\n'
+} > "$output"
+"""
+
+# The connection monitor of each scan pings, the fake answers at once without the network
+BENCH_FAKE_PING = "#!/bin/sh\nexit 0\n"
+
+
+def write_fake_bin(folder:str):
+    """Writes the fake nmap and ping into the folder, that is put first on PATH."""
+    for name, script in (("nmap", BENCH_FAKE_NMAP), ("ping", BENCH_FAKE_PING)):
+        path = os.path.join(folder, name)
+        with open(path, 'w') as file:
+            file.write(script)
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def synthetic_targets(count:int) -> List[str]:
+    """
+    :return: IPs 10.0.0.1, 10.0.0.2, ..., the fake nmap takes the index of a target from its IP
+    """
+    return [socket.inet_ntoa(struct.pack(">I", (10 << 24) + index)) for index in range(1, count + 1)]
+
+
+def _run_case(targets:int, async_processes:int, bin_folder:str, output_folder:str, sleep:float, xml_size:int,
+              fail_every:int, lines:int) -> dict:
+    """
+    Scans the targets with the fake nmap in a fresh interpreter, so the resources belong to this case.
+    """
+    os.environ["PATH"] = f"{bin_folder}{os.pathsep}{os.environ.get('PATH', '')}"
+    os.environ.update(FAKE_NMAP_SLEEP=str(sleep), FAKE_NMAP_XML_SIZE=str(xml_size), FAKE_NMAP_FAIL_EVERY=str(fail_every),
+                      FAKE_NMAP_LINES=str(lines))
+    # Imported in the case process, after the parent has spawned it
+    from _utils import Deadline
+    from nmap.async_nmap import _scan_all
+
+    args = argparse.Namespace(output_folder=output_folder, stats_every=NMAP_STATS_EVERY, host_timeout=None,
+                              async_processes=async_processes)
+    ips = synthetic_targets(targets)
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    cpu_started = os.times()
+    started = time.perf_counter()
+    with ResourceSampler() as sampler:
+        results = asyncio.run(_scan_all(ips, "-sV", args, Deadline()))
+    elapsed = time.perf_counter() - started
+    cpu = os.times()
+    peaks = sampler.peaks()
+    return {
+        "elapsed": elapsed,
+        "finished": sum(1 for result in results.values() if result),
+        "failed": sum(1 for result in results.values() if not result),
+        "cpu": (cpu.user - cpu_started.user) + (cpu.system - cpu_started.system),
+        "children_cpu": (cpu.children_user - cpu_started.children_user) + (cpu.children_system - cpu_started.children_system),
+        "peak_fds": peaks["fds"],
+        "peak_threads": peaks["threads"],
+        # ru_maxrss and VmRSS are in kilobytes
+        "baseline_rss_kb": baseline_rss,
+        "peak_rss_kb": max(peaks["rss_kb"], resource.getrusage(resource.RUSAGE_SELF).ru_maxrss),
+    }
+
+
+@logger(_module_name)
+def bench_orchestration(targets:List[int], async_processes:List[int], sleep:float = 0, xml_size:int = 2048,
+                        fail_rate:float = 0.01, lines:int = 2) -> dict:
+    """
+    Scans synthetic targets with nmap.async_nmap and a fake nmap on PATH for each number of targets and parallel processes.
+    Every case runs in a fresh interpreter.
+
+    :param targets: Numbers of targets
+    :param async_processes: Numbers of parallel nmap processes
+    :param sleep: Seconds each fake nmap sleeps
+    :param xml_size: Bytes of padding in each XML result
+    :param fail_rate: Share of the targets, for which the fake nmap fails
+    :param lines: Number of progress lines the fake nmap prints
+    :return: Report with the throughput, the overhead per target, the peak file descriptors, threads and RSS of each case
+    """
+    fail_every = round(1 / fail_rate) if fail_rate else 0
+    report = {"python": sys.version.split()[0], "sleep": sleep, "xml_size": xml_size, "fail_rate": fail_rate, "lines": lines,
+              "cpu_count": os.cpu_count(), "cases": []}
+    # Fresh interpreters instead of forks, so a case doesn't inherit the memory and the threads of this process
+    context = multiprocessing.get_context("spawn")
+
+    with tempfile.TemporaryDirectory(prefix="vsc-bench-bin-") as bin_folder:
+        write_fake_bin(bin_folder)
+        for target_count in targets:
+            for processes in async_processes:
+                with tempfile.TemporaryDirectory(prefix="vsc-bench-scan-") as output_folder, context.Pool(1) as pool:
+                    case = pool.apply(_run_case, (target_count, processes, bin_folder, output_folder + os.sep, sleep, xml_size,
+                                                  fail_every, lines))
+                expected_failed = target_count // fail_every if fail_every else 0
+                elapsed = case["elapsed"]
+                result = {
+                    "targets": target_count,
+                    "async_processes": processes,
+                    "elapsed_s": round(elapsed, 3),
+                    "targets_per_second": round(target_count / elapsed, 1),
+                    # Time of a process slot per target beyond the sleep of the fake nmap
+                    "slot_overhead_ms": round((elapsed * min(processes, target_count) / target_count - sleep) * 1000, 3),
+                    "cpu_per_target_ms": round(case["cpu"] / target_count * 1000, 3),
+                    "children_cpu_per_target_ms": round(case["children_cpu"] / target_count * 1000, 3),
+                    "peak_fds": case["peak_fds"],
+                    "peak_threads": case["peak_threads"],
+                    "baseline_rss_mb": round(case["baseline_rss_kb"] / 1024, 1),
+                    "peak_rss_mb": round(case["peak_rss_kb"] / 1024, 1),
+                    "rss_per_target_kb": round((case["peak_rss_kb"] - case["baseline_rss_kb"]) / target_count, 3),
+                    "finished": case["finished"],
+                    "failed": case["failed"],
+                    "correct": case["failed"] == expected_failed and case["finished"] == target_count - expected_failed,
+                }
+                report["cases"].append(result)
+                vsc_log.info_status_result(_module_name, "MEASURED", f"{target_count} targets with {processes} processes: "
+                                                                     f"{result['targets_per_second']} targets/s, "
+                                                                     f"{result['slot_overhead_ms']}ms slot overhead, "
+                                                                     f"{result['cpu_per_target_ms']}ms CPU per target, "
+                                                                     f"{result['peak_fds']} fds, {result['peak_threads']} threads, "
+                                                                     f"{result['peak_rss_mb']}MB peak RSS")
+    return report
+
+
+@logger(_module_name)
+def main(remaining_args):
+    parser = argparse.ArgumentParser(description="Orchestration benchmark of nmap.async_nmap with a fake nmap binary")
+    parser.add_argument('-n', '--targets', default="10000",
+                        help="Comma-separated list of numbers of targets, e.g. 10000,100000 (default is 10000)")
+    parser.add_argument('-aP', '--async-processes', default="16,64,256",
+                        help="Comma-separated list of numbers of parallel nmap processes (default is 16,64,256)")
+    parser.add_argument('-s', '--sleep', type=float, default=0,
+                        help="Seconds each fake nmap sleeps (default is 0)")
+    parser.add_argument('-x', '--xml-size', type=int, default=2048,
+                        help="Bytes of padding in each XML result (default is 2048)")
+    parser.add_argument('-f', '--fail-rate', type=float, default=0.01,
+                        help="Share of the targets, for which the fake nmap fails (default is 0.01)")
+    parser.add_argument('-l', '--lines', type=int, default=2,
+                        help="Number of progress lines the fake nmap prints (default is 2)")
+    parser.add_argument('-oF', '--output-file', default=None,
+                        help="Path to the JSON report (default is the standard output)")
+    args = parser.parse_args(remaining_args)
+
+    report = bench_orchestration([int(count) for count in args.targets.split(',')], [int(count) for count in args.async_processes.split(',')],
+                                 args.sleep, args.xml_size, args.fail_rate, args.lines)
+    if args.output_file:
+        with open(args.output_file, 'w') as file:
+            json.dump(report, file, indent=2)
+        vsc_log.info_status_result(_module_name, "COMPLETE", f"Report saved to '{args.output_file}'")
+    else:
+        print(json.dumps(report, indent=2))
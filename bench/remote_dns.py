@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import json
+import time
+
+from _log import vsc_log, logger
+from bench.ssh_stand_in import StandInServerSSH
+from domain.dns_stand_in import StandInServerDNS
+from domain.resolve_domain import configure_nameservers
+
+
+_module_name = "bench.remote_dns"
+
+
+async def _resolve_remote(stand_ins:list, nameserver:str, names:list, workers:int, min_shard:int,
+                          kill_after:float | None) -> list:
+    # Imported here, domain.remote_dns imports paramiko through the proxy package
+    from domain.remote_dns import RemoteResolver
+    from proxy import ServerSSH
+
+    # The names of a stopped node are resolved locally, with the same nameserver
+    configure_nameservers([nameserver])
+    servers = [ServerSSH(stand_in.host, stand_in.port, stand_in.username, stand_in.password, local_port=0) for stand_in in stand_ins]
+    for server in servers:
+        await asyncio.to_thread(server.connect)
+    resolver = RemoteResolver(servers, nameserver=nameserver, workers=workers, min_shard=min_shard)
+
+    async def kill_node():
+        await asyncio.sleep(kill_after)
+        vsc_log.info_ip_status_result(_module_name, f"{stand_ins[0].host}:{stand_ins[0].port}", "KILLED", "Node is stopped during the resolution")
+        await asyncio.to_thread(stand_ins[0].stop)
+
+    killer = asyncio.create_task(kill_node()) if kill_after is not None else None
+    results = []
+    try:
+        async for result in resolver.iter_resolve(names):
+            results.append(result)
+    finally:
+        if killer:
+            killer.cancel()
+        await asyncio.to_thread(resolver.close)
+        for server in servers:
+            server.close()
+        configure_nameservers(None)
+    return results
+
+
+@logger(_module_name)
+def bench_remote_dns(names:int = 2000, nodes:int = 3, workers:int = 20, hit_ratio:float = 0.1, delay:float = 0,
+                     min_shard:int = 100, kill_after:float | None = None) -> dict:
+    """
+    Resolves synthetic names with domain.remote_dns.RemoteResolver over local stand-in SSH nodes, whose workers
+    query a stand-in DNS server. The results are compared with the records of the DNS server. One node can be
+    stopped during the resolution, the names it hasn't reported yet have to be resolved locally.
+
+    :param names: Number of names
+    :param nodes: Number of stand-in SSH nodes
+    :param workers: Number of parallel lookups on each node
+    :param hit_ratio: Share of the names with a record
+    :param delay: Seconds before each answer of the DNS server
+    :param min_shard: Minimum number of names in a shard
+    :param kill_after: Seconds after the start, when the first node is stopped, None to keep all nodes
+    :return: Report with the throughput and the correctness of the run
+    """
+    every = round(1 / hit_ratio) if hit_ratio else 0
+    all_names = [f"name{index}.bench.test" for index in range(names)]
+    records = {name: f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}" for index, name in enumerate(all_names)
+               if every and index % every == 0}
+    with StandInServerDNS(records, delay=delay) as dns_server:
+        stand_ins = [StandInServerSSH().start() for _ in range(nodes)]
+        try:
+            started = time.perf_counter()
+            results = asyncio.run(_resolve_remote(stand_ins, dns_server.nameserver, all_names, workers, min_shard, kill_after))
+            elapsed = time.perf_counter() - started
+        finally:
+            for stand_in in stand_ins:
+                stand_in.stop()
+        expected = {name: dns_server.lookup(name) for name in all_names if dns_server.lookup(name)}
+
+    resolved = dict(results)
+    report = {
+        "names": names,
+        "nodes": nodes,
+        "workers": workers,
+        "kill_after": kill_after,
+        "elapsed_s": round(elapsed, 3),
+        "names_per_second": round(names / elapsed, 1),
+        "resolved": len(resolved),
+        "expected": len(expected),
+        "duplicates": len(results) - len(resolved),
+        "correct": resolved == expected,
+    }
+    vsc_log.info_status_result(_module_name, "MEASURED", f"{names} names on {nodes} nodes: {report['names_per_second']} names/s, "
+                                                         f"{report['resolved']} of {report['expected']} resolved, "
+                                                         f"{'correct' if report['correct'] else 'INCORRECT'}")
+    return report
+
+
+@logger(_module_name)
+def main(remaining_args):
+    parser = argparse.ArgumentParser(description="Remote brute-force resolution over local stand-in SSH nodes and a stand-in DNS server")
+    parser.add_argument('-n', '--names', type=int, default=2000,
+                        help="Number of names (default is 2000)")
+    parser.add_argument('-N', '--nodes', type=int, default=3,
+                        help="Number of stand-in SSH nodes (default is 3)")
+    parser.add_argument('-w', '--workers', type=int, default=20,
+                        help="Number of parallel lookups on each node (default is 20)")
+    parser.add_argument('-hR', '--hit-ratio', type=float, default=0.1,
+                        help="Share of the names with a record (default is 0.1)")
+    parser.add_argument('-d', '--delay', type=float, default=0,
+                        help="Seconds before each answer of the DNS server (default is 0)")
+    parser.add_argument('-mS', '--min-shard', type=int, default=100,
+                        help="Minimum number of names in a shard (default is 100)")
+    parser.add_argument('-k', '--kill-after', type=float, default=-1,
+                        help="Seconds after the start, when the first node is stopped, negative to keep all nodes (default is -1)")
+    parser.add_argument('-oF', '--output-file', default=None,
+                        help="Path to the JSON report (default is the standard output)")
+    args = parser.parse_args(remaining_args)
+
+    report = bench_remote_dns(args.names, args.nodes, args.workers, args.hit_ratio, args.delay, args.min_shard,
+                              args.kill_after if args.kill_after >= 0 else None)
+    if args.output_file:
+        with open(args.output_file, 'w') as file:
+            json.dump(report, file, indent=2)
+        vsc_log.info_status_result(_module_name, "COMPLETE", f"Report saved to '{args.output_file}'")
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,71 @@
+import os
+import threading
+
+
+BENCH_SAMPLE_INTERVAL = 0.05
+
+
+class ResourceSampler:
+    """
+    Samples the open file descriptors, the threads and the RSS (in kilobytes) of this process in a thread,
+    the last values and the peaks since the last reset() are kept. Linux only, it reads /proc/self.
+    """
+    def __init__(self, interval:float = BENCH_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.fds = self.threads = self.rss = 0
+        self.peak_fds = self.peak_threads = self.peak_rss = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def sample(self) -> dict:
+        """
+        :return: Current file descriptors, threads and RSS
+        """
+        fds = len(os.listdir("/proc/self/fd"))
+        threads = rss = 0
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("Threads:"):
+                    threads = int(line.split()[1])
+                elif line.startswith("VmRSS:"):
+                    rss = int(line.split()[1])
+        with self._lock:
+            self.fds, self.threads, self.rss = fds, threads, rss
+            self.peak_fds = max(self.peak_fds, fds)
+            self.peak_threads = max(self.peak_threads, threads)
+            self.peak_rss = max(self.peak_rss, rss)
+        return {"fds": fds, "threads": threads, "rss_kb": rss}
+
+    def reset(self):
+        """Starts the peaks from the current values."""
+        with self._lock:
+            self.peak_fds = self.peak_threads = self.peak_rss = 0
+        self.sample()
+
+    def peaks(self) -> dict:
+        with self._lock:
+            return {"fds": self.peak_fds, "threads": self.peak_threads, "rss_kb": self.peak_rss}
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def start(self) -> 'ResourceSampler':
+        self.sample()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="bench-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        self.sample()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
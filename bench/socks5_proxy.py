@@ -0,0 +1,402 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import time
+from typing import List
+
+from _conf import PROXY_BUFFER_SIZE, PROXY_POOL_SIZE
+from _log import vsc_log, logger
+from bench.resources import ResourceSampler
+from bench.ssh_stand_in import StandInServerSSH
+from proxy.egress import socks5_request, socks5_reply_length
+
+
+_module_name = "bench.socks5_proxy"
+
+BENCH_PROXY_HOST = "127.0.0.1"
+
+# Payload of each round trip of the connect and the latency phases
+BENCH_PROXY_CONNECT_PAYLOAD = 16
+
+BENCH_PROXY_MESSAGE_SIZE = 64
+
+# Seconds the parent waits for an answer of the proxy process
+BENCH_PROXY_CONTROL_TIMEOUT = 60
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((BENCH_PROXY_HOST, 0))
+        return sock.getsockname()[1]
+
+
+def _quantile(values:List[float], q:float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _ms(seconds:float | None) -> float | None:
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+def _run_proxy(ssh_host:str, ssh_port:int, username:str, password:str, proxy_port:int, control):
+    """
+    Runs the SOCKS5 proxy of ServerSSH in a fresh interpreter, so its threads, file descriptors and RSS are measured
+    without the stand-in server and the load of the parent. It answers the commands of the parent over the pipe:
+    'reset' starts the peaks from the current values, 'peaks' returns them with the proxy stats, 'stop' closes the proxy.
+    """
+    # Imported in the proxy process, after the parent has spawned it
+    from proxy import ServerSSH
+
+    server = ServerSSH(ssh_host, ssh_port, username, password, local_host=BENCH_PROXY_HOST, local_port=proxy_port)
+    server.connect()
+    server.start_proxy()
+    with ResourceSampler() as sampler:
+        control.send({"alive": server.is_alive()})
+        while (command := control.recv()) != "stop":
+            cpu = os.times()
+            if command == "reset":
+                sampler.reset()
+                control.send({**sampler.sample(), "cpu": cpu.user + cpu.system})
+            elif command == "peaks":
+                sampler.sample()
+                control.send({**sampler.peaks(), **server.proxy_stats(), "cpu": cpu.user + cpu.system})
+    server.close()
+
+
+class _Sinks:
+    """
+    Local TCP servers behind the proxy: an echo, a source, that sends the number of bytes in the 8-byte request,
+    and a sink, that reads the number of bytes in the 8-byte header and answers with the number it has received.
+    """
+    def __init__(self):
+        self.ports = {}
+        self._servers = []
+
+    async def start(self) -> '_Sinks':
+        for name, handler in (("echo", self._echo), ("source", self._source), ("sink", self._sink)):
+            server = await asyncio.start_server(handler, BENCH_PROXY_HOST, 0, backlog=1024, limit=PROXY_BUFFER_SIZE)
+            self.ports[name] = server.sockets[0].getsockname()[1]
+            self._servers.append(server)
+        return self
+
+    async def stop(self):
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+
+    @staticmethod
+    async def _echo(reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        try:
+            while data := await reader.read(PROXY_BUFFER_SIZE):
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _source(reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        try:
+            remaining = int.from_bytes(await reader.readexactly(8), "big")
+            chunk = bytes(PROXY_BUFFER_SIZE)
+            while remaining:
+                part = chunk[:min(remaining, len(chunk))]
+                writer.write(part)
+                await writer.drain()
+                remaining -= len(part)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _sink(reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        # The stand-in closes both directions on the first EOF, so the size comes first instead of a half-close
+        try:
+            remaining = int.from_bytes(await reader.readexactly(8), "big")
+            received = 0
+            while received < remaining and (data := await reader.read(PROXY_BUFFER_SIZE)):
+                received += len(data)
+            writer.write(received.to_bytes(8, "big"))
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _open(proxy_port:int, port:int, timeout:float) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """
+    :return: Connection to the local port through the SOCKS5 proxy
+    """
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(BENCH_PROXY_HOST, proxy_port), timeout)
+    try:
+        writer.write(socks5_request(BENCH_PROXY_HOST, port))
+        header = await asyncio.wait_for(reader.readexactly(7), timeout)
+        await asyncio.wait_for(reader.readexactly(socks5_reply_length(header)), timeout)
+    except BaseException:
+        writer.close()
+        raise
+    return reader, writer
+
+
+async def _close(writer:asyncio.StreamWriter):
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except ConnectionError:
+        pass
+
+
+class _Control:
+    """Commands to the proxy process."""
+    def __init__(self, connection):
+        self._connection = connection
+
+    def ask(self, command:str) -> dict:
+        self._connection.send(command)
+        if not self._connection.poll(BENCH_PROXY_CONTROL_TIMEOUT):
+            raise TimeoutError(f"Proxy process didn't answer '{command}'")
+        return self._connection.recv()
+
+    def stop(self):
+        self._connection.send("stop")
+
+
+async def _connect_phase(proxy_port:int, sinks:_Sinks, concurrency:int, duration:float, timeout:float) -> dict:
+    """
+    Each worker opens a connection to the echo, does one round trip and closes it, until the duration is over.
+    """
+    payload = bytes(BENCH_PROXY_CONNECT_PAYLOAD)
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                reader, writer = await _open(proxy_port, sinks.ports["echo"], timeout)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                errors += 1
+                continue
+            connected = time.perf_counter()
+            try:
+                writer.write(payload)
+                await asyncio.wait_for(reader.readexactly(len(payload)), timeout)
+                latencies.append(connected - started)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                errors += 1
+            finally:
+                await _close(writer)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "connections": len(latencies),
+        "errors": errors,
+        "connections_per_second": round(len(latencies) / elapsed, 1),
+        "connect_p50_ms": _ms(_quantile(latencies, 0.5)),
+        "connect_p99_ms": _ms(_quantile(latencies, 0.99)),
+    }
+
+
+async def _latency_phase(proxy_port:int, sinks:_Sinks, control:_Control, concurrency:int, duration:float, timeout:float) -> dict:
+    """
+    Holds the connections open and sends small messages to the echo over each of them, one at a time,
+    the resources of the proxy process with all connections open give the cost of a connection.
+    """
+    idle = control.ask("reset")
+    connections = await asyncio.gather(*(_open(proxy_port, sinks.ports["echo"], timeout) for _ in range(concurrency)),
+                                       return_exceptions=True)
+    opened = [connection for connection in connections if not isinstance(connection, BaseException)]
+    message = bytes(BENCH_PROXY_MESSAGE_SIZE)
+    round_trips = []
+    errors = concurrency - len(opened)
+    deadline = time.perf_counter() + duration
+
+    async def ping_pong(reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        nonlocal errors
+        try:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                writer.write(message)
+                await asyncio.wait_for(reader.readexactly(len(message)), timeout)
+                round_trips.append(time.perf_counter() - started)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            errors += 1
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(ping_pong(reader, writer) for reader, writer in opened))
+        elapsed = time.perf_counter() - started
+        # Asked while the connections are still open
+        peaks = control.ask("peaks")
+    finally:
+        await asyncio.gather(*(_close(writer) for _, writer in opened))
+    per_connection = max(1, len(opened))
+    return {
+        "messages": len(round_trips),
+        "errors": errors,
+        "messages_per_second": round(len(round_trips) / elapsed, 1),
+        "rtt_p50_ms": _ms(_quantile(round_trips, 0.5)),
+        "rtt_p99_ms": _ms(_quantile(round_trips, 0.99)),
+        "rtt_max_ms": _ms(max(round_trips, default=None)),
+        "proxy_cpu_per_message_us": round((peaks["cpu"] - idle["cpu"]) / max(1, len(round_trips)) * 1_000_000, 3),
+        "idle_threads": idle["threads"],
+        "peak_threads": peaks["threads"],
+        "peak_fds": peaks["fds"],
+        "peak_rss_mb": round(peaks["rss_kb"] / 1024, 1),
+        "threads_per_connection": round((peaks["threads"] - idle["threads"]) / per_connection, 3),
+        "fds_per_connection": round((peaks["fds"] - idle["fds"]) / per_connection, 3),
+        "rss_per_connection_kb": round((peaks["rss_kb"] - idle["rss_kb"]) / per_connection, 3),
+    }
+
+
+async def _bulk_phase(proxy_port:int, sinks:_Sinks, control:_Control, concurrency:int, bulk_bytes:int, timeout:float) -> dict:
+    """
+    Downloads from the source and uploads to the sink the bulk bytes, split over the connections.
+    """
+    size = max(1, bulk_bytes // concurrency)
+    chunk = bytes(PROXY_BUFFER_SIZE)
+
+    async def download() -> int:
+        reader, writer = await _open(proxy_port, sinks.ports["source"], timeout)
+        try:
+            writer.write(size.to_bytes(8, "big"))
+            received = 0
+            while data := await asyncio.wait_for(reader.read(PROXY_BUFFER_SIZE), timeout):
+                received += len(data)
+            return received
+        finally:
+            await _close(writer)
+
+    async def upload() -> int:
+        reader, writer = await _open(proxy_port, sinks.ports["sink"], timeout)
+        try:
+            writer.write(size.to_bytes(8, "big"))
+            remaining = size
+            while remaining:
+                part = chunk[:min(remaining, len(chunk))]
+                writer.write(part)
+                await writer.drain()
+                remaining -= len(part)
+            return int.from_bytes(await asyncio.wait_for(reader.readexactly(8), timeout), "big")
+        finally:
+            await _close(writer)
+
+    result = {"bytes_per_connection": size}
+    for name, transfer in (("download", download), ("upload", upload)):
+        before = control.ask("reset")
+        started = time.perf_counter()
+        transferred = await asyncio.gather(*(transfer() for _ in range(concurrency)), return_exceptions=True)
+        elapsed = time.perf_counter() - started
+        after = control.ask("peaks")
+        done = sum(count for count in transferred if isinstance(count, int))
+        result[name] = {
+            "elapsed_s": round(elapsed, 3),
+            "mb_per_second": round(done / elapsed / 1024 / 1024, 2),
+            "proxy_cpu_per_mb_ms": round((after["cpu"] - before["cpu"]) / max(1, done) * 1024 * 1024 * 1000, 3),
+            "errors": sum(1 for count in transferred if not isinstance(count, int)),
+            "correct": done == size * concurrency,
+        }
+    return result
+
+
+async def _run_cases(proxy_port:int, control:_Control, concurrency:List[int], duration:float, bulk_bytes:int,
+                     timeout:float) -> List[dict]:
+    sinks = await _Sinks().start()
+    cases = []
+    try:
+        for connections in concurrency:
+            case = {
+                "concurrency": connections,
+                "connect": await _connect_phase(proxy_port, sinks, connections, duration, timeout),
+                "latency": await _latency_phase(proxy_port, sinks, control, connections, duration, timeout),
+                "bulk": await _bulk_phase(proxy_port, sinks, control, connections, bulk_bytes, timeout),
+            }
+            cases.append(case)
+            vsc_log.info_status_result(_module_name, "MEASURED", f"{connections} connections: "
+                                                                 f"{case['connect']['connections_per_second']} conn/s, "
+                                                                 f"RTT p50 {case['latency']['rtt_p50_ms']}ms p99 {case['latency']['rtt_p99_ms']}ms, "
+                                                                 f"{case['bulk']['download']['mb_per_second']}MB/s down, "
+                                                                 f"{case['bulk']['upload']['mb_per_second']}MB/s up, "
+                                                                 f"{case['latency']['threads_per_connection']} threads and "
+                                                                 f"{case['latency']['rss_per_connection_kb']}KB per connection")
+    finally:
+        await sinks.stop()
+    return cases
+
+
+@logger(_module_name)
+def bench_proxy(concurrency:List[int], duration:float = 5, bulk_bytes:int = 64 * 1024 * 1024, timeout:float = 10) -> dict:
+    """
+    Pushes SOCKS5 connections through ServerSSH.start_proxy() and a local stand-in SSH server to local TCP sinks
+    for each number of concurrent connections. The proxy runs in a fresh interpreter, the stand-in, the sinks and
+    the clients run in this process.
+
+    :param concurrency: Numbers of concurrent connections
+    :param duration: Seconds of the connect and of the latency phase
+    :param bulk_bytes: Bytes downloaded and uploaded in the bulk phase, split over the connections
+    :param timeout: Timeout in seconds of each step of a connection
+    :return: Report with the connections per second, the round trip latencies under load, the bulk throughput and
+             the threads, file descriptors and RSS of the proxy per connection
+    """
+    report = {"python": sys.version.split()[0], "duration": duration, "bulk_bytes": bulk_bytes, "timeout": timeout,
+              "pool_size": PROXY_POOL_SIZE, "buffer_size": PROXY_BUFFER_SIZE, "cpu_count": os.cpu_count(), "cases": []}
+    # Fresh interpreter instead of a fork, so the proxy doesn't inherit the memory and the threads of this process
+    context = multiprocessing.get_context("spawn")
+    proxy_port = _free_port()
+
+    with StandInServerSSH(host=BENCH_PROXY_HOST) as stand_in:
+        parent_connection, child_connection = context.Pipe()
+        process = context.Process(target=_run_proxy, args=(stand_in.host, stand_in.port, stand_in.username, stand_in.password,
+                                                            proxy_port, child_connection), daemon=True)
+        process.start()
+        control = _Control(parent_connection)
+        try:
+            if not parent_connection.poll(BENCH_PROXY_CONTROL_TIMEOUT) or not parent_connection.recv()["alive"]:
+                raise ConnectionError(f"SOCKS5 proxy through {stand_in.host}:{stand_in.port} didn't start")
+            report["cases"] = asyncio.run(_run_cases(proxy_port, control, concurrency, duration, bulk_bytes, timeout))
+        finally:
+            if process.is_alive():
+                control.stop()
+            process.join(BENCH_PROXY_CONTROL_TIMEOUT)
+            if process.is_alive():
+                process.kill()
+    return report
+
+
+@logger(_module_name)
+def main(remaining_args):
+    parser = argparse.ArgumentParser(description="Throughput benchmark of the SOCKS5 proxy of ServerSSH with a local stand-in SSH server")
+    parser.add_argument('-c', '--concurrency', default="1,16,128",
+                        help="Comma-separated list of numbers of concurrent connections (default is 1,16,128)")
+    parser.add_argument('-d', '--duration', type=float, default=5,
+                        help="Seconds of the connect and of the latency phase of each case (default is 5)")
+    parser.add_argument('-b', '--bulk-mb', type=float, default=64,
+                        help="Megabytes downloaded and uploaded in the bulk phase, split over the connections (default is 64)")
+    parser.add_argument('-t', '--timeout', type=float, default=10,
+                        help="Timeout in seconds of each step of a connection (default is 10)")
+    parser.add_argument('-oF', '--output-file', default=None,
+                        help="Path to the JSON report (default is the standard output)")
+    args = parser.parse_args(remaining_args)
+
+    report = bench_proxy([int(count) for count in args.concurrency.split(',')], args.duration, int(args.bulk_mb * 1024 * 1024),
+                         args.timeout)
+    if args.output_file:
+        with open(args.output_file, 'w') as file:
+            json.dump(report, file, indent=2)
+        vsc_log.info_status_result(_module_name, "COMPLETE", f"Report saved to '{args.output_file}'")
+    else:
+        print(json.dumps(report, indent=2))
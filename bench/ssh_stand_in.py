@@ -0,0 +1,303 @@
+import os
+import selectors
+import socket
+import subprocess
+import threading
+
+import paramiko
+
+from _log import vsc_log
+
+
+_module_name = "bench.ssh_stand_in"
+
+
+class _StandInSFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        try:
+            paramiko.SFTPServer.set_file_attr(self.filename, attr)
+            return paramiko.SFTP_OK
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+
+class _StandInSFTPServer(paramiko.SFTPServerInterface):
+    """SFTP subsystem, that maps remote paths onto the local filesystem below the root of the stand-in."""
+    def __init__(self, server, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self._root = server.root
+
+    def _real_path(self, path):
+        return os.path.join(self._root, os.path.normpath(f"/{path}").lstrip("/"))
+
+    def list_folder(self, path):
+        path = self._real_path(path)
+        try:
+            return [paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(path, name)), name)
+                    for name in os.listdir(path)]
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._real_path(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def lstat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.lstat(self._real_path(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def open(self, path, flags, attr):
+        path = self._real_path(path)
+        try:
+            mode = getattr(attr, "st_mode", None)
+            fd = os.open(path, flags, mode if mode is not None else 0o666)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            file_mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            file_mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            file_mode = "rb"
+        handle = _StandInSFTPHandle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = os.fdopen(fd, file_mode)
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self._real_path(path))
+            return paramiko.SFTP_OK
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def rename(self, oldpath, newpath):
+        try:
+            os.rename(self._real_path(oldpath), self._real_path(newpath))
+            return paramiko.SFTP_OK
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def posix_rename(self, oldpath, newpath):
+        try:
+            os.replace(self._real_path(oldpath), self._real_path(newpath))
+            return paramiko.SFTP_OK
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self._real_path(path))
+            return paramiko.SFTP_OK
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(self._real_path(path))
+            return paramiko.SFTP_OK
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, path, attr):
+        try:
+            paramiko.SFTPServer.set_file_attr(self._real_path(path), attr)
+            return paramiko.SFTP_OK
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+
+class _StandInInterface(paramiko.ServerInterface):
+    def __init__(self, stand_in:'StandInServerSSH'):
+        self.root = stand_in.root
+        self._stand_in = stand_in
+        self.direct_destinations = {}
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if username == self._stand_in.username and password == self._stand_in.password:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        self.direct_destinations[chanid] = destination
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=_run_command, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+    def check_global_request(self, kind, msg):
+        return True
+
+
+def _run_command(channel:paramiko.Channel, command:str):
+    """Runs the command with the local shell and streams its output and exit status back to the channel."""
+    process = subprocess.Popen(command, shell=True, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def pump(stream, send):
+        for chunk in iter(lambda: stream.read1(65536), b""):
+            send(chunk)
+
+    stderr_thread = threading.Thread(target=pump, args=(process.stderr, channel.sendall_stderr), daemon=True)
+    stderr_thread.start()
+    try:
+        pump(process.stdout, channel.sendall)
+        stderr_thread.join()
+        channel.send_exit_status(process.wait())
+        # EOF instead of close: a fast command could otherwise close the channel before the exec request is confirmed
+        channel.shutdown_write()
+    except (OSError, EOFError, paramiko.SSHException):
+        process.kill()
+        channel.close()
+
+
+def _relay(channel:paramiko.Channel, destination:tuple[str, int]):
+    try:
+        sock = socket.create_connection(destination)
+    except OSError:
+        channel.close()
+        return
+    # A selector instead of select(), the descriptors of a busy stand-in go beyond FD_SETSIZE
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+    selector.register(channel, selectors.EVENT_READ)
+    try:
+        while True:
+            readable = {key.fileobj for key, _ in selector.select()}
+            if sock in readable:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                channel.sendall(data)
+            if channel in readable:
+                data = channel.recv(65536)
+                if not data:
+                    break
+                sock.sendall(data)
+    except (OSError, EOFError, paramiko.SSHException):
+        pass
+    finally:
+        selector.close()
+        sock.close()
+        channel.close()
+
+
+class StandInServerSSH:
+    """
+    Local paramiko-based SSH server, that stands in for a fleet node in tests and benchmarks.
+
+    It accepts password authentication, runs 'exec' commands with the local shell, serves SFTP from the local
+    filesystem below `root` and forwards 'direct-tcpip' channels, so ServerSSH can use it as a real server.
+    """
+    def __init__(self, host:str = "127.0.0.1", port:int = 0, username:str = "vulnscan", password:str = "vulnscan", root:str = "/"):
+        """
+        :param host: Listening address
+        :param port: Listening port, 0 for a random free port
+        :param username: Accepted username
+        :param password: Accepted password
+        :param root: Local folder, that is the root of the SFTP filesystem
+        """
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.root = root
+
+        self._host_key = paramiko.RSAKey.generate(2048)
+        self._server_sock = None
+        self._accept_thread = None
+        self._transports = set()
+        self._stopped = threading.Event()
+
+    def start(self) -> 'StandInServerSSH':
+        self._server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server_sock.bind((self.host, self.port))
+        self._server_sock.listen(128)
+        self.port = self._server_sock.getsockname()[1]
+        self._stopped.clear()
+        self._accept_thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self._accept_thread.start()
+        vsc_log.info_ip_status_result(_module_name, f"{self.host}:{self.port}", "START", "Stand-in SSH server is listening")
+        return self
+
+    def stop(self):
+        """Stops listening and drops all sessions, so clients see the node as dead."""
+        self._stopped.set()
+        if self._server_sock:
+            try:
+                # Shutdown wakes up the blocked accept()
+                self._server_sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._server_sock.close()
+        for transport in list(self._transports):
+            transport.close()
+        self._transports.clear()
+        if self._accept_thread:
+            self._accept_thread.join()
+        vsc_log.info_ip_status_result(_module_name, f"{self.host}:{self.port}", "STOP", "Stand-in SSH server is stopped")
+
+    def server_config(self) -> dict:
+        """
+        :return: Server entry in the format of the 'servers' list of the proxy JSON file
+        """
+        return {"host": self.host, "port": self.port, "user": self.username, "password": self.password, "protocol": ["ssh"]}
+
+    def _accept_loop(self):
+        while not self._stopped.is_set():
+            try:
+                client_sock, _ = self._server_sock.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._serve, args=(client_sock,), daemon=True).start()
+
+    def _serve(self, client_sock:socket.socket):
+        transport = paramiko.Transport(client_sock)
+        transport.add_server_key(self._host_key)
+        transport.set_subsystem_handler("sftp", paramiko.SFTPServer, _StandInSFTPServer)
+        interface = _StandInInterface(self)
+        self._transports.add(transport)
+        try:
+            transport.start_server(server=interface)
+            # The transport keeps only weak references, accepted session channels must be held until they are closed
+            sessions = set()
+            while transport.is_active() and not self._stopped.is_set():
+                channel = transport.accept(1)
+                sessions = {session for session in sessions if not session.closed}
+                if channel is None:
+                    continue
+                destination = interface.direct_destinations.pop(channel.get_id(), None)
+                if destination:
+                    threading.Thread(target=_relay, args=(channel, destination), daemon=True).start()
+                else:
+                    sessions.add(channel)
+        except (OSError, EOFError, paramiko.SSHException):
+            pass
+        finally:
+            self._transports.discard(transport)
+            transport.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
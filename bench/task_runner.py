@@ -0,0 +1,162 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import threading
+import time
+from typing import List
+
+from _log import vsc_log, logger
+from _utils import iter_bounded, run_bounded
+
+
+_module_name = "bench.task_runner"
+
+
+async def _sleep(delay:float) -> float:
+    await asyncio.sleep(delay)
+    return delay
+
+
+async def _early_close(delay:float, workers:int, queue_size:int | None) -> bool:
+    # The break leaves the workers blocked on a full outbox and the producer on a full inbox
+    async with contextlib.aclosing(iter_bounded(_sleep, (delay for _ in range(100000)), workers, queue_size)) as results:
+        async for _ in results:
+            break
+    return True
+
+
+async def _cancel(delay:float, workers:int, queue_size:int | None) -> bool:
+    try:
+        await asyncio.wait_for(run_bounded(_sleep, (delay for _ in range(100000)), workers, queue_size), delay * 3)
+    except asyncio.TimeoutError:
+        return True
+    return False
+
+
+async def _items_error(delay:float, workers:int, queue_size:int | None) -> bool:
+    def items():
+        yield from (delay for _ in range(workers * 4))
+        raise ValueError("Items iterator failed")
+
+    try:
+        await run_bounded(_sleep, items(), workers, queue_size)
+    except ValueError:
+        return True
+    return False
+
+
+async def _stubborn(value:float) -> float:
+    # Returns a result instead of the cancellation, as asyncio.wait_for() does when its future finishes at the same time
+    try:
+        await asyncio.sleep(value)
+    except asyncio.CancelledError:
+        pass
+    return value
+
+
+async def _swallowed_cancel(delay:float, workers:int, queue_size:int | None) -> bool:
+    async with contextlib.aclosing(iter_bounded(_stubborn, (delay for _ in range(100000)), workers, queue_size)) as results:
+        async for _ in results:
+            break
+    return True
+
+
+async def _nested_cancel(delay:float, workers:int, queue_size:int | None) -> bool:
+    async def inner(value:float) -> int:
+        # The outer runner cancels its workers again, while they still clean up the inner runner after stubborn calls
+        results = await run_bounded(_stubborn, (value * 1000 for _ in range(8)), 2, queue_size)
+        return len(results)
+
+    try:
+        await asyncio.wait_for(run_bounded(inner, (delay for _ in range(workers * 4)), workers, queue_size), delay * 3)
+    except asyncio.TimeoutError:
+        return True
+    return False
+
+
+BENCH_TASK_RUNNER_CHECKS = {"early_close": _early_close, "cancel": _cancel, "items_error": _items_error,
+                            "swallowed_cancel": _swallowed_cancel, "nested_cancel": _nested_cancel}
+
+
+def _run_check(check:str, delay:float, workers:int, queue_size:int | None, timeout:float) -> dict:
+    """
+    Runs the check in the event loop of a daemon thread, so a deadlocked runner doesn't hold up the report or the exit.
+    """
+    outcome = {}
+
+    async def run_alone() -> bool:
+        passed = await BENCH_TASK_RUNNER_CHECKS[check](delay, workers, queue_size)
+        # Workers left behind by the runner would be cancelled by asyncio.run() and may never end
+        return passed and asyncio.all_tasks() == {asyncio.current_task()}
+
+    def run():
+        outcome["passed"] = asyncio.run(run_alone())
+
+    started = time.perf_counter()
+    thread = threading.Thread(target=run, name=f"check-{check}", daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return {"check": check, "workers": workers, "queue_size": queue_size, "elapsed_s": round(time.perf_counter() - started, 3),
+            "correct": outcome.get("passed", False)}
+
+
+async def _throughput(items:int, delay:float, workers:int) -> dict:
+    started = time.perf_counter()
+    results = await run_bounded(_sleep, [delay] * items, workers)
+    elapsed = time.perf_counter() - started
+    return {"workers": workers, "items": items, "elapsed_s": round(elapsed, 3), "items_per_second": round(items / elapsed, 1),
+            "correct": len(results) == items and [result.index for result in results] == list(range(items))}
+
+
+@logger(_module_name)
+def bench_task_runner(workers:List[int], items:int = 10000, delay:float = 0.001, timeout:float = 5) -> dict:
+    """
+    Measures the throughput of _utils.run_bounded() and checks, that closing the iterator early, cancelling it (also
+    a runner inside the calls of another one), an error of the items iterator and calls, that swallow the cancellation,
+    end the run in time without leaving tasks behind, with full and with small queues.
+
+    :param workers: Numbers of workers
+    :param items: Number of items of the throughput runs
+    :param delay: Seconds each call sleeps
+    :param timeout: Seconds, after which a check counts as a deadlock
+    :return: Report with the items per second of each number of workers and the result of each check
+    """
+    report = {"items": items, "delay": delay, "throughput": [], "checks": []}
+    for count in workers:
+        result = asyncio.run(_throughput(items, delay, count))
+        report["throughput"].append(result)
+        vsc_log.info_status_result(_module_name, "MEASURED", f"{count} workers: {result['items_per_second']} items/s, "
+                                                             f"{'correct' if result['correct'] else 'INCORRECT'}")
+        for check in BENCH_TASK_RUNNER_CHECKS:
+            for queue_size in (1, None):
+                result = _run_check(check, delay, count, queue_size, timeout)
+                report["checks"].append(result)
+                vsc_log.info_status_result(_module_name, "CHECKED", f"{check} with {count} workers and queue size {queue_size}: "
+                                                                    f"{result['elapsed_s']}s, {'correct' if result['correct'] else 'FAILED'}")
+    report["correct"] = all(result["correct"] for result in report["throughput"] + report["checks"])
+    return report
+
+
+@logger(_module_name)
+def main(remaining_args):
+    parser = argparse.ArgumentParser(description="Throughput and cancellation checks of the bounded task runner")
+    parser.add_argument('-w', '--workers', default="1,16,256",
+                        help="Comma-separated list of numbers of workers (default is 1,16,256)")
+    parser.add_argument('-n', '--items', type=int, default=10000,
+                        help="Number of items of the throughput runs (default is 10000)")
+    parser.add_argument('-s', '--sleep', type=float, default=0.001,
+                        help="Seconds each call sleeps (default is 0.001)")
+    parser.add_argument('-t', '--timeout', type=float, default=5,
+                        help="Seconds, after which a check counts as a deadlock (default is 5)")
+    parser.add_argument('-oF', '--output-file', default=None,
+                        help="Path to the JSON report (default is the standard output)")
+    args = parser.parse_args(remaining_args)
+
+    report = bench_task_runner([int(workers) for workers in args.workers.split(',')], args.items, args.sleep, args.timeout)
+    if args.output_file:
+        with open(args.output_file, 'w') as file:
+            json.dump(report, file, indent=2)
+        vsc_log.info_status_result(_module_name, "COMPLETE", f"Report saved to '{args.output_file}'")
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,63 @@
+import argparse
+import json
+import socket
+import sys
+from typing import Iterator
+
+from _conf import DAEMON_SOCKET, DAEMON_JOB_PRIORITY
+from _log import vsc_log, logger
+
+
+_module_name = "daemon.client"
+
+
+def send_request(request:dict, socket_path:str = DAEMON_SOCKET) -> Iterator[dict]:
+    """
+    Sends the request to the daemon over the Unix socket.
+    :return: Responses of the daemon, as they are received
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(f"{json.dumps(request)}\n".encode())
+        # Nothing else is sent, so the daemon closes the connection after the last response
+        client.shutdown(socket.SHUT_WR)
+        with client.makefile('r') as responses:
+            for line in responses:
+                yield json.loads(line)
+
+
+@logger(_module_name)
+def main(remaining_args):
+    parser = argparse.ArgumentParser(description="Client of the daemon: submits the jobs and prints their streamed results as JSON lines")
+    parser.add_argument('action', choices=("resolve", "nmap", "status", "cancel", "stats"),
+                        help="Submit a resolve or nmap job, show the status of the jobs, cancel a job or show the cache statistics")
+    parser.add_argument('-t', '--targets', default=None,
+                        help="Comma-separated list of domains (resolve) or IPs and domains (nmap), no spaces")
+    parser.add_argument('-id', '--job-id', default=None,
+                        help="Job of the status and cancel actions")
+    parser.add_argument('-p', '--priority', type=int, default=DAEMON_JOB_PRIORITY,
+                        help=f"Priority of the job, a lower value runs first (default is {DAEMON_JOB_PRIORITY})")
+    parser.add_argument('-jP', '--params', default="{}",
+                        help="Additional parameters of the job as JSON, e.g. '{\"level\": 1}' or '{\"nmap_params\": \"-sV\"}'")
+    parser.add_argument('-nW', '--no-wait', action='store_true',
+                        help="Return after the job is accepted instead of streaming its results")
+    parser.add_argument('-s', '--socket', default=DAEMON_SOCKET,
+                        help=f"Path to the Unix socket of the daemon (default is '{DAEMON_SOCKET}')")
+
+    args = parser.parse_args(remaining_args)
+
+    if args.action in ("resolve", "nmap"):
+        if not args.targets:
+            parser.error(f"the {args.action} action requires -t/--targets")
+        params = json.loads(args.params)
+        params["domains" if args.action == "resolve" else "targets"] = args.targets.split(',')
+        request = {"action": "submit", "type": args.action, "params": params, "priority": args.priority, "stream": not args.no_wait}
+    else:
+        request = {"action": args.action, "id": args.job_id}
+
+    try:
+        for response in send_request(request, args.socket):
+            print(json.dumps(response), flush=True)
+    except (FileNotFoundError, ConnectionRefusedError) as e:
+        vsc_log.error_status_result(_module_name, "ERROR", f"The daemon is not running on '{args.socket}': {e}")
+        sys.exit(1)
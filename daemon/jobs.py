@@ -0,0 +1,291 @@
+import asyncio
+import itertools
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncIterator, List
+
+from _conf import NMAP_OUTPUT_FOLDER, NMAP_PARAMS, BRUTEFORCE_LEVEL, BRUTEFORCE_ASYNC_PROCESSES, BRUTEFORCE_DNS_WORKERS, DAEMON_MAX_JOBS, \
+    DAEMON_NMAP_PROCESSES, DAEMON_JOB_PRIORITY, DAEMON_FINISHED_JOBS, DAEMON_RESOLVE_TIMEOUT, DAEMON_NMAP_OPTIONS, ensure_dir
+from _log import vsc_log, logger
+from _utils import get_filtered_list, iter_bounded
+from domain import resolve_ips, limited_resolve_ips
+from nmap.async_nmap import _scan_ip
+from nmap.nmap_xml import iter_hosts, service_banner
+
+
+_module_name = "daemon.jobs"
+
+# States of a job, the last three are final
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+
+# Value of an allowed nmap option: ports, numbers, timings and script names or categories, but no paths
+_NMAP_VALUE = re.compile(r"^[\w,:\-]+$")
+
+
+class Job:
+    """
+    Job of the daemon. Its events are kept, so a client, that subscribes late, still receives all results.
+    """
+    def __init__(self, kind:str, params:dict, priority:int):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params
+        self.priority = priority
+        self.state = "queued"
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.events = []
+        self.task = None
+        self._subscribers = set()
+
+    @property
+    def is_final(self) -> bool:
+        return self.state in ("done", "failed", "cancelled")
+
+    def emit(self, event:dict):
+        event = {"job": self.id, **event}
+        self.events.append(event)
+        for subscriber in self._subscribers:
+            subscriber.put_nowait(event)
+
+    def finish(self, state:str, error:str = None):
+        self.state = state
+        self.error = error
+        self.finished = time.time()
+        self.emit({"event": "finished", "state": state, "error": error})
+
+    async def stream(self) -> AsyncIterator[dict]:
+        """
+        :return: All events of the job up to the 'finished' event
+        """
+        subscriber = asyncio.Queue()
+        for event in self.events:
+            subscriber.put_nowait(event)
+        self._subscribers.add(subscriber)
+        try:
+            while True:
+                event = await subscriber.get()
+                yield event
+                if event["event"] == "finished":
+                    return
+        finally:
+            self._subscribers.discard(subscriber)
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "type": self.kind, "priority": self.priority, "state": self.state, "error": self.error,
+                "created": self.created, "started": self.started, "finished": self.finished,
+                "results": sum(event["event"] == "result" for event in self.events)}
+
+
+@logger(_module_name)
+async def _run_resolve(job:Job, manager:'JobManager'):
+    """
+    Params: 'domains', optional 'level', 'brute_force_file', 'dns_workers', 'concurrency' and 'timeout' (per domain,
+    DAEMON_RESOLVE_TIMEOUT by default). Emits a result with the found IPs of each domain.
+    """
+    params = job.params
+    domains = get_filtered_list(params["domains"])
+
+    async def resolve(domain:str) -> List[str]:
+        return await resolve_ips(domain, None, level=params.get("level", BRUTEFORCE_LEVEL), brute_force_file=params.get("brute_force_file"),
+                                 timeout=params.get("timeout", DAEMON_RESOLVE_TIMEOUT),
+                                 dns_workers=params.get("dns_workers", BRUTEFORCE_DNS_WORKERS))
+
+    async for task in iter_bounded(resolve, domains, params.get("concurrency", BRUTEFORCE_ASYNC_PROCESSES)):
+        job.emit({"event": "result", "domain": task.item, "ips": task.result or [],
+                  "error": str(task.error) if task.error else None})
+
+
+@logger(_module_name)
+async def _run_nmap(job:Job, manager:'JobManager'):
+    """
+    Params: 'targets' (IPs or domains), optional 'nmap_params', 'output_folder', 'timeout' (per host), 'concurrency' and
+    'resolve_timeout' (per domain, DAEMON_RESOLVE_TIMEOUT by default). The params are checked by check_params() on submit.
+    The nmap processes of all jobs share the slots of the manager. Emits a result with the hosts and open ports of each IP.
+    """
+    params = job.params
+    targets = get_filtered_list(params["targets"])
+    ips = [target for target in targets if target.replace('.', '').isdigit()]
+    domains = [target for target in targets if target not in ips]
+    if domains:
+        domain_ips = await limited_resolve_ips(domains, max_concurrent=params.get("concurrency", BRUTEFORCE_ASYNC_PROCESSES), output_folder=None,
+                                               domain_timeout=params.get("resolve_timeout", DAEMON_RESOLVE_TIMEOUT))
+        ips.extend(ip for ips_of_domain in domain_ips if ips_of_domain for ip in ips_of_domain)
+    ips = get_filtered_list(ips)
+    output_folder = ensure_dir(params["output_folder"])
+
+    async def scan(ip:str) -> str | None:
+        async with manager.nmap_slots:
+            return await _scan_ip(ip, params["nmap_params"], output_folder, stats_every=None,
+                                  timeout=params.get("timeout"), prefix=f"nmap.daemon_{job.id}_", force=True)
+
+    # Only as many scans as the slots are started, the other IPs wait in the queue of iter_bounded()
+    async for task in iter_bounded(scan, ips, manager.nmap_processes):
+        hosts = []
+        if task.result:
+            hosts = [{"ip": host["ip"], "state": host["state"], "hostnames": host["hostnames"],
+                      "ports": {port: service_banner(data) for port, data in host["ports"].items() if data["state"] == "open"}}
+                     for host in iter_hosts(task.result)]
+        job.emit({"event": "result", "ip": task.item, "file": task.result, "hosts": hosts,
+                  "error": str(task.error) if task.error else None})
+
+
+JOB_TYPES = {
+    "resolve": _run_resolve,
+    "nmap": _run_nmap,
+}
+
+
+def _check_nmap_params(nmap_params:str) -> str:
+    """
+    :raise ValueError: An option, that isn't in DAEMON_NMAP_OPTIONS, or a value with other characters than the ones of _NMAP_VALUE
+    """
+    params = nmap_params.split()
+    while params:
+        param = params.pop(0)
+        option, separator, value = param.partition('=')
+        # A short option with its value, e.g. -p80,443 or -T4
+        if not separator and option not in DAEMON_NMAP_OPTIONS and DAEMON_NMAP_OPTIONS.get(option[:2]):
+            option, separator, value = option[:2], option[2:], option[2:]
+        if option not in DAEMON_NMAP_OPTIONS:
+            raise ValueError(f"nmap option '{option}' is not allowed, expected one of: {', '.join(DAEMON_NMAP_OPTIONS)}")
+        if not DAEMON_NMAP_OPTIONS[option]:
+            if separator:
+                raise ValueError(f"nmap option '{option}' takes no value")
+            continue
+        if not separator:
+            if not params:
+                raise ValueError(f"nmap option '{option}' requires a value")
+            value = params.pop(0)
+        if not _NMAP_VALUE.match(value):
+            raise ValueError(f"Invalid value '{value}' of the nmap option '{option}'")
+    return nmap_params
+
+
+def _check_output_folder(output_folder:str | None) -> str:
+    """
+    :param output_folder: Folder relative to NMAP_OUTPUT_FOLDER or an absolute path under it, None for NMAP_OUTPUT_FOLDER
+    :raise ValueError: The folder is outside NMAP_OUTPUT_FOLDER, symbolic links are resolved
+    """
+    root = os.path.realpath(NMAP_OUTPUT_FOLDER)
+    folder = os.path.realpath(os.path.join(root, str(output_folder or "")))
+    if os.path.commonpath((root, folder)) != root:
+        raise ValueError(f"Output folder '{output_folder}' is outside of '{NMAP_OUTPUT_FOLDER}'")
+    return f"{folder}{os.sep}"
+
+
+def check_params(kind:str, params:dict | None) -> dict:
+    """
+    Checks the params of a job from a client, before it is queued.
+    :return: The params, the ones of an nmap job with the checked nmap_params and the resolved output_folder
+    :raise ValueError: Unknown job type, the params aren't a dict, an nmap option isn't allowed or the output folder is outside the scan folder
+    """
+    if kind not in JOB_TYPES:
+        raise ValueError(f"Unknown job type '{kind}', expected one of: {', '.join(JOB_TYPES)}")
+    params = {} if params is None else params
+    if not isinstance(params, dict):
+        raise ValueError("The params of a job must be a JSON object")
+    if kind == "nmap":
+        params = {**params, "nmap_params": _check_nmap_params(str(params.get("nmap_params", NMAP_PARAMS))),
+                  "output_folder": _check_output_folder(params.get("output_folder"))}
+    return params
+
+
+class JobManager:
+    """
+    Runs the jobs by priority (a lower value runs first, the same priority in the order of submission)
+    with at most max_jobs jobs at a time. Finished jobs are kept for status requests up to a limit.
+    """
+    def __init__(self, max_jobs:int = DAEMON_MAX_JOBS, nmap_processes:int = DAEMON_NMAP_PROCESSES, finished_jobs:int = DAEMON_FINISHED_JOBS):
+        self.max_jobs = max_jobs
+        self.finished_jobs = finished_jobs
+        self.nmap_processes = nmap_processes
+        self.nmap_slots = asyncio.Semaphore(nmap_processes)
+        self._jobs = OrderedDict()
+        self._queue = asyncio.PriorityQueue()
+        self._sequence = itertools.count()
+        self._workers = []
+        self._stopping = False
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_jobs)]
+
+    async def stop(self):
+        """
+        Cancels the queued and running jobs, stops the workers and waits for the cancelled jobs to end.
+        """
+        self._stopping = True
+        running = [job.task for job in self._jobs.values() if job.task and not job.task.done()]
+        for job in list(self._jobs.values()):
+            self.cancel(job.id)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, *running, return_exceptions=True)
+
+    def submit(self, kind:str, params:dict, priority:int = DAEMON_JOB_PRIORITY) -> Job:
+        """
+        :raise ValueError: The job type or its params, see check_params()
+        """
+        job = Job(kind, check_params(kind, params), priority)
+        self._jobs[job.id] = job
+        self._queue.put_nowait((priority, next(self._sequence), job))
+        job.emit({"event": "accepted", "type": kind, "priority": priority, "queued": self._queue.qsize()})
+        vsc_log.info_status_result(_module_name, "ACCEPTED", f"Job {job.id} ({kind}, priority {priority})")
+        self._forget_finished()
+        return job
+
+    def get(self, job_id:str) -> Job | None:
+        return self._jobs.get(job_id)
+
+    def jobs(self) -> List[Job]:
+        return list(self._jobs.values())
+
+    def cancel(self, job_id:str) -> bool:
+        """
+        :return: True, if the job was queued or running
+        """
+        job = self._jobs.get(job_id)
+        if job is None or job.is_final:
+            return False
+        if job.task:
+            job.task.cancel()
+        else:
+            # The worker skips it, when the job comes out of the queue
+            job.finish("cancelled")
+        vsc_log.info_status_result(_module_name, "CANCELLED", f"Job {job.id}")
+        return True
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.is_final]
+        for job_id in finished[:max(0, len(finished) - self.finished_jobs)]:
+            del self._jobs[job_id]
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            if job.is_final:
+                continue
+            job.state = "running"
+            job.started = time.time()
+            job.emit({"event": "started"})
+            job.task = asyncio.create_task(JOB_TYPES[job.kind](job, self))
+            try:
+                await asyncio.shield(job.task)
+                job.finish("done")
+            except asyncio.CancelledError:
+                # The worker itself is stopped, the job may be cancelled by stop() at the same time
+                if self._stopping or not job.task.cancelled():
+                    job.task.cancel()
+                    job.finish("cancelled")
+                    raise
+                job.finish("cancelled")
+            except Exception as e:
+                vsc_log.error_status_result(_module_name, "FAILED", f"Job {job.id}: {e}")
+                job.finish("failed", str(e))
+            else:
+                vsc_log.info_status_result(_module_name, "FINISHED", f"Job {job.id} in {job.finished - job.started:.2f}s")
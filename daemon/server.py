@@ -0,0 +1,249 @@
+import argparse
+import asyncio
+import hmac
+import json
+import os
+import secrets
+import signal
+from typing import AsyncIterator
+
+from _conf import DAEMON_SOCKET, DAEMON_HTTP_HOST, DAEMON_HTTP_PORT, DAEMON_TOKEN_FILE, DAEMON_MAX_JOBS, DAEMON_NMAP_PROCESSES, DAEMON_DNS_THREADS, \
+    DAEMON_JOB_PRIORITY, DAEMON_DNS_CACHE_SIZE, DAEMON_DNS_CACHE_TTL, DAEMON_PASSIVE_CACHE_SIZE, DAEMON_PASSIVE_CACHE_TTL, \
+    DAEMON_WORDLIST_CACHE_SIZE, ensure_dir
+from _log import vsc_log, logger
+from daemon.jobs import JobManager
+from domain.resolve_domain import dns_cache, lookup_executor
+from domain.subdomain import wordlist_cache
+from domain.subdomain_dns_scanner import passive_cache
+
+
+_module_name = "daemon.server"
+
+_HTTP_REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+                 415: "Unsupported Media Type"}
+
+
+async def handle_request(manager:JobManager, request:dict) -> AsyncIterator[dict]:
+    """
+    Handles a request of a client, the same requests are sent over the Unix socket and HTTP.
+    Actions: 'submit' (with 'type', 'params', optional 'priority' and 'stream'), 'status' (optional 'id'), 'cancel' ('id') and 'stats'.
+    :return: Responses, a streamed submit returns all events of the job up to the 'finished' event
+    """
+    if not isinstance(request, dict):
+        yield {"event": "error", "error": "The request must be a JSON object"}
+        return
+    action = request.get("action")
+    if action == "submit":
+        try:
+            job = manager.submit(request.get("type"), request.get("params"), int(request.get("priority", DAEMON_JOB_PRIORITY)))
+        except ValueError as e:
+            yield {"event": "error", "error": str(e)}
+            return
+        if not request.get("stream", True):
+            yield {"event": "accepted", "job": job.id}
+            return
+        async for event in job.stream():
+            yield event
+    elif action == "status":
+        if request.get("id"):
+            job = manager.get(request["id"])
+            yield {"job": job.to_dict()} if job else {"event": "error", "error": f"Unknown job '{request['id']}'"}
+        else:
+            yield {"jobs": [job.to_dict() for job in manager.jobs()]}
+    elif action == "cancel":
+        yield {"id": request.get("id"), "cancelled": manager.cancel(request.get("id"))}
+    elif action == "stats":
+        yield {"dns_cache": dns_cache.stats(), "passive_cache": passive_cache.stats(), "wordlist_cache": wordlist_cache.stats(),
+               "jobs": {state: sum(job.state == state for job in manager.jobs()) for state in ("queued", "running", "done", "failed", "cancelled")}}
+    else:
+        yield {"event": "error", "error": f"Unknown action '{action}'"}
+
+
+async def _serve_socket_client(manager:JobManager, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+    """
+    JSON lines protocol: a request per line, the responses are written as JSON lines.
+    """
+    try:
+        while line := await reader.readline():
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                writer.write(f"{json.dumps({'event': 'error', 'error': f'Invalid JSON: {e}'})}\n".encode())
+                continue
+            async for response in handle_request(manager, request):
+                writer.write(f"{json.dumps(response)}\n".encode())
+                await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+def _http_route(method:str, path:str, body) -> dict | int:
+    """
+    :param body: Decoded JSON body, a submit requires an object
+    :return: Request for handle_request() or an HTTP error code
+    """
+    parts = [part for part in path.split('?')[0].split('/') if part]
+    if parts == ["stats"]:
+        return {"action": "stats"} if method == "GET" else 405
+    if not parts or parts[0] != "jobs" or len(parts) > 2:
+        return 404
+    job_id = parts[1] if len(parts) == 2 else None
+    if method == "POST" and not job_id:
+        return {**body, "action": "submit"} if isinstance(body, dict) else 400
+    if method == "GET":
+        return {"action": "status", "id": job_id}
+    if method == "DELETE" and job_id:
+        return {"action": "cancel", "id": job_id}
+    return 405
+
+
+def _http_check(method:str, headers:dict, body:bytes, token:str, origin:str) -> int | None:
+    """
+    Any page in a browser can send requests to a local port, so a request needs the token of the daemon
+    (Authorization: Bearer <token>), a JSON body and no Origin but the one of the API.
+    :return: HTTP error code of a rejected request, None for an accepted one
+    """
+    scheme, _, client_token = headers.get("authorization", "").partition(' ')
+    if scheme.lower() != "bearer" or not hmac.compare_digest(client_token.strip().encode(), token.encode()):
+        return 401
+    if headers.get("origin", origin) != origin:
+        return 403
+    if (method == "POST" or body) and headers.get("content-type", "").split(';')[0].strip().lower() != "application/json":
+        return 415
+    return None
+
+
+async def _serve_http_client(manager:JobManager, token:str, origin:str, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+    """
+    Minimal HTTP/1.1 API, a request per connection:
+    POST /jobs streams the events of the new job as NDJSON, GET /jobs[/<id>] and GET /stats return the status,
+    DELETE /jobs/<id> cancels the job. The requests are checked by _http_check().
+    """
+    try:
+        method, path, _ = (await reader.readline()).decode().split(' ', 2)
+        headers = {}
+        while (line := (await reader.readline()).decode().strip()):
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+        request = _http_check(method, headers, body, token, origin)
+        if request is None:
+            try:
+                request = _http_route(method, path, json.loads(body) if body else {})
+            except json.JSONDecodeError:
+                request = 400
+        if isinstance(request, int):
+            writer.write(f"HTTP/1.1 {request} {_HTTP_REASONS[request]}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode())
+            return
+        # The length of a streamed response is unknown, its end is the end of the connection
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n")
+        async for response in handle_request(manager, request):
+            writer.write(f"{json.dumps(response)}\n".encode())
+            await writer.drain()
+    except (ConnectionError, ValueError, asyncio.IncompleteReadError) as e:
+        vsc_log.debug_status_result(_module_name, "BADREQUEST", f"HTTP client: {e}")
+    finally:
+        writer.close()
+
+
+def configure_caches(dns_size:int = DAEMON_DNS_CACHE_SIZE, dns_ttl:float = DAEMON_DNS_CACHE_TTL, passive_size:int = DAEMON_PASSIVE_CACHE_SIZE,
+                     passive_ttl:float = DAEMON_PASSIVE_CACHE_TTL, wordlist_size:int = DAEMON_WORDLIST_CACHE_SIZE):
+    """
+    Enables the caches, that are kept warm between the jobs of the daemon.
+    """
+    dns_cache.configure(dns_size, dns_ttl)
+    passive_cache.configure(passive_size, passive_ttl)
+    wordlist_cache.configure(wordlist_size)
+
+
+@logger(_module_name)
+async def serve(socket_path:str = DAEMON_SOCKET, http_host:str = DAEMON_HTTP_HOST, http_port:int = DAEMON_HTTP_PORT,
+                max_jobs:int = DAEMON_MAX_JOBS, nmap_processes:int = DAEMON_NMAP_PROCESSES, dns_threads:int = DAEMON_DNS_THREADS):
+    """
+    Runs the daemon until SIGINT or SIGTERM.
+    :param socket_path: Path to the Unix socket, None to disable it
+    :param http_port: Port of the HTTP API on http_host, None or 0 to disable it. Its token is new for every run
+                      and written to DAEMON_TOKEN_FILE, only the owner can read it
+    """
+    loop = asyncio.get_running_loop()
+    # The threads of the lookups of resolve_domain() are kept for all jobs
+    lookup_executor.configure(dns_threads)
+    manager = JobManager(max_jobs, nmap_processes)
+    manager.start()
+
+    servers = []
+    if socket_path:
+        ensure_dir(os.path.dirname(socket_path))
+        if os.path.exists(socket_path):
+            try:
+                _, writer = await asyncio.open_unix_connection(socket_path)
+                writer.close()
+                raise RuntimeError(f"Another daemon is listening on '{socket_path}'")
+            except ConnectionRefusedError:
+                # A socket file left by a daemon, that was killed
+                os.remove(socket_path)
+        # The socket is created with the owner's permissions only, there is no moment, when others can connect to it
+        umask = os.umask(0o177)
+        try:
+            servers.append(await asyncio.start_unix_server(lambda r, w: _serve_socket_client(manager, r, w), socket_path))
+        finally:
+            os.umask(umask)
+        vsc_log.info_status_result(_module_name, "LISTENING", f"Unix socket '{socket_path}'")
+    if http_port:
+        token = secrets.token_urlsafe(32)
+        ensure_dir(os.path.dirname(DAEMON_TOKEN_FILE))
+        if os.path.exists(DAEMON_TOKEN_FILE):
+            os.remove(DAEMON_TOKEN_FILE)
+        with open(os.open(DAEMON_TOKEN_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w') as token_file:
+            token_file.write(token)
+        origin = f"http://{http_host}:{http_port}"
+        servers.append(await asyncio.start_server(lambda r, w: _serve_http_client(manager, token, origin, r, w), http_host, http_port))
+        vsc_log.info_status_result(_module_name, "LISTENING", f"HTTP API on {origin}/jobs, the token is in '{DAEMON_TOKEN_FILE}'")
+    if not servers:
+        raise ValueError("Neither the Unix socket nor the HTTP port is set")
+
+    stop_event = asyncio.Event()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(stop_signal, stop_event.set)
+    try:
+        await stop_event.wait()
+    finally:
+        vsc_log.info_status_result(_module_name, "STOPPING", "Cancelling the jobs")
+        for server in servers:
+            server.close()
+        await manager.stop()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+        if http_port and os.path.exists(DAEMON_TOKEN_FILE):
+            os.remove(DAEMON_TOKEN_FILE)
+
+
+@logger(_module_name)
+def main(remaining_args):
+    parser = argparse.ArgumentParser(description="Daemon, that runs the resolve and nmap jobs of the clients with warm caches")
+    parser.add_argument('-s', '--socket', default=DAEMON_SOCKET,
+                        help=f"Path to the Unix socket, empty to disable it (default is '{DAEMON_SOCKET}')")
+    parser.add_argument('-lH', '--http-host', default=DAEMON_HTTP_HOST,
+                        help=f"Host of the HTTP API (default is {DAEMON_HTTP_HOST})")
+    parser.add_argument('-lP', '--http-port', type=int, default=DAEMON_HTTP_PORT,
+                        help=f"Port of the HTTP API, the API is disabled without it, its requests need the token "
+                             f"in '{DAEMON_TOKEN_FILE}' (default is {DAEMON_HTTP_PORT})")
+    parser.add_argument('-mJ', '--max-jobs', type=int, default=DAEMON_MAX_JOBS,
+                        help=f"Number of jobs running at a time (default is {DAEMON_MAX_JOBS})")
+    parser.add_argument('-aP', '--async-processes', type=int, default=DAEMON_NMAP_PROCESSES,
+                        help=f"Number of nmap processes shared by all jobs (default is {DAEMON_NMAP_PROCESSES})")
+    parser.add_argument('-dT', '--dns-threads', type=int, default=DAEMON_DNS_THREADS,
+                        help=f"Number of threads of the DNS lookups (default is {DAEMON_DNS_THREADS})")
+    parser.add_argument('-cS', '--dns-cache-size', type=int, default=DAEMON_DNS_CACHE_SIZE,
+                        help=f"Number of cached DNS answers, 0 to disable the cache (default is {DAEMON_DNS_CACHE_SIZE})")
+    parser.add_argument('-cT', '--dns-cache-ttl', type=float, default=DAEMON_DNS_CACHE_TTL,
+                        help=f"Lifetime in seconds of a cached DNS answer (default is {DAEMON_DNS_CACHE_TTL})")
+    parser.add_argument('-pT', '--passive-cache-ttl', type=float, default=DAEMON_PASSIVE_CACHE_TTL,
+                        help=f"Lifetime in seconds of the cached passive collection results (default is {DAEMON_PASSIVE_CACHE_TTL})")
+
+    args = parser.parse_args(remaining_args)
+
+    configure_caches(dns_size=args.dns_cache_size, dns_ttl=args.dns_cache_ttl, passive_ttl=args.passive_cache_ttl)
+    asyncio.run(serve(args.socket or None, args.http_host, args.http_port, args.max_jobs, args.async_processes, args.dns_threads))
@@ -0,0 +1,169 @@
+import heapq
+import random
+import socket
+import struct
+import threading
+import time
+from typing import Dict
+
+from _log import vsc_log
+
+
+_module_name = "domain.dns_stand_in"
+
+
+class StandInServerDNS:
+    """
+    Local authoritative DNS server over UDP, that stands in for the resolvers in tests and benchmarks.
+
+    It answers the A queries of its records and NXDOMAIN for all other names, so the brute-force paths can be run
+    against it without the network. A record '*.zone' answers all names below the zone without their own record.
+    """
+    def __init__(self, records:Dict[str, str] = None, host:str = "127.0.0.1", port:int = 0, delay:float = 0,
+                 loss:float = 0, seed:int = 0):
+        """
+        :param records: IPv4 addresses by name
+        :param host: Listening address
+        :param port: Listening port, 0 for a random free port
+        :param delay: Seconds before each answer, a slow resolver
+        :param loss: Share of the queries, that are dropped without an answer
+        :param seed: Seed of the dropped queries, the same seed drops the same sequence
+        """
+        self.records = {name.rstrip('.').lower(): ip for name, ip in (records or {}).items()}
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.loss = loss
+        self.queries = 0
+        self.dropped = 0
+
+        self._random = random.Random(seed)
+        self._sock = None
+        self._threads = []
+        self._stopped = threading.Event()
+        # Delayed answers by their due time, they are sent by a single thread
+        self._delayed = []
+        self._delayed_changed = threading.Condition()
+
+    def start(self) -> 'StandInServerDNS':
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self._sock.bind((self.host, self.port))
+        self.port = self._sock.getsockname()[1]
+        self._stopped.clear()
+        self._threads = [threading.Thread(target=self._serve, daemon=True)]
+        if self.delay:
+            self._threads.append(threading.Thread(target=self._send_delayed, daemon=True))
+        for thread in self._threads:
+            thread.start()
+        vsc_log.info_ip_status_result(_module_name, f"{self.host}:{self.port}", "START", f"Stand-in DNS server with {len(self.records)} records")
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._sock:
+            # An empty datagram wakes up the blocked recvfrom()
+            self._sock.sendto(b"", (self.host, self.port))
+            with self._delayed_changed:
+                self._delayed_changed.notify()
+            for thread in self._threads:
+                thread.join()
+            self._sock.close()
+        vsc_log.info_ip_status_result(_module_name, f"{self.host}:{self.port}", "STOP", f"Stand-in DNS server answered {self.queries} queries")
+
+    @property
+    def nameserver(self) -> str:
+        """Address of the server as ip:port."""
+        return f"{self.host}:{self.port}"
+
+    def lookup(self, name:str) -> str | None:
+        """
+        :return: IPv4 address of the name by its own or a wildcard record, None for NXDOMAIN
+        """
+        name = name.rstrip('.').lower()
+        if name in self.records:
+            return self.records[name]
+        labels = name.split('.')
+        # The closest wildcard wins
+        for index in range(1, len(labels)):
+            wildcard = '*.' + '.'.join(labels[index:])
+            if wildcard in self.records:
+                return self.records[wildcard]
+        return None
+
+    def answer(self, query:bytes) -> bytes | None:
+        """
+        :return: Response to the query, None for a malformed one
+        """
+        if len(query) < 12:
+            return None
+        query_id, flags, questions = struct.unpack(">HHH", query[:6])
+        if flags & 0x8000 or questions != 1:
+            return None
+        labels = []
+        offset = 12
+        while offset < len(query) and query[offset]:
+            labels.append(query[offset + 1:offset + 1 + query[offset]].decode("ascii", "replace"))
+            offset += query[offset] + 1
+        offset += 1
+        if offset + 4 > len(query):
+            return None
+        question_type, _ = struct.unpack(">HH", query[offset:offset + 4])
+        question = query[12:offset + 4]
+        ip = self.lookup('.'.join(labels))
+        # Response, authoritative, the recursion desired bit of the query, NXDOMAIN without a record
+        response_flags = 0x8400 | (flags & 0x0100) | (0 if ip else 3)
+        answer = b""
+        if ip and question_type == 1:
+            # The name is a compression pointer to the question
+            answer = b"\xc0\x0c" + struct.pack(">HHIH", 1, 1, 60, 4) + socket.inet_aton(ip)
+        return struct.pack(">HHHHHH", query_id, response_flags, 1, 1 if answer else 0, 0, 0) + question + answer
+
+    def _serve(self):
+        while not self._stopped.is_set():
+            try:
+                query, client = self._sock.recvfrom(512)
+            except OSError:
+                break
+            if self._stopped.is_set():
+                break
+            self.queries += 1
+            if self.loss and self._random.random() < self.loss:
+                self.dropped += 1
+                continue
+            response = self.answer(query)
+            if response is None:
+                continue
+            if self.delay:
+                # The server keeps reading, while the answer waits for its due time
+                with self._delayed_changed:
+                    heapq.heappush(self._delayed, (time.monotonic() + self.delay, self.queries, response, client))
+                    self._delayed_changed.notify()
+            else:
+                self._send(response, client)
+
+    def _send_delayed(self):
+        with self._delayed_changed:
+            while not self._stopped.is_set():
+                if not self._delayed:
+                    self._delayed_changed.wait()
+                    continue
+                remaining = self._delayed[0][0] - time.monotonic()
+                if remaining > 0:
+                    self._delayed_changed.wait(remaining)
+                    continue
+                _, _, response, client = heapq.heappop(self._delayed)
+                self._send(response, client)
+
+    def _send(self, response:bytes, client:tuple):
+        try:
+            self._sock.sendto(response, client)
+        except OSError:
+            # Stopped meanwhile
+            pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
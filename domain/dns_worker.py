@@ -0,0 +1,103 @@
+"""
+Stand-alone DNS brute-force worker, domain.remote_dns uploads it to the SSH servers and runs it with their python3.
+It needs only the standard library and no other file of the package.
+
+Resolves the names of a shard file (one name per line) and prints a JSON line for each resolved name:
+{"name": "www.example.com", "ip": "93.184.216.34"}, and at the end a summary line: {"done": <names>, "resolved": <resolved>}.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import socket
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _query(name:str, nameserver:tuple[str, int], timeout:float, attempts:int) -> str | None:
+    """
+    A-record lookup over UDP at the nameserver.
+    :return: First IPv4 address of the answer, None for a name without one
+    """
+    query_id = random.getrandbits(16)
+    question = b"".join(bytes([len(label)]) + label for label in name.rstrip('.').encode("idna").split(b'.')) + b"\x00"
+    # Recursion desired, one question of the type A and the class IN
+    packet = struct.pack(">HHHHHH", query_id, 0x0100, 1, 0, 0, 0) + question + struct.pack(">HH", 1, 1)
+    with socket.socket(socket.AF_INET6 if ':' in nameserver[0] else socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        for _ in range(attempts):
+            sock.sendto(packet, nameserver)
+            try:
+                while True:
+                    response, _ = sock.recvfrom(4096)
+                    if len(response) >= 12 and struct.unpack(">H", response[:2])[0] == query_id:
+                        break
+            except socket.timeout:
+                continue
+            flags, _, answers = struct.unpack(">HHH", response[2:8])
+            if flags & 0x000F:
+                # NXDOMAIN or another error code
+                return None
+            offset = 12 + len(question) + 4
+            for _ in range(answers):
+                # The name of the record is a compression pointer or a sequence of labels
+                while response[offset] and response[offset] < 0xC0:
+                    offset += response[offset] + 1
+                offset += 2 if response[offset] >= 0xC0 else 1
+                record_type, _, _, length = struct.unpack(">HHIH", response[offset:offset + 10])
+                offset += 10
+                if record_type == 1 and length == 4:
+                    return socket.inet_ntoa(response[offset:offset + 4])
+                offset += length
+            return None
+    raise TimeoutError(f"No answer from {nameserver[0]}:{nameserver[1]}")
+
+
+def _resolve(name:str, nameserver:tuple[str, int] | None, timeout:float, attempts:int) -> str | None:
+    try:
+        if nameserver:
+            return _query(name, nameserver, timeout, attempts)
+        return socket.gethostbyname(name)
+    except (OSError, UnicodeError, ValueError, IndexError, struct.error):
+        return None
+
+
+def parse_nameserver(value:str) -> tuple[str, int]:
+    """
+    Copy of _utils.parse_nameserver(), the worker runs without the package.
+    :param value: 'ip', 'ip:port' or '[ipv6]:port'
+    """
+    host, separator, port = value.rpartition(':')
+    if not separator or (':' in host and not host.endswith(']')):
+        # Without a port, a bare IPv6 address has colons too
+        return value.strip('[]'), 53
+    return host.strip('[]'), int(port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DNS brute-force worker")
+    parser.add_argument('shard', help="File with the names to resolve, one per line")
+    parser.add_argument('-w', '--workers', type=int, default=32, help="Number of parallel lookups")
+    parser.add_argument('-ns', '--nameserver', default=None, help="Nameserver as ip or ip:port (default is the system resolver)")
+    parser.add_argument('-t', '--timeout', type=float, default=2, help="Timeout in seconds of a query to the nameserver")
+    parser.add_argument('-a', '--attempts', type=int, default=2, help="Attempts of a query to the nameserver")
+    args = parser.parse_args()
+
+    nameserver = parse_nameserver(args.nameserver) if args.nameserver else None
+    with open(args.shard, 'r') as file:
+        names = [line.strip() for line in file if line.strip()]
+    resolved = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        for name, ip in zip(names, executor.map(lambda name: _resolve(name, nameserver, args.timeout, args.attempts), names)):
+            if ip:
+                resolved += 1
+                # A line per result, so the results stream back while the shard is resolved
+                sys.stdout.write(json.dumps({"name": name, "ip": ip}) + "\n")
+                sys.stdout.flush()
+    sys.stdout.write(json.dumps({"done": len(names), "resolved": resolved}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
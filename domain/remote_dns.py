@@ -0,0 +1,199 @@
+import asyncio
+import itertools
+import json
+import os
+import posixpath
+import shlex
+import threading
+from typing import AsyncIterator, Callable, List
+
+from _conf import BRUTEFORCE_DNS_WORKERS, BRUTEFORCE_DNS_TIMEOUT, BRUTEFORCE_DNS_ATTEMPTS, BRUTEFORCE_REMOTE_TEMP_DIR, BRUTEFORCE_REMOTE_PYTHON, BRUTEFORCE_REMOTE_MIN_SHARD, \
+    BRUTEFORCE_REMOTE_TIMEOUT, TEMP_DIR, ensure_dir
+from _log import vsc_log, logger
+from _utils import iter_bounded
+from domain import resolve_domain
+from proxy import ServerSSH
+
+
+_module_name = "domain.remote_dns"
+
+_WORKER_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dns_worker.py")
+
+
+class RemoteResolver:
+    """
+    Resolves the brute-force names on the SSH servers.
+
+    The names are split into a shard for each server. The server gets the stand-alone domain/dns_worker.py and its
+    shard via SFTP into a private folder made by mktemp, resolves the shard with its own resolvers and streams the
+    results back over the SSH channel. The names of a failed server, that it hasn't reported yet, are resolved
+    locally, so a lost node costs time, not results.
+    """
+    def __init__(self, servers:List[ServerSSH], nameserver:str = None, workers:int = BRUTEFORCE_DNS_WORKERS,
+                 remote_temp_dir:str = BRUTEFORCE_REMOTE_TEMP_DIR, python:str = BRUTEFORCE_REMOTE_PYTHON,
+                 min_shard:int = BRUTEFORCE_REMOTE_MIN_SHARD, timeout:float = BRUTEFORCE_REMOTE_TIMEOUT):
+        """
+        :param servers: Connected SSH servers
+        :param nameserver: Nameserver of the workers as ip or ip:port, None for the resolvers of each server
+        :param workers: Number of parallel lookups on each server
+        :param remote_temp_dir: Parent of the private folder for the worker and the shards on the servers,
+            None for $TMPDIR or /tmp of each server
+        :param python: Python interpreter on the servers
+        :param min_shard: Minimum number of names in a shard, small lists don't occupy all servers
+        :param timeout: Timeout in seconds of a shard on a server
+        """
+        self.servers = servers
+        self.nameserver = nameserver
+        self.workers = workers
+        self.remote_temp_dir = remote_temp_dir
+        self.python = python
+        self.min_shard = max(1, min_shard)
+        self.timeout = timeout
+
+        # Private folder with the worker on each prepared server, and the server, that removes it
+        self._folders = {}
+        self._lock = threading.Lock()
+        self._shard_ids = itertools.count()
+
+    def _prepare(self, server:ServerSSH) -> str:
+        """
+        :return: Private folder with the worker on the server
+        """
+        # One upload at a time, the servers of the same host share the folder
+        with self._lock:
+            if server.str_remote in self._folders:
+                return self._folders[server.str_remote][1]
+            parent = shlex.quote(self.remote_temp_dir.rstrip('/')) if self.remote_temp_dir else '"${TMPDIR:-/tmp}"'
+            # mktemp makes a new folder only the user can access, a predictable shared path could be prepared by other users
+            stdout, stderr = server.execute_command(f"mktemp -d {parent}/vulnscan-dns.XXXXXXXXXX")
+            if stdout is None:
+                raise ConnectionError(f"SSH connection to {server.str_remote} is not established")
+            folder = stdout.strip()
+            if stderr or not folder:
+                raise RuntimeError(f"Failed to create a temporary folder on {server.str_remote}: {stderr}")
+            self._folders[server.str_remote] = (server, folder)
+            server.sftp_upload(_WORKER_FILE, posixpath.join(folder, "dns_worker.py"), resume=False, verify=False)
+            return folder
+
+    def _resolve_shard(self, server:ServerSSH, names:List[str], on_result:Callable[[str, str], None]) -> int:
+        """
+        Runs the worker for the names on the server and passes each result to on_result, as it is received.
+        :return: Number of the results
+        :raises ConnectionError: If the SSH connection is lost
+        :raises RuntimeError: If the worker fails or doesn't finish the shard
+        """
+        folder = self._prepare(server)
+        shard_name = f"shard-{os.getpid()}-{next(self._shard_ids)}.txt"
+        local_shard = os.path.join(ensure_dir(TEMP_DIR), shard_name)
+        remote_shard = posixpath.join(folder, shard_name)
+        with open(local_shard, 'w') as file:
+            file.write('\n'.join(names) + '\n')
+        try:
+            server.sftp_upload(local_shard, remote_shard, resume=False, verify=False)
+        finally:
+            os.remove(local_shard)
+
+        command = [self.python, posixpath.join(folder, "dns_worker.py"), remote_shard, "-w", str(self.workers),
+                   "-t", str(BRUTEFORCE_DNS_TIMEOUT), "-a", str(BRUTEFORCE_DNS_ATTEMPTS)]
+        if self.nameserver:
+            command += ["-ns", self.nameserver]
+        command = ' '.join(shlex.quote(param) for param in command)
+        if self.timeout:
+            # The remote side enforces the timeout itself, so a lost connection doesn't leave the worker running
+            command = f"timeout {max(1, int(self.timeout))} {command}"
+
+        count = 0
+        summary = None
+        try:
+            for line in server.iter_command(command, timeout=self.timeout):
+                record = json.loads(line)
+                if "done" in record:
+                    summary = record
+                else:
+                    on_result(record["name"], record["ip"])
+                    count += 1
+        finally:
+            server.execute_command(f"rm -f {shlex.quote(remote_shard)}")
+        if not summary or summary["done"] != len(names):
+            raise RuntimeError(f"Worker on {server.str_remote} stopped after {count} results")
+        return count
+
+    async def iter_resolve(self, names:List[str]) -> AsyncIterator[tuple[str, str]]:
+        """
+        :param names: Names to resolve
+        :return: Async iterator of the resolved names with their IPs, as they are received from the servers
+        """
+        servers = [server for server in self.servers if server.is_alive()]
+        shard_count = min(len(servers), -(-len(names) // self.min_shard))
+        if not shard_count:
+            if names:
+                vsc_log.warn_status_result(_module_name, "LOCAL", f"No alive SSH servers, {len(names)} names are resolved locally")
+            async for result in self._iter_locally(names):
+                yield result
+            return
+
+        shards = [names[index::shard_count] for index in range(shard_count)]
+        loop = asyncio.get_running_loop()
+        # Results of all shards, None when a shard is finished
+        results = asyncio.Queue()
+
+        async def resolve_on(server:ServerSSH, shard:List[str]):
+            reported = set()
+
+            def on_result(name:str, ip:str):
+                reported.add(name)
+                loop.call_soon_threadsafe(results.put_nowait, (name, ip))
+
+            try:
+                count = await asyncio.to_thread(self._resolve_shard, server, shard, on_result)
+                vsc_log.debug_ip_status_result(_module_name, server.str_remote, "RESOLVED", f"{count} of {len(shard)} names")
+            except Exception as e:
+                # The results of the worker are already passed on, only the rest of the shard is resolved again
+                remaining = [name for name in shard if name not in reported]
+                vsc_log.warn_ip_status_result(_module_name, server.str_remote, "LOCAL",
+                                              f"Worker failed ({e}), its {len(remaining)} remaining names are resolved locally")
+                async for result in self._iter_locally(remaining):
+                    results.put_nowait(result)
+            finally:
+                results.put_nowait(None)
+
+        tasks = [asyncio.create_task(resolve_on(server, shard)) for server, shard in zip(servers, shards)]
+        try:
+            pending = len(tasks)
+            while pending:
+                result = await results.get()
+                if result is None:
+                    pending -= 1
+                else:
+                    yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+            # The cancelled shards end their local resolution, before the caller goes on or closes the servers
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    @logger(_module_name)
+    async def resolve(self, names:List[str]) -> List[tuple[str, str]]:
+        """
+        :param names: Names to resolve
+        :return: Resolved names with their IPs, in the order they are received
+        """
+        return [result async for result in self.iter_resolve(names)]
+
+    @logger(_module_name)
+    def close(self):
+        """Removes the private folders from the servers."""
+        with self._lock:
+            folders, self._folders = self._folders, {}
+        for server, folder in folders.values():
+            try:
+                server.execute_command(f"rm -rf {shlex.quote(folder)}")
+            except Exception as e:
+                vsc_log.warn_ip_status_result(_module_name, server.str_remote, "CLEANUP", f"Failed to remove '{folder}': {e}")
+
+    async def _iter_locally(self, names:List[str]) -> AsyncIterator[tuple[str, str]]:
+        async for task in iter_bounded(resolve_domain, names, self.workers):
+            if task.error:
+                vsc_log.error_status_result(_module_name, "ERROR", f"Failed resolve_domain for '{task.item}'!\n{task.error}")
+            elif task.result:
+                yield task.item, task.result
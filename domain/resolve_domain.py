@@ -1,26 +1,114 @@
+import asyncio
 import socket
+from typing import List, Tuple
 
+from _conf import BRUTEFORCE_DNS_TIMEOUT, BRUTEFORCE_DNS_ATTEMPTS, BRUTEFORCE_DNS_THREADS
 from _log import vsc_log, logger
+from _utils import TTLCache, MISSING, DaemonExecutor, parse_nameserver
 
 _module_name = "domain.resolve_domain"
 
+# Results of the lookups (None for a domain without an address), disabled until a long-running process configures it.
+# Timeouts and other transient failures aren't cached, the next lookup of the domain is sent again
+dns_cache = TTLCache()
+
+# Threads of the system resolver lookups, a timed out lookup doesn't hold up the end of the run
+lookup_executor = DaemonExecutor(BRUTEFORCE_DNS_THREADS, thread_name_prefix="dns-lookup")
+
+# Resolver of the configured nameservers, the system resolver is used until they are configured
+_resolver = None
+
 
 @logger(_module_name)
+def configure_nameservers(nameservers:List[str] | None, timeout:float = BRUTEFORCE_DNS_TIMEOUT, attempts:int = BRUTEFORCE_DNS_ATTEMPTS):
+    """
+    Sends the lookups of resolve_domain() to the nameservers instead of the system resolver. The queries are sent by
+    dnspython on the event loop, so they don't wait for the threads of the default executor.
+    :param nameservers: Nameservers as ip or ip:port, None or empty for the system resolver
+    :param timeout: Timeout in seconds of each query
+    :param attempts: Number of queries of a lookup, a lost query is sent again after the timeout
+    """
+    global _resolver
+    if not nameservers:
+        _resolver = None
+        return
+    # dnspython is imported only with configured nameservers, not with the domain package
+    import dns.asyncresolver
+    import dns.nameserver
+    resolver = dns.asyncresolver.Resolver(configure=False)
+    resolver.nameservers = [dns.nameserver.Do53Nameserver(*parse_nameserver(nameserver)) for nameserver in nameservers]
+    resolver.timeout = timeout
+    resolver.lifetime = timeout * max(1, attempts)
+    _resolver = resolver
+    vsc_log.info_status_result(_module_name, "NAMESERVERS", f"Lookups are sent to {', '.join(nameservers)}")
+
+
+# Called for every brute-forced subdomain, so only a sample of the calls is auto-logged
+@logger(_module_name, sample_every=100)
 async def resolve_domain(domain:str):
     clear_domain = domain.replace('*.','').replace(' ','')
+    ip = dns_cache.get(clear_domain)
+    if ip is not MISSING:
+        return ip
+    ip, definitive = await _lookup(domain, clear_domain)
+    if definitive:
+        dns_cache.set(clear_domain, ip)
+    return ip
+
+
+# Errors of getaddrinfo(), that are the answer for the domain, the others (e.g. EAI_AGAIN) may pass with the next lookup
+_DEFINITIVE_GAIERRORS = {getattr(socket, name) for name in ("EAI_NONAME", "EAI_NODATA", "EAI_ADDRFAMILY") if hasattr(socket, name)}
+
+
+async def _lookup(domain:str, clear_domain:str) -> Tuple[str | None, bool]:
+    """
+    :return: IP or None, and whether it is the answer for the domain (an address or its absence) and not a transient failure
+    """
+    if _resolver:
+        return await _query(domain, clear_domain)
     try:
-        ip = socket.gethostbyname(clear_domain)
+        # The blocking lookup runs in its own executor, so it doesn't stall the event loop and can be timed out
+        ip = await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(lookup_executor, socket.gethostbyname, clear_domain),
+                                    BRUTEFORCE_DNS_TIMEOUT * max(1, BRUTEFORCE_DNS_ATTEMPTS))
         vsc_log.info_ip_status_result(_module_name, ip, "RESOLVED", f"From {clear_domain}")
-        return ip
+        return ip, True
+    except asyncio.TimeoutError:
+        vsc_log.debug_status_result(_module_name, "TIMEOUT", f"Unable to resolve domain '{clear_domain}' in time")
+        return None, False
     except socket.gaierror as e:
         vsc_log.debug_status_result(_module_name, "GAIERROR", f"Unable to resolve domain '{clear_domain}' due to address-related error: {e}")
-        return None
+        return None, e.errno in _DEFINITIVE_GAIERRORS
     except socket.herror as e:
         vsc_log.debug_status_result(_module_name, "HERROR", f"Unable to resolve domain '{clear_domain}' due to host-related error: {e}")
-        return None
+        return None, False
     except ValueError as e:
         vsc_log.debug_status_result(_module_name, "VALUEERROR", f"Invalid domain format '{domain}': {e}")
-        return None
+        return None, True
+    except Exception as e:
+        vsc_log.warn_status_result(_module_name, "ERROR", f"Unexpected error occurred while resolving domain '{domain}': {e}")
+        return None, False
+
+
+async def _query(domain:str, clear_domain:str) -> Tuple[str | None, bool]:
+    """
+    :return: The same as _lookup()
+    """
+    import dns.exception
+    import dns.resolver
+    try:
+        answer = await _resolver.resolve(clear_domain, "A", search=False)
+        ip = answer[0].address
+        vsc_log.info_ip_status_result(_module_name, ip, "RESOLVED", f"From {clear_domain}")
+        return ip, True
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+        vsc_log.debug_status_result(_module_name, "NXDOMAIN", f"Unable to resolve domain '{clear_domain}': {e}")
+        return None, True
+    except (dns.exception.Timeout, dns.resolver.NoNameservers) as e:
+        vsc_log.debug_status_result(_module_name, "TIMEOUT", f"Unable to resolve domain '{clear_domain}' due to the nameservers: {e}")
+        return None, False
+    except dns.exception.DNSException as e:
+        vsc_log.debug_status_result(_module_name, "VALUEERROR", f"Invalid domain format '{domain}': {e}")
+        return None, True
     except Exception as e:
         vsc_log.warn_status_result(_module_name, "ERROR", f"Unexpected error occurred while resolving domain '{domain}': {e}")
-        return None
+        return None, False
@@ -0,0 +1,181 @@
+import asyncio
+import multiprocessing
+import queue
+import time
+from datetime import datetime
+from typing import Callable, List
+
+from _conf import ensure_dir, BRUTEFORCE_OUTPUT_FOLDER, BRUTEFORCE_OUTPUT_FORMAT, BRUTEFORCE_ASYNC_PROCESSES, BRUTEFORCE_DNS_WORKERS, \
+    BRUTEFORCE_DOMAIN_TIMEOUT, BRUTEFORCE_SHARD_POLL_INTERVAL
+from _log import vsc_log, logger
+from _utils import Deadline, iter_bounded
+from domain.resolve_domain import configure_nameservers
+from domain.subdomain import resolve_ips
+from proxy.egress import egress_pool
+
+
+_module_name = "domain.shard"
+
+
+class _LineBuffer:
+    """
+    Stands in for the output file of resolve_ips(), the lines of a domain are sent to the writer with its result.
+    """
+    def __init__(self):
+        self.lines = []
+
+    async def write(self, line:str):
+        self.lines.append(line)
+
+
+def split_budget(total:int, parts:int) -> List[int]:
+    """
+    Splits a concurrency budget between the shards, the sum of the parts is the budget.
+    :param parts: Number of shards, at most the budget, so every part is at least 1
+    :raise ValueError: More parts than the budget
+    """
+    if parts > total:
+        raise ValueError(f"Budget {total} can't be split into {parts} parts of at least 1")
+    return [total // parts + (index < total % parts) for index in range(parts)]
+
+
+async def _resolve_shard(items:list, results:multiprocessing.Queue, max_concurrent:int, ends_at:float | None,
+                         domain_timeout:float | None, **kwargs):
+    # The budget starts with the run and not with the shard, so the start-up of the interpreter is charged to it
+    deadline = Deadline(max(0.0, ends_at - time.time()) if ends_at is not None else None)
+
+    async def resolve(item:tuple) -> tuple:
+        index, domain = item
+        if deadline.expired():
+            vsc_log.warn_status_result(_module_name, "SKIPPED", f"Time budget is exhausted before resolving '{domain}'")
+            return None, [], []
+        lines = _LineBuffer()
+        resolved = []
+        ips = await resolve_ips(domain, lines, timeout=deadline.timeout(domain_timeout), max_concurrent=max_concurrent,
+                                on_resolved=lambda name, name_ips: resolved.append((name, name_ips)), **kwargs)
+        return ips, lines.lines, resolved
+
+    async for task in iter_bounded(resolve, items, max_concurrent):
+        index, domain = task.item
+        ips, lines, resolved = task.result if task.result else ([], [], [])
+        results.put((index, domain, ips, (lines, resolved), str(task.error) if task.error else None))
+
+
+def _shard_worker(shard:int, items:list, results:multiprocessing.Queue, max_concurrent:int, ends_at:float | None,
+                  domain_timeout:float | None, nameservers:List[str] | None, egress:dict | None, kwargs:dict):
+    """
+    Entry point of a shard process: resolves its domains on its own event loop and sends each result to the writer.
+    :param ends_at: Wall-clock time (time.time()) of the end of the budget, the monotonic clock isn't shared by the processes
+    :param egress: Settings of the egress pool of the parent, see EgressPool.config()
+    """
+    # The spawned interpreter doesn't inherit the resolver and the egresses of the parent. The egresses are the local
+    # SOCKS5 proxies of the parent (or external ones), their tunnels stay in the parent
+    configure_nameservers(nameservers)
+    if egress:
+        egress_pool.configure(**egress)
+    try:
+        asyncio.run(_resolve_shard(items, results, max_concurrent, ends_at, domain_timeout, **kwargs))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        results.put((None, shard, None, None, None))
+
+
+@logger(_module_name)
+def sharded_resolve_ips(domains:list, shards:int, max_concurrent:int=BRUTEFORCE_ASYNC_PROCESSES, output_folder:str=BRUTEFORCE_OUTPUT_FOLDER,
+                        output_format:str=BRUTEFORCE_OUTPUT_FORMAT, deadline:Deadline=None, domain_timeout:float=BRUTEFORCE_DOMAIN_TIMEOUT,
+                        dns_workers:int=BRUTEFORCE_DNS_WORKERS, on_resolved:Callable[[str, List[str]], None]=None,
+                        nameservers:List[str]=None, **kwargs) -> List[List[str]]:
+    """
+    Resolves the domains with their subdomains in several processes, each of them runs its own event loop.
+    The domains are dealt to the shards round-robin and the concurrency budgets (domains and DNS lookups) are split
+    between the shards, so the whole run never exceeds them. The results are written by a single writer in the order
+    of the domains, as soon as all preceding domains are finished. The shards use the egresses of egress_pool,
+    the rate of each egress is split between them.
+    :param shards: Number of worker processes, it is limited by the number of domains and both budgets, so each shard
+                   gets at least one of each
+    :param on_resolved: Called in this process with each resolved domain or subdomain and its IPs, in the order of the domains
+    :param nameservers: Nameservers of the lookups in the shards, None for the system resolver
+    :return: Found IPs of each domain, in the order of the domains, None for a domain skipped because the time budget
+             was exhausted or lost with its shard
+    """
+    deadline = deadline if deadline else Deadline()
+    shards = max(1, min(shards, len(domains), max_concurrent, dns_workers))
+    domain_budgets = split_budget(max_concurrent, shards)
+    dns_budgets = split_budget(dns_workers, shards)
+
+    # Fresh interpreters instead of forks, so the shards don't inherit the threads and the log writer of this process
+    context = multiprocessing.get_context("spawn")
+    results_queue = context.Queue()
+    items = list(enumerate(domains))
+    egress = egress_pool.config(shards)
+    remaining = deadline.remaining()
+    ends_at = time.time() + remaining if remaining is not None else None
+    processes = []
+    for shard in range(shards):
+        shard_kwargs = {**kwargs, "output_format": output_format, "dns_workers": dns_budgets[shard]}
+        processes.append(context.Process(target=_shard_worker, name=f"vsc-shard-{shard}", daemon=True,
+                                         args=(shard, items[shard::shards], results_queue, domain_budgets[shard],
+                                               ends_at, domain_timeout, nameservers, egress, shard_kwargs)))
+    vsc_log.info_status_result(_module_name, "STARTED", f"{len(domains)} domains in {shards} shards, domain budgets {domain_budgets}, "
+                                                        f"DNS budgets {dns_budgets}")
+    for process in processes:
+        process.start()
+
+    output_file_path = f"{ensure_dir(output_folder)}domain.subdomain {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}.txt" if output_folder else None
+    output_file = open(output_file_path, 'w') if output_file_path else None
+    results = [None] * len(domains)
+    # Lines and resolutions of the finished domains, that wait for the preceding domains
+    pending = {}
+    next_index = 0
+    finished_shards = set()
+
+    def write_ready():
+        # The ordered writer: the lines of a domain are written after all preceding domains
+        nonlocal next_index
+        while next_index in pending:
+            domain_lines, resolved = pending.pop(next_index)
+            if on_resolved:
+                for name, name_ips in resolved:
+                    on_resolved(name, name_ips)
+            if output_file:
+                output_file.writelines(domain_lines)
+                output_file.flush()
+            next_index += 1
+
+    try:
+        while len(finished_shards) < shards:
+            try:
+                index, domain, ips, output, error = results_queue.get(timeout=BRUTEFORCE_SHARD_POLL_INTERVAL)
+            except queue.Empty:
+                # A shard, that died without its end marker, loses its unfinished domains
+                for shard, process in enumerate(processes):
+                    if shard not in finished_shards and not process.is_alive() and process.exitcode:
+                        vsc_log.error_status_result(_module_name, "ERROR", f"Shard {shard} exited with code {process.exitcode}")
+                        finished_shards.add(shard)
+                        for lost_index, _ in items[shard::shards]:
+                            if lost_index not in pending and lost_index >= next_index:
+                                pending[lost_index] = ([], [])
+                write_ready()
+                continue
+            if index is None:
+                finished_shards.add(domain)
+                continue
+            if error:
+                vsc_log.error_status_result(_module_name, "ERROR", f"Error resolving domain '{domain}': {error}")
+            results[index] = ips
+            pending[index] = output
+            write_ready()
+    except KeyboardInterrupt:
+        vsc_log.warn_status_result(_module_name, "CANCELLED", "Stopping the shards")
+        for process in processes:
+            process.terminate()
+        raise
+    finally:
+        for process in processes:
+            process.join()
+        if output_file:
+            output_file.close()
+            vsc_log.info_status_result(_module_name, "COMPLETE", f"Results saved to '{output_file_path}' file")
+
+    return results
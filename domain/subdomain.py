@@ -1,39 +1,58 @@
 import argparse
 import asyncio
+import os
 from datetime import datetime
-from typing import List, Tuple, Any
+from typing import Callable, List
 
 import aiofiles
 
-from _conf import COMMON_SUBDOMAINS, BRUTEFORCE_FILE, BRUTEFORCE_LEVEL, BRUTEFORCE_OUTPUT_FOLDER, BRUTEFORCE_OUTPUT_FORMAT, BRUTEFORCE_ASYNC_PROCESSES
-from _log import vsc_log, logger
-from _utils import async_load_targets, get_filtered_list, start_monitor, stop_monitor
-from domain import resolve_domain
+from _conf import get_common_subdomains, ensure_dir, BRUTEFORCE_FILE, BRUTEFORCE_LEVEL, BRUTEFORCE_OUTPUT_FOLDER, BRUTEFORCE_OUTPUT_FORMAT, BRUTEFORCE_ASYNC_PROCESSES, \
+    BRUTEFORCE_DOMAIN_TIMEOUT, BRUTEFORCE_TIME_BUDGET, BRUTEFORCE_DNS_WORKERS, BRUTEFORCE_SHARDS, PROXY_EGRESS_STRATEGY, PROXY_EGRESS_STRATEGIES, \
+    PROXY_EGRESS_RATE, PROXY_JSON_FILE, BRUTEFORCE_PASSIVE, BRUTEFORCE_PASSIVE_TIMEOUT, BRUTEFORCE_PASSIVE_THREADS
+from _log import vsc_log, logger, tracer
+from _utils import async_load_targets, get_filtered_list, start_monitor, stop_monitor, Deadline, run_bounded, iter_bounded, \
+    TTLCache, MISSING, load_external_servers, DaemonExecutor
+from domain import resolve_domain, configure_nameservers
 from domain.subdomain_dns_scanner import collect_subdomains
+from proxy.egress import configure_egress, egress_pool
 
 
 _module_name = "domain.subdomain"
 
+# Brute-force wordlists by (path, modification time), disabled until a long-running process configures it
+wordlist_cache = TTLCache()
+
+# Threads of the passive collection, a timed out collection doesn't hold up the end of the run
+passive_executor = DaemonExecutor(BRUTEFORCE_PASSIVE_THREADS, thread_name_prefix="passive")
+
 
 @logger(_module_name)
-async def limited_resolve_ips(domains:list, max_concurrent:int=BRUTEFORCE_ASYNC_PROCESSES, output_folder:str=BRUTEFORCE_OUTPUT_FOLDER, **kwargs) -> tuple[Any]:
-    semaphore = asyncio.Semaphore(max_concurrent)
+async def limited_resolve_ips(domains:list, max_concurrent:int=BRUTEFORCE_ASYNC_PROCESSES, output_folder:str=BRUTEFORCE_OUTPUT_FOLDER,
+                              deadline:Deadline=None, domain_timeout:float=BRUTEFORCE_DOMAIN_TIMEOUT, **kwargs) -> List[List[str]]:
+    """
+    Resolves the domains with their subdomains by a fixed number of workers.
+    :return: Found IPs of each domain, in the order of the domains, None for a domain skipped because the time budget
+             was exhausted (its IPs are unknown, not gone)
+    """
+    deadline = deadline if deadline else Deadline()
 
-    output_file_path = f"{output_folder}domain.subdomain {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}.txt" if output_folder else None
+    output_file_path = f"{ensure_dir(output_folder)}domain.subdomain {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}.txt" if output_folder else None
     output_file = await aiofiles.open(output_file_path, mode='w') if output_file_path else None
 
-    @logger(_module_name)
-    async def resolve_with_limit(domain:str) -> List[str]:
-        async with semaphore:
-            try:
-                return await resolve_ips(domain, output_file, **kwargs)
-            except Exception as e:
-                vsc_log.error_status_result(_module_name, "ERROR", f"Error resolving domain '{domain}': {e}")
-                return []
+    async def resolve_within_deadline(domain:str) -> List[str]:
+        if deadline.expired():
+            vsc_log.warn_status_result(_module_name, "SKIPPED", f"Time budget is exhausted before resolving '{domain}'")
+            return None
+        # Each domain has its own row in the trace, its nested spans and tasks inherit it
+        with tracer.span("resolve", lane=domain):
+            return await resolve_ips(domain, output_file, timeout=deadline.timeout(domain_timeout), max_concurrent=max_concurrent, **kwargs)
 
     vsc_log.info_status_result(_module_name, "STARTED", "The search for subdomains has begun")
-    tasks = [resolve_with_limit(domain) for domain in domains]
-    results = await asyncio.gather(*tasks)
+    results = []
+    for task in await run_bounded(resolve_within_deadline, domains, max_concurrent):
+        if task.error:
+            vsc_log.error_status_result(_module_name, "ERROR", f"Error resolving domain '{task.item}': {task.error}")
+        results.append([] if task.error else task.result)
 
     # Closing a file if it has been opened
     if output_file:
@@ -44,48 +63,81 @@ async def limited_resolve_ips(domains:list, max_concurrent:int=BRUTEFORCE_ASYNC_
 
 
 @logger(_module_name)
-async def resolve_ips(domain:str, output_file:aiofiles, level:int=BRUTEFORCE_LEVEL, brute_force_file:str=BRUTEFORCE_FILE, output_format:str=BRUTEFORCE_OUTPUT_FORMAT) -> List[str]:
+async def resolve_ips(domain:str, output_file:aiofiles, level:int=BRUTEFORCE_LEVEL, brute_force_file:str=BRUTEFORCE_FILE, output_format:str=BRUTEFORCE_OUTPUT_FORMAT,
+                      timeout:float=None, dns_workers:int=BRUTEFORCE_DNS_WORKERS, on_resolved:Callable[[str, List[str]], None]=None,
+                      remote_resolver=None, passive:bool=BRUTEFORCE_PASSIVE, max_concurrent:int=BRUTEFORCE_ASYNC_PROCESSES) -> List[str]:
+    """
+    :param on_resolved: Called with each resolved domain or subdomain and its IPs, e.g. to keep the mapping in the results store
+    :param remote_resolver: RemoteResolver of domain.remote_dns, that brute-forces the subdomains on the SSH servers
+    :param passive: Add the subdomains of the passive collection (crt.sh, DNS records, subfinder, dnsdumpster) to the wordlist
+    :param max_concurrent: Number of subdomains of the next level searched in parallel
+    :return: All found IPs of the domain and its subdomains
+    """
     found_ips = set()  # To store unique IP addresses
+    deadline = Deadline(timeout)
 
     @logger(_module_name)
     async def search_subdomains(current_domain:str, current_level:int):
         if current_level > 0:
-            subdomains = collect_subdomains(current_domain) + [f"{sub}.{current_domain}" for sub in COMMON_SUBDOMAINS]
+            subdomains = []
+            if passive:
+                # Passive collection does blocking HTTP requests, so it runs in a thread with the time left of the domain
+                with tracer.span("passive collection", domain=current_domain):
+                    subdomains = await asyncio.get_running_loop().run_in_executor(
+                        passive_executor, collect_subdomains, current_domain, deadline.timeout(BRUTEFORCE_PASSIVE_TIMEOUT))
+            subdomains += [f"{sub}.{current_domain}" for sub in get_common_subdomains()]
         else:
             subdomains = [current_domain]
 
         if brute_force_file and current_level > 0:
-            additional_subdomains = await _load_subdomains_from_file(brute_force_file)
+            with tracer.span("load wordlist", file=brute_force_file):
+                additional_subdomains = await _load_subdomains_from_file(brute_force_file)
             subdomains.extend([f"{sub}.{current_domain}" for sub in additional_subdomains])
 
 
         subdomains = get_filtered_list(subdomains)
-        resolved_ips = []
+        # IPs of each resolved name, a subdomain keeps its own IPs instead of adding them to its parent
+        resolved = {}
 
-        try:
-            resolved_ips = await asyncio.gather(*[resolve_domain(sub) for sub in subdomains])
-        except Exception as exe:
-            vsc_log.error_status_result(_module_name, "ERROR", f"Failed resolve_domain!\n{exe}")
+        # Only dns_workers lookups are alive at a time, instead of a coroutine for every subdomain
+        with tracer.span("dns", domain=current_domain, level=current_level, names=len(subdomains)):
+            if remote_resolver and current_level > 0:
+                # The brute-force names are resolved by the workers on the SSH servers and streamed back
+                async for name, ip in remote_resolver.iter_resolve(subdomains):
+                    resolved.setdefault(name, []).append(ip)
+                    # Kept at once, a timed out domain returns the IPs found before the timeout
+                    found_ips.add(ip)
+            else:
+                async for task in iter_bounded(resolve_domain, subdomains, dns_workers):
+                    if task.error:
+                        vsc_log.error_status_result(_module_name, "ERROR", f"Failed resolve_domain for '{task.item}'!\n{task.error}")
+                    elif task.result:
+                        resolved[task.item] = [task.result]
+                        found_ips.add(task.result)
 
-        resolved_ips = get_filtered_list(resolved_ips)
-        for ip in resolved_ips:
-            found_ips.add(ip)
+        resolved_ips = get_filtered_list([ip for name_ips in resolved.values() for ip in name_ips])
 
-        if resolved_ips:
+        for name, name_ips in resolved.items():
+            if on_resolved:
+                on_resolved(name, name_ips)
             # Recording results to a file as they are received
-            if output_file:
-                if output_format == 'domain-ip':
-                    await output_file.write(f"{current_domain} - {', '.join(resolved_ips)}\n")
-                elif output_format == 'ip':
-                    await output_file.write(f"{', '.join(resolved_ips)}\n")
+            if output_file and output_format == 'domain-ip':
+                await output_file.write(f"{name} - {', '.join(name_ips)}\n")
+        if resolved_ips and output_file and output_format == 'ip':
+            await output_file.write(f"{', '.join(resolved_ips)}\n")
 
         if current_level < level:
-            tasks = [search_subdomains(sub, current_level + 1) for sub in subdomains]
-            await asyncio.gather(*tasks)
+            # A bounded number of subdomains of the next level are searched in parallel, so their passive collections overlap
+            async for task in iter_bounded(lambda sub: search_subdomains(sub, current_level + 1), subdomains, max_concurrent):
+                if task.error:
+                    vsc_log.error_status_result(_module_name, "ERROR", f"Failed search_subdomains for '{task.item}'!\n{task.error}")
 
     # Processing of each domain
     try:
-        await search_subdomains(domain, 0)
+        await asyncio.wait_for(search_subdomains(domain, 0), timeout)
+    except asyncio.TimeoutError:
+        vsc_log.warn_status_result(_module_name, "TIMEOUT", f"Resolving of '{domain}' is stopped after {timeout:.1f}s, "
+                                                            f"returning {len(found_ips)} IPs found so far")
     except Exception as e:
         vsc_log.error_status_result(_module_name, "ERROR", f"Failed resolve_ips_from_subdomains for '{domain}'\n{e}")
 
@@ -94,6 +146,10 @@ async def resolve_ips(domain:str, output_file:aiofiles, level:int=BRUTEFORCE_LEV
 
 @logger(_module_name)
 async def _load_subdomains_from_file(file_path:str) -> List[str]:
+    cache_key = (os.path.abspath(file_path), os.path.getmtime(file_path)) if wordlist_cache.enabled else None
+    cached = wordlist_cache.get(cache_key) if cache_key else MISSING
+    if cached is not MISSING:
+        return list(cached)
     subdomains = []
     async with aiofiles.open(file_path, mode='r') as f:
         async for line in f:
@@ -102,6 +158,8 @@ async def _load_subdomains_from_file(file_path:str) -> List[str]:
                 subdomains.append(subdomain)
     subdomains = get_filtered_list(subdomains)
     vsc_log.info_status_result(_module_name, "LOADED", f"{len(subdomains)} subdomains from '{file_path}'")
+    if cache_key:
+        wordlist_cache.set(cache_key, tuple(subdomains))
     return subdomains
 
 
@@ -118,27 +176,98 @@ def main(remaining_args):
                         help=f"Number of parallel scanning processes (default is {BRUTEFORCE_ASYNC_PROCESSES})")
     parser.add_argument('-dBF', '--brute-force-file', default=BRUTEFORCE_FILE,
                         help="Path to brute-force subdomains file (default: BRUTEFORCE_FILE)")
+    parser.add_argument('-dW', '--dns-workers', type=int, default=BRUTEFORCE_DNS_WORKERS,
+                        help=f"Number of parallel DNS lookups of each domain (default is {BRUTEFORCE_DNS_WORKERS})")
+    parser.add_argument('-dT', '--domain-timeout', type=float, default=BRUTEFORCE_DOMAIN_TIMEOUT,
+                        help=f"Timeout in seconds for resolving of each domain with its subdomains (default is {BRUTEFORCE_DOMAIN_TIMEOUT})")
+    parser.add_argument('-tB', '--time-budget', type=float, default=BRUTEFORCE_TIME_BUDGET,
+                        help=f"Time budget in seconds for the whole run (default is {BRUTEFORCE_TIME_BUDGET})")
+    parser.add_argument('-sH', '--shards', type=int, default=BRUTEFORCE_SHARDS,
+                        help=f"Number of worker processes sharing the domains and the -aP/-dW budgets, 1 runs in this process (default is {BRUTEFORCE_SHARDS})")
     parser.add_argument('-oF', '--output-folder', default=BRUTEFORCE_OUTPUT_FOLDER,
                         help="Output folder for results")
     parser.add_argument('-oFmt', '--output-format', choices=['domain-ip', 'ip'], default='domain-ip',
                         help="Output format: 'domain-ip' or 'ip' (default: 'domain-ip')")
+    parser.add_argument('-rDB', '--results-db', default=None,
+                        help="Path to the results store, the resolved domains and subdomains are added to it (default is not to store them)")
+    parser.add_argument('-eG', '--egress', default=None,
+                        help="Comma-separated SOCKS5 proxies (host:port) or 'ssh' for the tunnels of the SSH servers, "
+                             "the passive collection requests are spread over them (default is direct connections)")
+    parser.add_argument('-eGS', '--egress-strategy', choices=PROXY_EGRESS_STRATEGIES, default=PROXY_EGRESS_STRATEGY,
+                        help=f"Assignment of the requests to the egresses (default is '{PROXY_EGRESS_STRATEGY}')")
+    parser.add_argument('-eGR', '--egress-rate', type=float, default=PROXY_EGRESS_RATE,
+                        help=f"New connections per second of each egress, 0 for unlimited (default is {PROXY_EGRESS_RATE})")
+    parser.add_argument('-rW', '--remote-workers', action='store_true',
+                        help="Brute-force the subdomains on the SSH servers of the proxy JSON file, each of them resolves its shard "
+                             "of the names with its own resolvers (default is to resolve them locally)")
+    parser.add_argument('-pJ', '--proxy-json', default=PROXY_JSON_FILE,
+                        help=f"Path to the JSON file with SSH servers for -rW (default is '{PROXY_JSON_FILE}')")
+    parser.add_argument('-nS', '--nameserver', default=None,
+                        help="Nameserver of the lookups as ip or ip:port (default is the system resolver, with -rW the resolvers of each SSH server)")
+    parser.add_argument('-nP', '--no-passive', dest='passive', action='store_false',
+                        help="Brute-force only the wordlists, without the passive collection of subdomains")
     args = parser.parse_args(remaining_args)
 
     domains = []
     if args.domains:
         domains = [domain.strip() for domain in args.domains.split(',')]
     elif args.input_file:
-        _, domains = asyncio.run(async_load_targets(args.input_file))
+        with tracer.span("load targets", file=args.input_file):
+            _, domains = asyncio.run(async_load_targets(args.input_file))
 
     domains = get_filtered_list(domains)
+    if args.egress:
+        configure_egress(args.egress, args.egress_strategy, args.egress_rate)
+    if args.nameserver:
+        configure_nameservers([args.nameserver])
     monitor_id = start_monitor()
-    # Running asynchronous search for all domains
-    asyncio.run(limited_resolve_ips(
+    resolve_args = dict(
         domains=domains,
         max_concurrent=args.async_processes,
         level=args.level,
         brute_force_file=args.brute_force_file,
         output_folder=args.output_folder,
-        output_format=args.output_format
-    ))
-    stop_monitor(monitor_id)
+        output_format=args.output_format,
+        deadline=Deadline(args.time_budget),
+        domain_timeout=args.domain_timeout,
+        dns_workers=args.dns_workers,
+        passive=args.passive
+    )
+    store = None
+    if args.results_db:
+        # Imported here, the results store imports the nmap package, that imports this module
+        from results.store import ResultsStore
+        store = ResultsStore(args.results_db)
+        resolve_args["on_resolved"] = store.add_resolutions
+    manager = None
+    remote_resolver = None
+    if args.remote_workers:
+        # Imported here, the SSH servers are needed only for the remote workers
+        from domain.remote_dns import RemoteResolver
+        from proxy import ManagerSSH
+        manager = ManagerSSH(load_external_servers(["ssh"], args.proxy_json))
+        manager.connect_all()
+        remote_resolver = RemoteResolver([server for server in manager.get_all_servers() if server.is_alive()],
+                                         nameserver=args.nameserver, workers=args.dns_workers)
+        resolve_args["remote_resolver"] = remote_resolver
+        if args.shards > 1:
+            vsc_log.warn_status_result(_module_name, "SHARDS", "The remote workers share the SSH connections of this process, "
+                                                               "the domains are resolved without the worker processes")
+            args.shards = 1
+    try:
+        if args.shards > 1:
+            # Imported here, domain.shard imports this module
+            from domain.shard import sharded_resolve_ips
+            sharded_resolve_ips(shards=args.shards, nameservers=[args.nameserver] if args.nameserver else None, **resolve_args)
+        else:
+            # Running asynchronous search for all domains
+            asyncio.run(limited_resolve_ips(**resolve_args))
+    finally:
+        if store:
+            store.close()
+        if remote_resolver:
+            remote_resolver.close()
+        if manager:
+            manager.disconnect_all()
+        stop_monitor(monitor_id)
+        egress_pool.close()
@@ -1,23 +1,32 @@
 import json
-import dns.resolver
 import subprocess
-import requests
 import re
 from typing import List
 
+from _conf import BRUTEFORCE_PASSIVE_TIMEOUT
 from _log import vsc_log, logger, LogLevel
-from _utils import get_filtered_list
+from _utils import get_filtered_list, TTLCache, MISSING, Deadline
+from proxy.egress import egress_pool
 
 
 _module_name = "domain.dns_finder"
 
+# Results of the passive collection by target domain, disabled until a long-running process configures it
+passive_cache = TTLCache()
+
 
 # Function for searching subdomains with crt.sh
 @logger(_module_name)
-def _find_subdomains_crtsh(target_domain:str) -> List[str]:
+def _find_subdomains_crtsh(target_domain:str, timeout:float = None) -> List[str]:
+    # requests and dnspython are imported on the first passive collection, not with the domain package
     url = f'https://crt.sh/?q={target_domain}&output=json'
-    response = requests.get(url)
     v_subdomains = []
+    try:
+        # Through the configured egresses (if any), so the rate limit of crt.sh applies to each of them
+        response = egress_pool.request("GET", url, timeout=timeout)
+    except Exception as e:
+        vsc_log.warn_status_result(_module_name, "FAILED", f"crt.sh query error: {e}")
+        return v_subdomains
 
     # Checking the status and availability of data
     if response.status_code == 200:
@@ -34,10 +43,11 @@ def _find_subdomains_crtsh(target_domain:str) -> List[str]:
 
 # Function for searching subdomains using DNS queries (dnspython)
 @logger(_module_name)
-def _find_subdomains_dns(target_domain:str) -> List[str]:
+def _find_subdomains_dns(target_domain:str, timeout:float = None) -> List[str]:
+    import dns.resolver
     v_subdomains = []
     try:
-        result = dns.resolver.resolve(target_domain, 'NS')
+        result = dns.resolver.resolve(target_domain, 'NS', lifetime=timeout)
         for ns in result:
             v_subdomains.append(ns.to_text())
     except Exception as e:
@@ -47,10 +57,10 @@ def _find_subdomains_dns(target_domain:str) -> List[str]:
 
 # Function for collecting subdomains using Subfinder
 @logger(_module_name)
-def _find_subdomains_subfinder(target_domain:str) -> List[str]:
+def _find_subdomains_subfinder(target_domain:str, timeout:float = None) -> List[str]:
     v_subdomains = []
     try:
-        result = subprocess.run(['subfinder', '-d', target_domain, '-silent'], capture_output=True, text=True)
+        result = subprocess.run(['subfinder', '-d', target_domain, '-silent'], capture_output=True, text=True, timeout=timeout)
         if result.returncode == 0:
             v_subdomains = result.stdout.strip().splitlines()
         else:
@@ -62,16 +72,15 @@ def _find_subdomains_subfinder(target_domain:str) -> List[str]:
 
 # Function for collecting subdomains using DNSDumpster
 @logger(_module_name)
-def _find_subdomains_dnsdumpster(target_domain:str) -> List[str]:
+def _find_subdomains_dnsdumpster(target_domain:str, timeout:float = None) -> List[str]:
     url = f"https://dnsdumpster.com/"
     v_subdomains = set()
 
     try:
-        session = requests.Session()
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
-        response = session.get(url, headers=headers, params={'url': target_domain})
+        response = egress_pool.request("GET", url, headers=headers, params={'url': target_domain}, timeout=timeout)
 
         if response.status_code == 200:
             v_subdomains = re.findall(r"([a-zA-Z0-9-]+\.[a-zA-Z0-9-]+\.[a-zA-Z]{2,})", response.text)
@@ -83,14 +92,23 @@ def _find_subdomains_dnsdumpster(target_domain:str) -> List[str]:
 
 # The main function for collecting subdomains
 @logger(_module_name)
-def collect_subdomains(target_domain:str) -> List[str]:
+def collect_subdomains(target_domain:str, timeout:float = BRUTEFORCE_PASSIVE_TIMEOUT) -> List[str]:
+    """
+    :param timeout: Timeout in seconds of the whole collection, each source gets the time left by the previous ones
+    """
+    cached = passive_cache.get(target_domain)
+    if cached is not MISSING:
+        vsc_log.debug_status_result(_module_name, "CACHED", f"Passive collection results for '{target_domain}'")
+        return list(cached)
     all_subdomains = set()
     vsc_log.info_status_result(_module_name, "SCANNING", f"Running DNS scanning of subdomains for '{target_domain}'")
+    deadline = Deadline(timeout)
     # Collecting subdomains using different methods
-    all_subdomains.update(_find_subdomains_crtsh(target_domain))
-    all_subdomains.update(_find_subdomains_dns(target_domain))
-    all_subdomains.update(_find_subdomains_subfinder(target_domain))
-    all_subdomains.update(_find_subdomains_dnsdumpster(target_domain))
+    for find_subdomains in (_find_subdomains_crtsh, _find_subdomains_dns, _find_subdomains_subfinder, _find_subdomains_dnsdumpster):
+        if deadline.expired():
+            vsc_log.warn_status_result(_module_name, "TIMEOUT", f"Passive collection for '{target_domain}' is stopped after {timeout:g}s")
+            break
+        all_subdomains.update(find_subdomains(target_domain, deadline.timeout()))
 
     # Keep only subdomains containing the main domain
     all_subdomains = {sub for sub in all_subdomains if target_domain in sub}
@@ -100,6 +118,9 @@ def collect_subdomains(target_domain:str) -> List[str]:
         vsc_log.warn_status_result(_module_name, "FAILED", f"No subdomains detected for '{target_domain}'")
     else:
         vsc_log.info_status_result(_module_name, "RESOLVED", f"From {target_domain} : {', '.join(all_subdomains)}")
+    if not deadline.expired():
+        # An incomplete collection isn't cached, the next run asks all sources again
+        passive_cache.set(target_domain, tuple(all_subdomains))
     # Returning unique subdomains
     return all_subdomains
 
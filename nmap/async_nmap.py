@@ -1,56 +1,169 @@
 import asyncio
 import subprocess
 import os
+import signal
 import argparse
 import sys
+import time
+from datetime import timedelta
+from typing import Callable, List
 
-from _conf import NMAP_OUTPUT_FOLDER, NMAP_PARAMS, NMAP_ASYNC_PROCESSES, BRUTEFORCE_LEVEL, BRUTEFORCE_FILE
-from _log import vsc_log, logger
-from _utils import async_load_targets, check_internet_connection, start_monitor, stop_monitor, get_filtered_list
+from _conf import NMAP_OUTPUT_FOLDER, NMAP_PARAMS, NMAP_ASYNC_PROCESSES, NMAP_STATS_EVERY, NMAP_HOST_TIMEOUT, NMAP_TIME_BUDGET, \
+    NMAP_KILL_GRACE_PERIOD, NMAP_BASELINE_SWEEP_PARAMS, BRUTEFORCE_LEVEL, BRUTEFORCE_FILE, BRUTEFORCE_DOMAIN_TIMEOUT, ensure_dir, \
+    PROXY_EGRESS_STRATEGY, PROXY_EGRESS_STRATEGIES, PROXY_EGRESS_RATE
+from _log import vsc_log, logger, tracer
+from _utils import async_load_targets, check_internet_connection, start_monitor, stop_monitor, get_filtered_list, Deadline, \
+    iter_bounded
 from domain import limited_resolve_ips
+from nmap.baseline import load_baseline, save_baseline, host_fingerprint, deep_ports, diff_baselines, hosts_to_rescan, write_diff_report
+from nmap.progress import scan_progress
+from proxy.egress import configure_egress, egress_pool
 
 
 _module_name = "nmap.async_nmap"
 
 
+async def _read_lines(stream:asyncio.StreamReader, handle_line):
+    """
+    Reads the stream line by line until EOF, so the process output is never buffered whole in memory.
+    :param stream: Stdout or stderr of the process
+    :param handle_line: Callable, that takes each decoded line without the trailing newline
+    """
+    while True:
+        try:
+            line = await stream.readline()
+        except ValueError:
+            # The line is longer than the stream limit, it is dropped by the reader
+            continue
+        if not line:
+            break
+        handle_line(line.decode(errors="replace").rstrip())
+
+
+def _handle_stdout_line(ip:str, line:str):
+    if not line:
+        return
+    host = scan_progress.update(ip, line)
+    if host is not None:
+        if "Timing:" in line:
+            remaining = f", {timedelta(seconds=host['remaining'])} remaining" if host["remaining"] is not None else ""
+            vsc_log.info_ip_status_result(_module_name, ip, "PROGRESS", f"{host['phase']}: {host['percent']:.2f}% done{remaining}")
+        return
+    vsc_log.info_ip_status_result(_module_name, ip, "OUTPUT", line)
+
+
+def _handle_stderr_line(ip:str, line:str):
+    if line:
+        vsc_log.warn_ip_result(_module_name, ip, f"Error when scanning: {line}")
+
+
+async def _stop_process(process:asyncio.subprocess.Process, grace_period:float = NMAP_KILL_GRACE_PERIOD):
+    """
+    Terminates the process group of nmap and kills it, if it doesn't exit within the grace period.
+    """
+    if process.returncode is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        await asyncio.wait_for(process.wait(), grace_period)
+    except asyncio.TimeoutError:
+        os.killpg(process.pid, signal.SIGKILL)
+        await process.wait()
+    except ProcessLookupError:
+        pass
+
+
+def _save_partial(ip:str, output_file:str, partial_file_name:str):
+    if os.path.exists(output_file):
+        os.replace(output_file, partial_file_name)
+        vsc_log.info_ip_status_result(_module_name, ip, "PARTIAL", f"Partial results saved to '{partial_file_name}'")
+
+
 @logger(_module_name)
-async def _scan_ip(ip:str, nmap_params:str, output_folder:str):
-    finished_file_name = os.path.join(output_folder, f"nmap.async_finished_{ip}.xml")
-    if os.path.exists(finished_file_name):
+async def _scan_ip(ip:str, nmap_params:str, output_folder:str, stats_every:str = NMAP_STATS_EVERY, timeout:float = None,
+                   prefix:str = "nmap.async_", force:bool = False) -> str | None:
+    """
+    Scans the IP with nmap and saves the XML result as '<prefix>finished_<ip>.xml'.
+    :param prefix: Prefix of the result file names
+    :param force: Scan even if the finished result file already exists
+    :return: Path to the finished result file or None, if the scanning failed
+    """
+    finished_file_name = os.path.join(output_folder, f"{prefix}finished_{ip}.xml")
+    if os.path.exists(finished_file_name) and not force:
         vsc_log.info_ip_status_result(_module_name, ip, "SKIPPED", f"The '{finished_file_name}' file already exists.")
-        return
+        return finished_file_name
 
     connection_monitor_id = start_monitor()
 
-    output_file = os.path.join(output_folder, f"nmap.async_{ip}.xml")
+    output_file = os.path.join(output_folder, f"{prefix}{ip}.xml")
+    partial_file_name = os.path.join(output_folder, f"{prefix}partial_{ip}.xml")
     if os.path.exists(output_file):
         vsc_log.info_result(_module_name, f"The '{output_file}' file already exists. It will be overwritten.")
 
+    params = nmap_params.split()
+    if stats_every and "--stats-every" not in params:
+        params += ["--stats-every", stats_every]
+
     vsc_log.info_ip_status_result(_module_name, ip, "SCANNING", f"Starts!")
 
+    process = None
     try:
         process = await asyncio.create_subprocess_exec(
-            "nmap", *nmap_params.split(), "-oX", output_file, ip,
+            "nmap", *params, "-oX", output_file, ip,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
+            stderr=subprocess.PIPE,
+            # Own process group, so nmap can be stopped together with its children
+            start_new_session=True
         )
-        stdout, stderr = await process.communicate()
-
-        vsc_log.info_ip_status_result(_module_name, ip, "FINISHED", f"\n{stdout.decode()}")
-        if stderr:
-            vsc_log.warn_ip_result(_module_name, ip, f"Error when scanning:\n{stderr.decode()}")
+        scan_progress.start(ip)
+        # Both pipes are consumed concurrently, so nmap never blocks on a full pipe
+        await asyncio.wait_for(asyncio.gather(
+            _read_lines(process.stdout, lambda line: _handle_stdout_line(ip, line)),
+            _read_lines(process.stderr, lambda line: _handle_stderr_line(ip, line))
+        ), timeout)
+        return_code = await process.wait()
+        scan_progress.finish(ip, success=return_code == 0)
+        vsc_log.info_status_result(_module_name, "PROGRESS", scan_progress.summary())
+        if return_code != 0:
+            # The result of a failed nmap is incomplete, it is kept as partial and the host isn't finished
+            vsc_log.warn_ip_status_result(_module_name, ip, "FAILED", f"Exit code {return_code}")
+            _save_partial(ip, output_file, partial_file_name)
+            return None
 
+        vsc_log.info_ip_status_result(_module_name, ip, "FINISHED", f"Exit code {return_code}")
         vsc_log.info_result(_module_name, f"File renamed from {output_file} to {finished_file_name}")
-        os.rename(output_file, finished_file_name)
+        os.replace(output_file, finished_file_name)
+        return finished_file_name
 
+    except asyncio.TimeoutError:
+        await _stop_process(process)
+        scan_progress.finish(ip, success=False)
+        vsc_log.warn_ip_status_result(_module_name, ip, "TIMEOUT", f"Scanning is stopped after {timeout:.1f}s")
+        _save_partial(ip, output_file, partial_file_name)
+    except asyncio.CancelledError:
+        if process:
+            await _stop_process(process)
+        scan_progress.finish(ip, success=False)
+        vsc_log.warn_ip_status_result(_module_name, ip, "CANCELLED", "Scanning is cancelled")
+        _save_partial(ip, output_file, partial_file_name)
+        raise
     except Exception as e:
+        if process:
+            await _stop_process(process)
+        scan_progress.finish(ip, success=False)
         vsc_log.error_ip_result(_module_name, ip, f"Error when scanning:\n{e}")
-
-    stop_monitor(connection_monitor_id)
+    finally:
+        stop_monitor(connection_monitor_id)
+    return None
 
 
 @logger(_module_name)
-async def _start_scan(args):
+async def _load_ips(args, deadline:Deadline, on_resolved:Callable[[str, List[str]], None] = None) -> tuple[List[str], dict]:
+    """
+    Collects IPs from the command line or the input file and resolves the given domains.
+    :param on_resolved: Called with each resolved domain or subdomain and its IPs
+    :return: All IPs and the resolved IPs by domain, None for a domain skipped because the time budget was exhausted
+    """
     domains = []
     ips = []
 
@@ -59,35 +172,149 @@ async def _start_scan(args):
         domains = [t.strip() for t in targets if not t.replace('.', '').isdigit()]
         ips = [t.strip() for t in targets if t.replace('.', '').isdigit()]
     else:
-        ips, domains = await async_load_targets(args.input_file)
+        with tracer.span("load targets", file=args.input_file):
+            ips, domains = await async_load_targets(args.input_file)
 
     resolved_ips = []
+    dns_answers = {}
     domains = get_filtered_list(domains)
     if domains:
         domain_ips = await limited_resolve_ips(
             domains=domains,
             max_concurrent=args.async_processes,
             level=args.brute_force_level,
-            brute_force_file=args.brute_force_file
+            brute_force_file=args.brute_force_file,
+            deadline=deadline.child(args.resolve_budget),
+            domain_timeout=args.domain_timeout,
+            on_resolved=on_resolved
         )
-        resolved_ips.extend(domain_ips)
+        resolved_ips.extend(ip for ips_of_domain in domain_ips if ips_of_domain for ip in ips_of_domain)
+        dns_answers = {domain: sorted(ips_of_domain) if ips_of_domain is not None else None
+                       for domain, ips_of_domain in zip(domains, domain_ips)}
 
     all_ips = get_filtered_list(ips + resolved_ips)
     if all_ips:
         vsc_log.info_result(_module_name, f"Starts scanning to: {', '.join(all_ips)}")
     else:
         vsc_log.info_result(_module_name, f"Not found IPs!")
-    tasks = [_scan_ip(ip, args.nmap_params, args.output_folder) for ip in all_ips]
+    return all_ips, dns_answers
+
 
-    # Restriction on parallel processes
-    semaphore = asyncio.Semaphore(args.async_processes)
+@logger(_module_name)
+async def _scan_all(ips:List[str], nmap_params:str, args, deadline:Deadline, **kwargs) -> dict:
+    """
+    Scans the IPs with a limited number of parallel nmap processes within the time budget.
+    :param kwargs: Additional arguments of _scan_ip()
+    :return: Finished result file (or None) by IP
+    """
+    ensure_dir(args.output_folder)
+    results = {}
+    not_started = set()
+    scan_progress.queue(ips)
+    queued = time.perf_counter()
 
-    @logger(_module_name)
-    async def limited_task(task):
-        async with semaphore:
-            await task
+    # A fixed number of workers, a worker takes the next host as soon as its host is finished or timed out
+    async def scan_within_deadline(ip):
+        tracer.add_span("queue wait", queued, time.perf_counter(), lane=ip)
+        if deadline.expired():
+            not_started.add(ip)
+            return None
+        with tracer.span("nmap", lane=ip, params=nmap_params):
+            return await _scan_ip(ip, nmap_params, args.output_folder, args.stats_every,
+                                  timeout=deadline.timeout(args.host_timeout), **kwargs)
 
-    await asyncio.gather(*(limited_task(task) for task in tasks))
+    async for task in iter_bounded(scan_within_deadline, ips, args.async_processes):
+        if task.error:
+            vsc_log.error_ip_result(_module_name, task.item, f"Error when scanning:\n{task.error}")
+        if task.item not in not_started:
+            results[task.item] = task.result
+
+    if not_started:
+        vsc_log.warn_status_result(_module_name, "SKIPPED", f"Time budget is exhausted, {len(not_started)} of {len(ips)} hosts are not scanned")
+    return results
+
+
+@logger(_module_name)
+async def _incremental_scan(args, ips:List[str], dns_answers:dict, deadline:Deadline):
+    """
+    Runs the fast verification sweep for all IPs and the deep scan only for the hosts, that are new or changed
+    against the baseline of the previous run.
+    """
+    old_baseline = load_baseline(args.baseline)
+
+    vsc_log.info_status_result(_module_name, "SWEEP", f"Verification sweep of {len(ips)} hosts")
+    sweep_results = await _scan_all(ips, args.sweep_params, args, deadline, prefix="nmap.sweep_", force=True)
+    # The answers of the skipped domains are unknown, they aren't compared and keep the old answers
+    skipped_domains = sorted(domain for domain, answer in dns_answers.items() if answer is None)
+    new_baseline = {"dns": {domain: answer for domain, answer in dns_answers.items() if answer is not None}, "hosts": {}}
+    for ip, sweep_file in sweep_results.items():
+        if sweep_file:
+            with tracer.span("xml fingerprint", lane=ip, file=sweep_file):
+                new_baseline["hosts"][ip] = host_fingerprint(sweep_file, ip)
+
+    report = diff_baselines(old_baseline, new_baseline)
+    # Hosts without a sweep result can't be compared, they keep the old fingerprint
+    unverified = [ip for ip in ips if ip not in new_baseline["hosts"]]
+    report["unverified_hosts"] = unverified
+    report["removed_hosts"] = [ip for ip in report["removed_hosts"] if ip not in unverified]
+    report["skipped_domains"] = skipped_domains
+
+    rescan = hosts_to_rescan(report)
+    vsc_log.info_status_result(_module_name, "RESCAN", f"Deep scan of {len(rescan)} new or changed hosts, "
+                                                       f"{len(report['unchanged_hosts'])} hosts are unchanged")
+    scan_progress.clear()
+    deep_results = await _scan_all(rescan, args.nmap_params, args, deadline, force=True)
+    report["rescanned_hosts"] = sorted(ip for ip, finished_file in deep_results.items() if finished_file)
+    write_diff_report(report, args.output_folder)
+
+    # A host, that failed the deep scan, keeps its old fingerprint (if any), so it is rescanned by the next run
+    for ip in rescan:
+        if ip not in report["rescanned_hosts"]:
+            new_baseline["hosts"].pop(ip, None)
+    for ip in ips:
+        if ip not in new_baseline["hosts"] and ip in old_baseline["hosts"]:
+            new_baseline["hosts"][ip] = old_baseline["hosts"][ip]
+    for domain in skipped_domains:
+        if domain in old_baseline["dns"]:
+            new_baseline["dns"][domain] = old_baseline["dns"][domain]
+    # The deep scan sees the ports beyond the sweep, they are kept apart, so the next sweep doesn't report them as closed
+    # and the report doesn't see them as new exposures. An unchanged host keeps the ports of its last deep scan
+    for ip, fingerprint in new_baseline["hosts"].items():
+        deep_file = deep_results.get(ip) or os.path.join(args.output_folder, f"nmap.async_finished_{ip}.xml")
+        if deep_results.get(ip) or "deep_ports" not in old_baseline["hosts"].get(ip, {}):
+            if os.path.exists(deep_file):
+                fingerprint["deep_ports"] = deep_ports(deep_file, ip)
+        else:
+            fingerprint["deep_ports"] = old_baseline["hosts"][ip]["deep_ports"]
+    save_baseline(args.baseline, new_baseline)
+
+
+@logger(_module_name)
+async def _start_scan(args):
+    store = None
+    if getattr(args, "results_db", None):
+        # Imported here, the results store is only needed with -rDB
+        from results.store import ResultsStore
+        store = ResultsStore(args.results_db)
+    try:
+        deadline = Deadline(args.time_budget)
+        all_ips, dns_answers = await _load_ips(args, deadline, store.add_resolutions if store else None)
+
+        scan_deadline = deadline.child(args.scan_budget)
+        if args.baseline:
+            await _incremental_scan(args, all_ips, dns_answers, scan_deadline)
+        else:
+            await _scan_all(all_ips, args.nmap_params, args, scan_deadline)
+
+        if store:
+            # The deep scans of both modes are saved as the finished files of the default prefix
+            for ip in all_ips:
+                finished_file_name = os.path.join(args.output_folder, f"nmap.async_finished_{ip}.xml")
+                if os.path.exists(finished_file_name):
+                    store.ingest_nmap_xml(finished_file_name)
+    finally:
+        if store:
+            store.close()
 
 
 @logger(_module_name)
@@ -104,12 +331,37 @@ def main(remaining_args):
                         help=f"Folder path for results (default is the '{NMAP_OUTPUT_FOLDER}' folder)")
     parser.add_argument('-nmap-params', default=NMAP_PARAMS,
                         help=f"Parameters for nmap (default '{NMAP_PARAMS}')")
+    parser.add_argument('-nmap-stats-every', dest='stats_every', default=NMAP_STATS_EVERY,
+                        help=f"Interval of nmap progress reports, empty to disable (default '{NMAP_STATS_EVERY}')")
+    parser.add_argument('-bL', '--baseline', default=None,
+                        help="Path to the baseline JSON file. Enables incremental scanning: only new or changed hosts are deeply scanned")
+    parser.add_argument('-sweep-params', default=NMAP_BASELINE_SWEEP_PARAMS,
+                        help=f"Parameters for nmap of the verification sweep in the baseline mode (default '{NMAP_BASELINE_SWEEP_PARAMS}')")
     parser.add_argument('-aP', '--async-processes', type=int, default=NMAP_ASYNC_PROCESSES,
                         help=f"Number of parallel scanning processes (default is {NMAP_ASYNC_PROCESSES})")
+    parser.add_argument('-hT', '--host-timeout', type=float, default=NMAP_HOST_TIMEOUT,
+                        help=f"Timeout in seconds for scanning of each host (default is {NMAP_HOST_TIMEOUT})")
+    parser.add_argument('-tB', '--time-budget', type=float, default=NMAP_TIME_BUDGET,
+                        help=f"Time budget in seconds for the whole run (default is {NMAP_TIME_BUDGET})")
+    parser.add_argument('-rB', '--resolve-budget', type=float, default=None,
+                        help="Time budget in seconds for the resolving of domains (default is unlimited within the time budget)")
+    parser.add_argument('-sB', '--scan-budget', type=float, default=None,
+                        help="Time budget in seconds for the nmap scanning (default is unlimited within the time budget)")
+    parser.add_argument('-dT', '--domain-timeout', type=float, default=BRUTEFORCE_DOMAIN_TIMEOUT,
+                        help=f"Timeout in seconds for resolving of each domain with its subdomains (default is {BRUTEFORCE_DOMAIN_TIMEOUT})")
     parser.add_argument('-dBL','--brute-force-level',type=int, default=BRUTEFORCE_LEVEL,
                         help=f"Level brute-forcing subdomains (default is {BRUTEFORCE_LEVEL})")
     parser.add_argument('-dBF', '--brute-force-file', default=BRUTEFORCE_FILE,
                         help=f"Path to file with subdomains for brute-forcing (default is {BRUTEFORCE_FILE})")
+    parser.add_argument('-rDB', '--results-db', default=None,
+                        help="Path to the results store, the resolutions and the scanned hosts are added to it (default is not to store them)")
+    parser.add_argument('-eG', '--egress', default=None,
+                        help="Comma-separated SOCKS5 proxies (host:port) or 'ssh' for the tunnels of the SSH servers, "
+                             "the passive collection requests are spread over them (default is direct connections)")
+    parser.add_argument('-eGS', '--egress-strategy', choices=PROXY_EGRESS_STRATEGIES, default=PROXY_EGRESS_STRATEGY,
+                        help=f"Assignment of the requests to the egresses (default is '{PROXY_EGRESS_STRATEGY}')")
+    parser.add_argument('-eGR', '--egress-rate', type=float, default=PROXY_EGRESS_RATE,
+                        help=f"New connections per second of each egress, 0 for unlimited (default is {PROXY_EGRESS_RATE})")
 
     args = parser.parse_args(remaining_args)
 
@@ -117,5 +369,10 @@ def main(remaining_args):
         vsc_log.error_result(_module_name, "Unable to execute script, no internet connection!")
         sys.exit(1)
 
+    if args.egress:
+        configure_egress(args.egress, args.egress_strategy, args.egress_rate)
     # Start scanning
-    asyncio.run(_start_scan(args))
+    try:
+        asyncio.run(_start_scan(args))
+    finally:
+        egress_pool.close()
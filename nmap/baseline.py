@@ -0,0 +1,136 @@
+import json
+import os
+from datetime import datetime
+from typing import List
+
+from _conf import ensure_dir
+from _log import vsc_log, logger
+from nmap.nmap_xml import iter_hosts, service_banner
+
+
+_module_name = "nmap.baseline"
+
+
+@logger(_module_name)
+def load_baseline(path:str) -> dict:
+    """
+    Loads the baseline of the previous run. The 'ports' and 'banners' of a host are the ones of the verification sweep
+    (NMAP_BASELINE_SWEEP_PARAMS, the top ports), its 'deep_ports' are the open ports of its last deep scan (NMAP_PARAMS).
+    :param path: Path to the baseline JSON file
+    :return: Dict with 'dns' (IPs by domain) and 'hosts' (fingerprints by IP), empty if there is no baseline yet
+    """
+    if not os.path.exists(path):
+        vsc_log.info_status_result(_module_name, "NEW", f"No baseline in '{path}', all hosts will be scanned")
+        return {"dns": {}, "hosts": {}}
+    with open(path, 'r') as file:
+        baseline = json.load(file)
+    vsc_log.info_status_result(_module_name, "LOADED", f"Baseline of {len(baseline.get('hosts', {}))} hosts from '{path}'")
+    return {"dns": baseline.get("dns", {}), "hosts": baseline.get("hosts", {})}
+
+
+@logger(_module_name)
+def save_baseline(path:str, baseline:dict):
+    # Written next to the target and renamed, so an interrupted run never leaves a broken baseline
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as file:
+        json.dump({"created": datetime.now().isoformat(), **baseline}, file, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+    vsc_log.info_status_result(_module_name, "SAVED", f"Baseline of {len(baseline['hosts'])} hosts to '{path}'")
+
+
+def _open_ports(xml_file:str, ip:str) -> dict:
+    ports = {}
+    for host in iter_hosts(xml_file):
+        if host["ip"] == ip:
+            ports = {port: data for port, data in host["ports"].items() if data["state"] == "open"}
+    return ports
+
+
+def host_fingerprint(xml_file:str, ip:str) -> dict:
+    """
+    Makes the fingerprint of the host from the XML result of the verification sweep.
+    :return: Dict with sorted open 'ports' and service 'banners' by port
+    """
+    ports = _open_ports(xml_file, ip)
+    return {
+        "ports": sorted(ports),
+        "banners": {port: service_banner(data) for port, data in ports.items()},
+    }
+
+
+def deep_ports(xml_file:str, ip:str) -> List[str]:
+    """
+    :param xml_file: XML result of the deep scan of the host
+    :return: Sorted open ports of the deep scan, they are kept in the fingerprint as 'deep_ports'
+    """
+    return sorted(_open_ports(xml_file, ip))
+
+
+def diff_baselines(old:dict, new:dict) -> dict:
+    """
+    Compares the fingerprints and DNS answers of two runs, only the sweep ports, the deep ports of the unchanged
+    hosts aren't scanned again.
+    :param old: Baseline of the previous run
+    :param new: Baseline of the current run
+    :return: Dict with 'new_hosts', 'removed_hosts', 'changed_hosts' (changes by IP), 'dns_changes' (by domain)
+             and 'unchanged_hosts'
+    """
+    report = {"new_hosts": [], "removed_hosts": [], "changed_hosts": {}, "dns_changes": {}, "unchanged_hosts": []}
+
+    for domain, ips in new["dns"].items():
+        old_ips = set(old["dns"].get(domain, []))
+        added, removed = sorted(set(ips) - old_ips), sorted(old_ips - set(ips))
+        if added or removed:
+            report["dns_changes"][domain] = {"added": added, "removed": removed}
+
+    for ip, fingerprint in new["hosts"].items():
+        old_fingerprint = old["hosts"].get(ip)
+        if old_fingerprint is None:
+            report["new_hosts"].append(ip)
+            continue
+        changes = {}
+        opened = sorted(set(fingerprint["ports"]) - set(old_fingerprint["ports"]))
+        closed = sorted(set(old_fingerprint["ports"]) - set(fingerprint["ports"]))
+        if opened:
+            changes["opened"] = opened
+        if closed:
+            changes["closed"] = closed
+        banners = {port: {"old": old_fingerprint["banners"].get(port), "new": banner}
+                   for port, banner in fingerprint["banners"].items()
+                   if port in old_fingerprint["banners"] and old_fingerprint["banners"][port] != banner}
+        if banners:
+            changes["banners"] = banners
+        domains = sorted(domain for domain, change in report["dns_changes"].items() if ip in change["added"])
+        if domains:
+            changes["dns"] = domains
+        if changes:
+            report["changed_hosts"][ip] = changes
+        else:
+            report["unchanged_hosts"].append(ip)
+
+    report["removed_hosts"] = sorted(set(old["hosts"]) - set(new["hosts"]))
+    return report
+
+
+def hosts_to_rescan(report:dict) -> List[str]:
+    return sorted(set(report["new_hosts"]) | set(report["changed_hosts"]))
+
+
+@logger(_module_name)
+def write_diff_report(report:dict, output_folder:str) -> str:
+    report_file = os.path.join(ensure_dir(output_folder), f"nmap.baseline_diff {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}.json")
+    with open(report_file, 'w') as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+
+    for ip in report["new_hosts"]:
+        vsc_log.info_ip_status_result(_module_name, ip, "NEW", "Host is not in the baseline")
+    for ip, changes in report["changed_hosts"].items():
+        vsc_log.info_ip_status_result(_module_name, ip, "CHANGED", ', '.join(f"{key}: {value}" for key, value in changes.items()))
+    for ip in report["removed_hosts"]:
+        vsc_log.info_ip_status_result(_module_name, ip, "REMOVED", "Host is not scanned anymore")
+    for domain in report.get("skipped_domains", []):
+        vsc_log.warn_status_result(_module_name, "SKIPPED", f"'{domain}' isn't resolved within the time budget, its DNS answer isn't compared")
+    vsc_log.info_status_result(_module_name, "COMPLETE", f"{len(report['new_hosts'])} new, {len(report['changed_hosts'])} changed, "
+                                                         f"{len(report['unchanged_hosts'])} unchanged, {len(report['removed_hosts'])} removed hosts. "
+                                                         f"Diff report saved to '{report_file}'")
+    return report_file
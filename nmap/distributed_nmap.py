@@ -0,0 +1,291 @@
+import argparse
+import asyncio
+import os
+import posixpath
+import shlex
+from collections import deque
+from typing import List
+
+from _conf import NMAP_OUTPUT_FOLDER, NMAP_PARAMS, NMAP_ASYNC_PROCESSES, NMAP_HOST_TIMEOUT, NMAP_TIME_BUDGET, NMAP_FLEET_SLOTS, \
+    NMAP_FLEET_PREFETCH, NMAP_FLEET_MAX_ATTEMPTS, NMAP_FLEET_REMOTE_FOLDER, BRUTEFORCE_LEVEL, BRUTEFORCE_FILE, \
+    BRUTEFORCE_DOMAIN_TIMEOUT, PROXY_JSON_FILE, PROXY_POOL_RECONNECT_BACKOFF, ensure_dir
+from _log import vsc_log, logger
+from _utils import load_external_servers, Deadline
+from nmap.async_nmap import _load_ips
+from nmap.progress import scan_progress
+from proxy import ManagerSSH, ServerSSH
+
+
+_module_name = "nmap.distributed_nmap"
+
+
+class FleetScheduler:
+    """
+    Work queue of nmap jobs shared by the nodes of the SSH fleet.
+
+    Every node prefetches a few jobs into its own queue. A node, that has run out of jobs, steals from the tail of
+    the longest queue of another node, so a node, that falls behind, doesn't hold back the jobs it has prefetched.
+    Jobs of a dead node are returned to the shared queue without counting an attempt, a job, that fails on a healthy
+    node, is retried up to `max_attempts` times.
+    """
+    def __init__(self, ips:List[str], prefetch:int = NMAP_FLEET_PREFETCH, max_attempts:int = NMAP_FLEET_MAX_ATTEMPTS):
+        self._pending = deque({"ip": ip, "attempts": 0} for ip in ips)
+        self._local = {}
+        self._prefetch = max(1, prefetch)
+        self._max_attempts = max_attempts
+        self._in_flight = 0
+        self._changed = asyncio.Condition()
+
+        self.finished = []
+        self.failed = []
+
+    def register(self, node:str):
+        self._local[node] = deque()
+
+    def is_registered(self, node:str) -> bool:
+        return node in self._local
+
+    def _take(self, node:str) -> dict | None:
+        local = self._local[node]
+        if not local:
+            for _ in range(min(self._prefetch, len(self._pending))):
+                local.append(self._pending.popleft())
+        if not local:
+            victim = max(self._local, key=lambda other: len(self._local[other]) if other != node else -1, default=None)
+            if victim and victim != node and self._local[victim]:
+                # Steal half of the prefetched jobs from the tail of the slowest node
+                for _ in range(max(1, len(self._local[victim]) // 2)):
+                    local.append(self._local[victim].pop())
+                vsc_log.debug_status_result(_module_name, "STOLEN", f"Node {node} took {len(local)} jobs from {victim}")
+        return local.popleft() if local else None
+
+    async def next_job(self, node:str) -> dict | None:
+        """
+        Waits for the next job of the node.
+        :return: Job or None, if the node is dropped or there is nothing left to do
+        """
+        async with self._changed:
+            while self.is_registered(node):
+                job = self._take(node)
+                if job:
+                    self._in_flight += 1
+                    return job
+                if not self._in_flight:
+                    return None
+                # Jobs in flight can still come back from a dead node
+                await self._changed.wait()
+            return None
+
+    async def done(self, job:dict):
+        async with self._changed:
+            self._in_flight -= 1
+            self.finished.append(job["ip"])
+            self._changed.notify_all()
+
+    async def retry(self, job:dict):
+        async with self._changed:
+            self._in_flight -= 1
+            job["attempts"] += 1
+            if job["attempts"] >= self._max_attempts:
+                self.failed.append(job["ip"])
+                vsc_log.error_ip_status_result(_module_name, job["ip"], "FAILED", f"Giving up after {job['attempts']} attempts")
+            else:
+                self._pending.appendleft(job)
+            self._changed.notify_all()
+
+    async def release(self, job:dict):
+        """Returns the job to the shared queue without counting an attempt."""
+        async with self._changed:
+            self._in_flight -= 1
+            self._pending.appendleft(job)
+            self._changed.notify_all()
+
+    async def drop_node(self, node:str):
+        """Removes the dead node and returns its prefetched jobs to the shared queue."""
+        async with self._changed:
+            local = self._local.pop(node, deque())
+            self._pending.extendleft(reversed(local))
+            self._changed.notify_all()
+
+    def unscheduled(self) -> List[str]:
+        return [job["ip"] for job in self._pending] + [job["ip"] for local in self._local.values() for job in local]
+
+
+def _run_remote_scan(server:ServerSSH, ip:str, nmap_params:str, remote_folder:str, output_folder:str, timeout:float = None) -> str:
+    """
+    Runs nmap for the IP on the remote server and downloads the XML result via SFTP.
+    :return: Path to the finished XML file
+    :raises ConnectionError: If the SSH connection is lost
+    :raises RuntimeError: If nmap doesn't produce a complete XML file
+    """
+    remote_file = posixpath.join(remote_folder, f"nmap.async_{ip}.xml")
+    output_file = os.path.join(output_folder, f"nmap.async_{ip}.xml")
+    finished_file_name = os.path.join(output_folder, f"nmap.async_finished_{ip}.xml")
+
+    nmap_command = ' '.join(shlex.quote(param) for param in ["nmap", *nmap_params.split(), "-oX", remote_file, ip])
+    if timeout:
+        # The remote side enforces the host timeout itself, so a lost connection doesn't leave nmap running
+        nmap_command = f"timeout {max(1, int(timeout))} {nmap_command}"
+    stdout, stderr = server.execute_command(f"mkdir -p {shlex.quote(remote_folder)} && {nmap_command}")
+    if stdout is None:
+        raise ConnectionError(f"SSH connection to {server.str_remote} is not established")
+    if stderr:
+        vsc_log.warn_ip_result(_module_name, ip, f"Error when scanning on {server.str_remote}:\n{stderr}")
+
+    # Each attempt runs nmap again, so a partial download of an earlier attempt isn't resumed
+    server.sftp_download(remote_file, output_file, resume=False)
+    server.execute_command(f"rm -f {shlex.quote(remote_file)}")
+
+    with open(output_file, 'rb') as file:
+        file.seek(max(0, os.path.getsize(output_file) - 256))
+        if b"</nmaprun>" not in file.read():
+            raise RuntimeError(f"Incomplete XML result '{output_file}'")
+    os.rename(output_file, finished_file_name)
+    return finished_file_name
+
+
+@logger(_module_name)
+async def distributed_scan(servers:List[ServerSSH], ips:List[str], nmap_params:str = NMAP_PARAMS, output_folder:str = NMAP_OUTPUT_FOLDER,
+                           slots:int = NMAP_FLEET_SLOTS, prefetch:int = NMAP_FLEET_PREFETCH, max_attempts:int = NMAP_FLEET_MAX_ATTEMPTS,
+                           remote_folder:str = NMAP_FLEET_REMOTE_FOLDER, host_timeout:float = NMAP_HOST_TIMEOUT,
+                           deadline:Deadline = None) -> dict:
+    """
+    Scans the IPs with nmap on the connected SSH servers.
+
+    :param servers: Connected servers of the fleet
+    :param ips: IPs to scan, IPs with an existing finished XML file are skipped
+    :param slots: Number of parallel nmap processes on each server
+    :param prefetch: Number of jobs, that each server takes from the shared queue at once
+    :param max_attempts: Number of attempts for each IP before giving up
+    :param remote_folder: Folder for the XML results on the servers
+    :param host_timeout: Timeout in seconds for scanning of each host
+    :param deadline: Time budget of the scanning, jobs are not started after it
+    :return: Dict with the 'finished', 'failed' and 'unscheduled' IPs
+    """
+    ensure_dir(output_folder)
+    todo = []
+    for ip in ips:
+        finished_file_name = os.path.join(output_folder, f"nmap.async_finished_{ip}.xml")
+        if os.path.exists(finished_file_name):
+            vsc_log.info_ip_status_result(_module_name, ip, "SKIPPED", f"The '{finished_file_name}' file already exists.")
+        else:
+            todo.append(ip)
+
+    deadline = deadline if deadline else Deadline()
+    scheduler = FleetScheduler(todo, prefetch, max_attempts)
+    scan_progress.queue(todo)
+
+    async def node_slot(server:ServerSSH):
+        node = server.str_remote
+        while job := await scheduler.next_job(node):
+            if deadline.expired():
+                await scheduler.release(job)
+                return
+            ip = job["ip"]
+            scan_progress.start(ip)
+            vsc_log.info_ip_status_result(_module_name, ip, "SCANNING", f"Starts on {node}")
+            try:
+                finished_file_name = await asyncio.to_thread(_run_remote_scan, server, ip, nmap_params, remote_folder, output_folder,
+                                                          deadline.timeout(host_timeout))
+                scan_progress.finish(ip)
+                await scheduler.done(job)
+                vsc_log.info_ip_status_result(_module_name, ip, "FINISHED", f"Result of {node} saved to '{finished_file_name}'")
+                vsc_log.info_status_result(_module_name, "PROGRESS", scan_progress.summary())
+            except Exception as e:
+                scan_progress.finish(ip, success=False)
+                if isinstance(e, (ConnectionError, EOFError)) or not server.is_alive():
+                    # The node failed, not the job: it is requeued without counting an attempt
+                    vsc_log.warn_ip_status_result(_module_name, ip, "REQUEUED", f"Node {node} is lost while scanning: {e}")
+                    await scheduler.release(job)
+                else:
+                    vsc_log.warn_ip_status_result(_module_name, ip, "RETRY", f"Scanning on {node} failed: {e}")
+                    await scheduler.retry(job)
+                if not server.is_alive():
+                    # A lost connection is re-established by the pool of the server, the node is dropped if it can't reconnect
+                    await asyncio.sleep(PROXY_POOL_RECONNECT_BACKOFF)
+                    await asyncio.to_thread(server.connect)
+                if not server.is_alive():
+                    vsc_log.error_ip_status_result(_module_name, node, "DEAD", "Node is lost, its jobs are re-queued")
+                    await scheduler.drop_node(node)
+                    return
+
+    for server in servers:
+        scheduler.register(server.str_remote)
+    await asyncio.gather(*(node_slot(server) for server in servers for _ in range(slots)))
+
+    unscheduled = scheduler.unscheduled()
+    if unscheduled:
+        vsc_log.error_status_result(_module_name, "SKIPPED", f"No alive nodes or time left, not scanned: {', '.join(unscheduled)}")
+    return {"finished": scheduler.finished, "failed": scheduler.failed, "unscheduled": unscheduled}
+
+
+@logger(_module_name)
+async def _start_distributed_scan(args):
+    manager = ManagerSSH(load_external_servers(["ssh"], args.proxy_json))
+    manager.connect_all()
+    servers = [server for server in manager.get_all_servers() if server.is_alive()]
+    if not servers:
+        vsc_log.error_result(_module_name, "No connected SSH servers, unable to distribute scanning!")
+        return
+
+    try:
+        deadline = Deadline(args.time_budget)
+        ips, _ = await _load_ips(args, deadline)
+        await distributed_scan(
+            servers=servers,
+            ips=ips,
+            nmap_params=args.nmap_params,
+            output_folder=args.output_folder,
+            slots=args.slots,
+            prefetch=args.prefetch,
+            max_attempts=args.max_attempts,
+            remote_folder=args.remote_folder,
+            host_timeout=args.host_timeout,
+            deadline=deadline
+        )
+    finally:
+        manager.disconnect_all()
+
+
+@logger(_module_name)
+def main(remaining_args):
+    parser = argparse.ArgumentParser(description="Distributed scanning with Nmap over the SSH servers of the proxy JSON file.")
+
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('-iF', '--input-file', type=str,
+                        help="Path to the IP addresses or domains included file")
+    group.add_argument('-ips', '--ip-addresses', type=str,
+                        help="List of IP addresses or domains, comma separated (no spaces), to be checked")
+
+    parser.add_argument('-oF', '--output-folder', default=NMAP_OUTPUT_FOLDER,
+                        help=f"Folder path for results (default is the '{NMAP_OUTPUT_FOLDER}' folder)")
+    parser.add_argument('-nmap-params', default=NMAP_PARAMS,
+                        help=f"Parameters for nmap (default '{NMAP_PARAMS}')")
+    parser.add_argument('-pJ', '--proxy-json', default=PROXY_JSON_FILE,
+                        help=f"Path to the JSON file with SSH servers (default is '{PROXY_JSON_FILE}')")
+    parser.add_argument('-sN', '--slots', type=int, default=NMAP_FLEET_SLOTS,
+                        help=f"Number of parallel nmap processes on each server (default is {NMAP_FLEET_SLOTS})")
+    parser.add_argument('-pF', '--prefetch', type=int, default=NMAP_FLEET_PREFETCH,
+                        help=f"Number of jobs, that each server takes at once (default is {NMAP_FLEET_PREFETCH})")
+    parser.add_argument('-mA', '--max-attempts', type=int, default=NMAP_FLEET_MAX_ATTEMPTS,
+                        help=f"Number of attempts for each host (default is {NMAP_FLEET_MAX_ATTEMPTS})")
+    parser.add_argument('-rF', '--remote-folder', default=NMAP_FLEET_REMOTE_FOLDER,
+                        help=f"Folder for results on the servers (default is '{NMAP_FLEET_REMOTE_FOLDER}')")
+    parser.add_argument('-hT', '--host-timeout', type=float, default=NMAP_HOST_TIMEOUT,
+                        help=f"Timeout in seconds for scanning of each host (default is {NMAP_HOST_TIMEOUT})")
+    parser.add_argument('-tB', '--time-budget', type=float, default=NMAP_TIME_BUDGET,
+                        help=f"Time budget in seconds for the whole run (default is {NMAP_TIME_BUDGET})")
+    parser.add_argument('-rB', '--resolve-budget', type=float, default=None,
+                        help="Time budget in seconds for the resolving of domains (default is unlimited within the time budget)")
+    parser.add_argument('-dT', '--domain-timeout', type=float, default=BRUTEFORCE_DOMAIN_TIMEOUT,
+                        help=f"Timeout in seconds for resolving of each domain with its subdomains (default is {BRUTEFORCE_DOMAIN_TIMEOUT})")
+    parser.add_argument('-aP', '--async-processes', type=int, default=NMAP_ASYNC_PROCESSES,
+                        help=f"Number of parallel resolving processes (default is {NMAP_ASYNC_PROCESSES})")
+    parser.add_argument('-dBL','--brute-force-level',type=int, default=BRUTEFORCE_LEVEL,
+                        help=f"Level brute-forcing subdomains (default is {BRUTEFORCE_LEVEL})")
+    parser.add_argument('-dBF', '--brute-force-file', default=BRUTEFORCE_FILE,
+                        help=f"Path to file with subdomains for brute-forcing (default is {BRUTEFORCE_FILE})")
+
+    args = parser.parse_args(remaining_args)
+
+    asyncio.run(_start_distributed_scan(args))
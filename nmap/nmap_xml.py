@@ -0,0 +1,58 @@
+import xml.etree.ElementTree as ElementTree
+from typing import Iterator
+
+from _log import vsc_log
+
+
+_module_name = "nmap.nmap_xml"
+
+
+def _parse_host(host_elem:ElementTree.Element) -> dict:
+    address = next((addr.get("addr") for addr in host_elem.iter("address") if addr.get("addrtype") in ("ipv4", "ipv6")), None)
+    status = host_elem.find("status")
+    ports = {}
+    for port_elem in host_elem.iterfind("ports/port"):
+        state = port_elem.find("state")
+        service = port_elem.find("service")
+        ports[f"{port_elem.get('portid')}/{port_elem.get('protocol')}"] = {
+            "state": state.get("state") if state is not None else None,
+            "service": service.get("name") if service is not None else None,
+            "product": service.get("product") if service is not None else None,
+            "version": service.get("version") if service is not None else None,
+            "extrainfo": service.get("extrainfo") if service is not None else None,
+            "scripts": {script.get("id"): script.get("output") for script in port_elem.iterfind("script")},
+        }
+    return {
+        "ip": address,
+        "state": status.get("state") if status is not None else None,
+        "hostnames": [hostname.get("name") for hostname in host_elem.iterfind("hostnames/hostname")],
+        "user_hostnames": [hostname.get("name") for hostname in host_elem.iterfind("hostnames/hostname[@type='user']")],
+        "ports": ports,
+        "scripts": {script.get("id"): script.get("output") for script in host_elem.iterfind("hostscript/script")},
+    }
+
+
+def iter_hosts(xml_file:str) -> Iterator[dict]:
+    """
+    Streams the hosts of an nmap XML file, only one host element is kept in memory at a time.
+    Hosts of an incomplete (partial) file are returned up to the broken part.
+
+    :param xml_file: Path to the nmap XML file
+    :return: Iterator of dicts with 'ip', 'state', 'hostnames', 'user_hostnames' (the names of the targets, without the PTR names),
+             'ports' (by 'port/protocol') and host 'scripts'
+    """
+    try:
+        for _, elem in ElementTree.iterparse(xml_file, events=("end",)):
+            if elem.tag == "host":
+                yield _parse_host(elem)
+                elem.clear()
+    except ElementTree.ParseError as e:
+        vsc_log.debug_status_result(_module_name, "PARSEERROR", f"Incomplete XML file '{xml_file}': {e}")
+
+
+def service_banner(port:dict) -> str:
+    """
+    :param port: Port dict of a host from iter_hosts()
+    :return: Service banner made of the name, product, version and extra info
+    """
+    return ' '.join(filter(None, (port.get("service"), port.get("product"), port.get("version"), port.get("extrainfo"))))
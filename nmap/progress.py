@@ -0,0 +1,153 @@
+import re
+import time
+from datetime import timedelta
+from typing import Callable, List
+
+from _log import vsc_log
+
+
+_module_name = "nmap.progress"
+
+# Example: "SYN Stealth Scan Timing: About 15.20% done; ETC: 14:32 (0:00:56 remaining)"
+_TIMING_RE = re.compile(r"^(?P<phase>.+?) Timing: About (?P<percent>\d+(?:\.\d+)?)% done"
+                        r"(?:; ETC: (?P<etc>\d+:\d+) \((?P<remaining>\d+:\d+:\d+) remaining\))?")
+# Example: "Stats: 0:01:12 elapsed; 0 hosts completed (1 up), 1 undergoing Service Scan"
+_STATS_RE = re.compile(r"^Stats: (?P<elapsed>\d+:\d+:\d+) elapsed;")
+
+
+def _to_seconds(hms:str) -> int:
+    hours, minutes, seconds = (int(part) for part in hms.split(':'))
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def parse_progress_line(line:str) -> dict | None:
+    """
+    Parses a single line of nmap '--stats-every' output.
+    :param line: Line of nmap stdout without trailing newline
+    :return: Dict with 'phase', 'percent' and 'remaining' (seconds or None), dict with 'elapsed' or None
+    """
+    match = _TIMING_RE.match(line)
+    if match:
+        remaining = match.group("remaining")
+        return {
+            "phase": match.group("phase"),
+            "percent": float(match.group("percent")),
+            "remaining": _to_seconds(remaining) if remaining else None,
+        }
+    match = _STATS_RE.match(line)
+    if match:
+        return {"elapsed": _to_seconds(match.group("elapsed"))}
+    return None
+
+
+class ProgressTracker:
+    """
+    Keeps the latest progress state of every nmap process and notifies subscribers with structured events.
+
+    Every event is a dict with the 'event' ('started', 'progress', 'finished' or 'failed'), 'ip' and 'timestamp' keys,
+    'progress' events also contain 'phase', 'percent', 'remaining' and 'elapsed'.
+    """
+    def __init__(self):
+        self._hosts = {}
+        self._running = set()
+        self._counts = {"queued": 0, "running": 0, "finished": 0, "failed": 0}
+        self._subscribers = []
+
+    def subscribe(self, callback:Callable[[dict], None]):
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback:Callable[[dict], None]):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def _emit(self, event:str, ip:str, **data):
+        payload = {"event": event, "ip": ip, "timestamp": time.time(), **data}
+        for callback in list(self._subscribers):
+            try:
+                callback(payload)
+            except Exception as e:
+                vsc_log.warn_ip_status_result(_module_name, ip, "ERROR", f"Progress subscriber failed: {e}")
+
+    def _set_state(self, ip:str, state:str) -> dict:
+        host = self._hosts.get(ip)
+        if host is None:
+            host = self._hosts[ip] = {"state": state, "phase": None, "percent": 0.0, "remaining": None, "elapsed": 0}
+        else:
+            self._counts[host["state"]] -= 1
+            host["state"] = state
+        self._counts[state] += 1
+        if state == "running":
+            self._running.add(ip)
+        else:
+            self._running.discard(ip)
+        return host
+
+    def queue(self, ips:List[str]):
+        """Registers hosts waiting for a free scanning slot, so the aggregate view knows the whole scope."""
+        for ip in ips:
+            if ip not in self._hosts:
+                self._set_state(ip, "queued")
+
+    def start(self, ip:str):
+        host = self._set_state(ip, "running")
+        host.update(phase=None, percent=0.0, remaining=None, elapsed=0)
+        self._emit("started", ip)
+
+    def update(self, ip:str, line:str) -> dict | None:
+        """
+        Updates the host state from a line of nmap output.
+        :return: Updated host state if the line was a progress line, otherwise None
+        """
+        parsed = parse_progress_line(line)
+        if parsed is None:
+            return None
+        host = self._hosts.get(ip) or self._set_state(ip, "running")
+        host.update(parsed)
+        if "percent" in parsed:
+            self._emit("progress", ip, phase=host["phase"], percent=host["percent"],
+                       remaining=host["remaining"], elapsed=host["elapsed"])
+        return host
+
+    def finish(self, ip:str, success:bool = True):
+        host = self._set_state(ip, "finished" if success else "failed")
+        host["remaining"] = 0 if success else None
+        if success:
+            host["percent"] = 100.0
+        self._emit("finished" if success else "failed", ip)
+
+    def host(self, ip:str) -> dict | None:
+        host = self._hosts.get(ip)
+        return dict(host) if host else None
+
+    def snapshot(self) -> dict:
+        """
+        Returns an aggregate view of all tracked hosts.
+        :return: Dict with host counts, overall progress in percent and the longest remaining time of running hosts
+        """
+        total = len(self._hosts)
+        remaining = [self._hosts[ip]["remaining"] for ip in self._running if self._hosts[ip]["remaining"] is not None]
+        done_percent = 100.0 * (self._counts["finished"] + self._counts["failed"])
+        running_percent = sum(self._hosts[ip]["percent"] for ip in self._running)
+        return {
+            "total": total,
+            **self._counts,
+            "percent": (done_percent + running_percent) / total if total else 100.0,
+            "remaining": max(remaining) if remaining else None,
+        }
+
+    def running_hosts(self) -> List[str]:
+        return list(self._running)
+
+    def summary(self) -> str:
+        snapshot = self.snapshot()
+        remaining = f", up to {timedelta(seconds=snapshot['remaining'])} remaining" if snapshot["remaining"] is not None else ""
+        return (f"{snapshot['finished'] + snapshot['failed']}/{snapshot['total']} hosts done "
+                f"({snapshot['failed']} failed, {snapshot['running']} running), {snapshot['percent']:.2f}% overall{remaining}")
+
+    def clear(self):
+        self._hosts.clear()
+        self._running.clear()
+        self._counts = dict.fromkeys(self._counts, 0)
+
+
+scan_progress = ProgressTracker()
@@ -1,2 +1,18 @@
-from .ssh_manager import ManagerSSH, instance_ssh_manager
-from .ssh_server import ServerSSH
+import importlib
+
+
+# The submodules import paramiko and the manager reads the proxy JSON file, so they are loaded on the first access
+_lazy_attributes = {
+    "ManagerSSH": "ssh_manager",
+    "get_ssh_manager": "ssh_manager",
+    "instance_ssh_manager": "ssh_manager",
+    "ServerSSH": "ssh_server",
+    "BalancerSSH": "balancer",
+    "PoolSSH": "ssh_pool",
+}
+
+
+def __getattr__(name):
+    if name in _lazy_attributes:
+        return getattr(importlib.import_module(f".{_lazy_attributes[name]}", __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,202 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator
+
+from _conf import PROXY_BALANCER_STRATEGY, PROXY_BALANCER_STRATEGIES, PROXY_BALANCER_HEALTH_INTERVAL, PROXY_BALANCER_HEALTH_TIMEOUT, \
+    PROXY_BALANCER_EWMA_ALPHA, PROXY_BALANCER_MAX_FAILURES, PROXY_BALANCER_MAX_ERROR_RATE, PROXY_BALANCER_EJECT_BACKOFF, \
+    PROXY_BALANCER_MAX_EJECT_BACKOFF
+from _log import vsc_log
+from proxy.ssh_server import ServerSSH
+
+
+_module_name = "proxy.balancer"
+
+
+class ServerHealth:
+    """Health of a server: round trip time and error rate as moving averages, requests in flight and ejection."""
+    __slots__ = ("rtt", "error_rate", "active", "failures", "requests", "ejected_until", "backoff")
+
+    def __init__(self):
+        self.rtt = None
+        self.error_rate = 0.0
+        self.active = 0
+        # Consecutive failures
+        self.failures = 0
+        self.requests = 0
+        self.ejected_until = None
+        self.backoff = PROXY_BALANCER_EJECT_BACKOFF
+
+    @property
+    def ejected(self) -> bool:
+        return self.ejected_until is not None
+
+    def to_dict(self) -> dict:
+        return {"rtt": round(self.rtt, 4) if self.rtt is not None else None, "error_rate": round(self.error_rate, 3),
+                "active": self.active, "failures": self.failures, "requests": self.requests, "ejected": self.ejected,
+                "readmit_in": round(max(0.0, self.ejected_until - time.monotonic()), 1) if self.ejected else None}
+
+
+class BalancerSSH:
+    """
+    Picks the server for the next request by its health instead of at random.
+
+    The requests update the error rate and the number of requests in flight, the background health checks measure
+    the round trip time and detect lost connections. A server is ejected after several consecutive failures or with
+    a high error rate. An ejected server gets a health check after its backoff, a passed check re-admits it and
+    a failed one doubles the backoff. If all servers are ejected, the alive ones are still used.
+    """
+    def __init__(self, servers:Dict[str, ServerSSH], strategy:str = PROXY_BALANCER_STRATEGY,
+                 health_interval:float = PROXY_BALANCER_HEALTH_INTERVAL, health_timeout:float = PROXY_BALANCER_HEALTH_TIMEOUT):
+        """
+        :param servers: Servers by hostname
+        :param strategy: 'least-load' picks the server with the fewest requests and proxy connections in flight,
+                         'latency' picks at random weighted by the round trip time, the load and the error rate
+        :param health_interval: Interval in seconds between the health checks
+        :param health_timeout: Timeout in seconds of a health check
+        """
+        if strategy not in PROXY_BALANCER_STRATEGIES:
+            raise ValueError(f"Unknown balancing strategy '{strategy}', expected one of {', '.join(PROXY_BALANCER_STRATEGIES)}")
+        self.servers = servers
+        self.strategy = strategy
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.health = {host: ServerHealth() for host in servers}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _load(self, host:str) -> int:
+        return self.health[host].active + self.servers[host].active_connections
+
+    def pick(self, exclude:Iterable[str] = ()) -> ServerSSH | None:
+        """
+        :param exclude: Hostnames, that are not picked, e.g. the servers of the failed attempts
+        :return: Server for the next request, None if there is no admitted or alive server
+        """
+        exclude = set(exclude)
+        with self._lock:
+            candidates = [host for host, health in self.health.items() if host not in exclude and not health.ejected]
+            if not candidates:
+                # Panic mode: an ejected but alive server is better than none
+                candidates = [host for host in self.health if host not in exclude and self.servers[host].is_alive()]
+            if not candidates:
+                return None
+            if self.strategy == "least-load":
+                host = min(candidates, key=lambda host: (self._load(host), self.health[host].rtt or 0.0, random.random()))
+            else:
+                known = [self.health[host].rtt for host in candidates if self.health[host].rtt is not None]
+                # A server without a measured round trip time is treated as the fastest one, so it gets measured
+                fastest = min(known) if known else 1.0
+                weights = [(1.0 - self.health[host].error_rate + 0.01) / ((self.health[host].rtt or fastest) * (1 + self._load(host)))
+                           for host in candidates]
+                host = random.choices(candidates, weights)[0]
+            return self.servers[host]
+
+    @contextmanager
+    def track(self, server:ServerSSH) -> Iterator[ServerSSH]:
+        """
+        Counts the request as in flight on the server and records its success or failure.
+        """
+        health = self.health[server.remote_host]
+        with self._lock:
+            health.active += 1
+        try:
+            yield server
+        except Exception as e:
+            self.record_failure(server.remote_host, str(e))
+            raise
+        else:
+            self.record_success(server.remote_host)
+        finally:
+            with self._lock:
+                health.active -= 1
+
+    def record_success(self, host:str, rtt:float = None):
+        """
+        :param rtt: Measured round trip time in seconds (if any)
+        """
+        with self._lock:
+            health = self.health[host]
+            health.requests += 1
+            health.failures = 0
+            health.error_rate *= 1 - PROXY_BALANCER_EWMA_ALPHA
+            if rtt is not None:
+                health.rtt = rtt if health.rtt is None else health.rtt + PROXY_BALANCER_EWMA_ALPHA * (rtt - health.rtt)
+            if health.ejected:
+                health.ejected_until = None
+                vsc_log.info_ip_status_result(_module_name, host, "READMITTED", f"Passed the health check after {health.backoff:g}s")
+            else:
+                # The server stays healthy after its re-admission
+                health.backoff = PROXY_BALANCER_EJECT_BACKOFF
+
+    def record_failure(self, host:str, reason:str):
+        with self._lock:
+            health = self.health[host]
+            health.requests += 1
+            health.failures += 1
+            health.error_rate += PROXY_BALANCER_EWMA_ALPHA * (1.0 - health.error_rate)
+            if health.ejected:
+                # Failed the check after the backoff
+                health.backoff = min(health.backoff * 2, PROXY_BALANCER_MAX_EJECT_BACKOFF)
+                health.ejected_until = time.monotonic() + health.backoff
+                vsc_log.warn_ip_status_result(_module_name, host, "EJECTED", f"Still failing ({reason}), next check in {health.backoff:g}s")
+            elif health.failures >= PROXY_BALANCER_MAX_FAILURES or health.error_rate >= PROXY_BALANCER_MAX_ERROR_RATE \
+                    or not self.servers[host].is_alive():
+                health.ejected_until = time.monotonic() + health.backoff
+                vsc_log.warn_ip_status_result(_module_name, host, "EJECTED", f"{reason} ({health.failures} consecutive failures, "
+                                                                             f"error rate {health.error_rate:.2f}), next check in {health.backoff:g}s")
+
+    def check(self, host:str):
+        """
+        Health check of the server: a lost connection of an ejected server is re-established and the round trip
+        time of a new channel is measured.
+        """
+        server = self.servers[host]
+        if not server.is_alive() and self.health[host].ejected:
+            server.connect()
+        rtt = server.ping(self.health_timeout)
+        if rtt is None:
+            self.record_failure(host, "Health check failed" if server.is_alive() else "Connection is lost")
+        else:
+            self.record_success(host, rtt)
+
+    def check_all(self):
+        """Checks the admitted servers and the ejected ones, whose backoff is over, in parallel."""
+        now = time.monotonic()
+        hosts = [host for host, health in self.health.items() if not health.ejected or health.ejected_until <= now]
+        if hosts:
+            with ThreadPoolExecutor(max_workers=min(len(hosts), 16), thread_name_prefix="ssh-health") as executor:
+                list(executor.map(self.check, hosts))
+
+    def _run_health_checks(self):
+        while not self._stop_event.is_set():
+            try:
+                self.check_all()
+            except Exception as e:
+                vsc_log.error_status_result(_module_name, "ERROR", f"Health check failed: {e}")
+            self._stop_event.wait(self.health_interval)
+
+    def start(self):
+        """Starts the background health checks, the first round runs right away."""
+        if self._thread:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run_health_checks, name="ssh-health", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self._thread:
+            return
+        self._stop_event.set()
+        self._thread.join(self.health_timeout)
+        self._thread = None
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        :return: Health of each server by hostname
+        """
+        with self._lock:
+            return {host: {**health.to_dict(), "load": self._load(host)} for host, health in self.health.items()}
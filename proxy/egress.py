@@ -0,0 +1,352 @@
+import asyncio
+import ipaddress
+import itertools
+import threading
+import time
+import zlib
+from typing import List, Optional
+from urllib.parse import urlsplit
+
+from _conf import PROXY_EGRESS_STRATEGY, PROXY_EGRESS_STRATEGIES, PROXY_EGRESS_RATE, PROXY_EGRESS_BURST, PROXY_EGRESS_MAX_FAILURES, \
+    PROXY_EGRESS_BACKOFF, PROXY_EGRESS_MAX_BACKOFF, PROXY_EGRESS_ATTEMPTS, PROXY_EGRESS_TIMEOUT
+from _log import vsc_log, logger
+
+
+_module_name = "proxy.egress"
+
+
+class Egress:
+    """
+    SOCKS5 proxy used as an egress, with a token bucket of its new connections and its failures.
+    """
+    __slots__ = ("host", "port", "rate", "burst", "_tokens", "_updated", "active", "requests", "failures", "disabled_until", "backoff")
+
+    def __init__(self, host:str, port:int, rate:float = PROXY_EGRESS_RATE, burst:int = PROXY_EGRESS_BURST):
+        """
+        :param rate: New connections per second, 0 for unlimited
+        :param burst: Connections opened at once after an idle period
+        """
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self.active = 0
+        self.requests = 0
+        # Consecutive failures
+        self.failures = 0
+        self.disabled_until = None
+        self.backoff = PROXY_EGRESS_BACKOFF
+
+    @property
+    def url(self) -> str:
+        # socks5h: the names are resolved by the proxy, so the DNS lookups leave through the egress too
+        return f"socks5h://{self.host}:{self.port}"
+
+    @property
+    def disabled(self) -> bool:
+        return self.disabled_until is not None and self.disabled_until > time.monotonic()
+
+    def reserve(self) -> float:
+        """
+        Takes a token, the bucket may go into debt. Called under the lock of the pool.
+        :return: Delay in seconds until the connection may be opened
+        """
+        if not self.rate:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(float(self.burst), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {"active": self.active, "requests": self.requests, "failures": self.failures, "disabled": self.disabled,
+                "enable_in": round(max(0.0, self.disabled_until - time.monotonic()), 1) if self.disabled else None}
+
+
+class EgressError(ConnectionError):
+    """The connection failed through all tried egresses."""
+
+
+def socks5_request(host:str, port:int) -> bytes:
+    """
+    :return: Greeting without authentication and the CONNECT request of the address
+    """
+    try:
+        address = ipaddress.ip_address(host)
+        destination = (b"\x01" if address.version == 4 else b"\x04") + address.packed
+    except ValueError:
+        encoded = host.encode("idna")
+        destination = b"\x03" + bytes([len(encoded)]) + encoded
+    return b"\x05\x01\x00" + b"\x05\x01\x00" + destination + port.to_bytes(2, "big")
+
+
+# Reply of the proxy, that the target refused the connection, the other failures don't tell the state of the port
+_SOCKS5_REPLY_REFUSED = 0x05
+
+
+class UnreachableError(ConnectionError):
+    """The proxy couldn't reach the target (e.g. general failure, TTL expired or host unreachable), the port state is unknown."""
+
+
+def socks5_reply_length(header:bytes) -> int:
+    """
+    :param header: Method answer and the first 5 bytes of the CONNECT reply
+    :return: Number of the remaining bytes of the reply
+    :raises ConnectionError: If the proxy rejected the greeting
+    :raises ConnectionRefusedError: If the target refused the connection, it is an answer about the target
+    :raises UnreachableError: If the proxy failed to connect to the target for another reason
+    """
+    if header[:2] != b"\x05\x00" or header[2] != 0x05:
+        raise ConnectionError("SOCKS5 proxy rejected the greeting")
+    if header[3] == _SOCKS5_REPLY_REFUSED:
+        raise ConnectionRefusedError("Target refused the connection")
+    if header[3] != 0x00:
+        raise UnreachableError(f"SOCKS5 proxy couldn't connect to the target (reply {header[3]})")
+    # The first byte of the bound address (the length of a domain name) is already read, the port follows the address
+    return {0x01: 3, 0x03: header[6], 0x04: 15}.get(header[5], 3) + 2
+
+
+class EgressPool:
+    """
+    Spreads the outgoing connections of the probes over SOCKS5 proxies, e.g. the tunnels of the SSH servers,
+    so the per-source rate limits of the targets apply to each egress instead of to the whole scan.
+
+    An egress is picked round-robin or by the target, so a target always leaves through the same egress while it works.
+    Each egress has its own connection rate. A connection, that fails at the proxy, is retried through another egress,
+    and an egress is disabled for a backoff after several consecutive failures. Without egresses the connections are direct.
+    """
+    def __init__(self, endpoints:List[tuple[str, int]] = None, strategy:str = PROXY_EGRESS_STRATEGY, rate:float = PROXY_EGRESS_RATE,
+                 burst:int = PROXY_EGRESS_BURST):
+        self.egresses: List[Egress] = []
+        self.strategy = strategy
+        self.rate = rate
+        self.burst = burst
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._closers = []
+        self.configure(endpoints or [], strategy, rate, burst)
+
+    def configure(self, endpoints:List[tuple[str, int]], strategy:str = PROXY_EGRESS_STRATEGY, rate:float = PROXY_EGRESS_RATE,
+                  burst:int = PROXY_EGRESS_BURST):
+        """
+        :param endpoints: Hosts and ports of the SOCKS5 proxies, an empty list disables the pool
+        :param strategy: 'round-robin' or 'per-target'
+        :param rate: New connections per second of each egress, 0 for unlimited
+        """
+        if strategy not in PROXY_EGRESS_STRATEGIES:
+            raise ValueError(f"Unknown egress strategy '{strategy}', expected one of {', '.join(PROXY_EGRESS_STRATEGIES)}")
+        with self._lock:
+            self.strategy = strategy
+            self.rate = rate
+            self.burst = burst
+            self.egresses = [Egress(host, port, rate, burst) for host, port in endpoints]
+
+    def config(self, share:int = 1) -> dict | None:
+        """
+        Settings of the pool for another process, e.g. a shard, that uses the same egresses.
+        :param share: Number of processes, the rate and burst of each egress are split between them
+        :return: Arguments of configure(), None if the pool is disabled
+        """
+        with self._lock:
+            if not self.egresses:
+                return None
+            return {"endpoints": [(egress.host, egress.port) for egress in self.egresses], "strategy": self.strategy,
+                    "rate": self.rate / share, "burst": max(1, self.burst // share)}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.egresses)
+
+    def pick(self, target:str = None, exclude:List[Egress] = ()) -> Egress | None:
+        """
+        :param target: Host of the connection, it keeps its egress with the 'per-target' strategy
+        :param exclude: Egresses of the failed attempts
+        :return: Egress for the connection, None if there is none left
+        """
+        with self._lock:
+            candidates = [egress for egress in self.egresses if egress not in exclude]
+            if not candidates:
+                return None
+            enabled = [egress for egress in candidates if not egress.disabled]
+            # All disabled: a failing egress is better than none
+            candidates = enabled if enabled else candidates
+            if self.strategy == "per-target" and target:
+                # The egresses keep their places, so a disabled egress only moves its own targets
+                start = zlib.crc32(target.encode())
+                egress = next(self.egresses[(start + i) % len(self.egresses)] for i in range(len(self.egresses))
+                              if self.egresses[(start + i) % len(self.egresses)] in candidates)
+            else:
+                egress = candidates[next(self._counter) % len(candidates)]
+            egress.active += 1
+            return egress
+
+    def _reserve(self, egress:Egress) -> float:
+        with self._lock:
+            return egress.reserve()
+
+    def _done(self, egress:Egress, error:str = None):
+        with self._lock:
+            egress.active -= 1
+            egress.requests += 1
+            if error is None:
+                egress.failures = 0
+                if egress.disabled_until is not None:
+                    egress.disabled_until = None
+                    egress.backoff = PROXY_EGRESS_BACKOFF
+                    vsc_log.info_ip_status_result(_module_name, f"{egress.host}:{egress.port}", "ENABLED", "Egress works again")
+                return
+            egress.failures += 1
+            if egress.failures >= PROXY_EGRESS_MAX_FAILURES:
+                if egress.disabled_until is not None:
+                    egress.backoff = min(egress.backoff * 2, PROXY_EGRESS_MAX_BACKOFF)
+                egress.disabled_until = time.monotonic() + egress.backoff
+                vsc_log.warn_ip_status_result(_module_name, f"{egress.host}:{egress.port}", "DISABLED",
+                                              f"{error} ({egress.failures} consecutive failures), next try in {egress.backoff:g}s")
+
+    def request(self, method:str, url:str, attempts:int = PROXY_EGRESS_ATTEMPTS, **kwargs):
+        """
+        HTTP request through an egress, a failed connection is retried through the next one.
+        :param kwargs: Arguments of requests.request(), the timeout defaults to PROXY_EGRESS_TIMEOUT
+        :return: requests.Response
+        :raises EgressError: If the request failed through all tried egresses
+        """
+        # Imported on the first request, like in the passive collection
+        import requests
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = PROXY_EGRESS_TIMEOUT
+        if not self.egresses:
+            return requests.request(method, url, **kwargs)
+        tried = []
+        errors = []
+        for _ in range(attempts):
+            egress = self.pick(urlsplit(url).hostname, tried)
+            if not egress:
+                break
+            tried.append(egress)
+            time.sleep(self._reserve(egress))
+            try:
+                response = requests.request(method, url, proxies={"http": egress.url, "https": egress.url}, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._done(egress, type(e).__name__)
+                errors.append(f"{egress.host}:{egress.port}: {e}")
+                continue
+            self._done(egress)
+            return response
+        raise EgressError(f"{method} {url} failed through {len(tried)} egresses: {'; '.join(errors)}")
+
+    async def open_connection(self, host:str, port:int, timeout:Optional[float] = PROXY_EGRESS_TIMEOUT,
+                              attempts:int = PROXY_EGRESS_ATTEMPTS) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """
+        TCP connection to the target through an egress, a failed proxy is retried through the next one.
+        :param timeout: Timeout in seconds of each attempt
+        :raises ConnectionRefusedError: If the target refused the connection (an answer, it isn't retried)
+        :raises EgressError: If the connection failed through all tried egresses, also if they couldn't reach the target
+        """
+        if not self.egresses:
+            return await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        tried = []
+        errors = []
+        for _ in range(attempts):
+            egress = self.pick(host, tried)
+            if not egress:
+                break
+            tried.append(egress)
+            await asyncio.sleep(self._reserve(egress))
+            writer = None
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(egress.host, egress.port), timeout)
+                writer.write(socks5_request(host, port))
+                header = await asyncio.wait_for(reader.readexactly(7), timeout)
+                await asyncio.wait_for(reader.readexactly(socks5_reply_length(header)), timeout)
+            except ConnectionRefusedError:
+                if writer:
+                    # The proxy answered for the target, the egress works
+                    writer.close()
+                    self._done(egress)
+                    raise
+                self._done(egress, "Refused")
+                errors.append(f"{egress.host}:{egress.port}: proxy refused the connection")
+                continue
+            except UnreachableError as e:
+                # The proxy works, but its route to the target may not, another egress may reach it
+                writer.close()
+                self._done(egress)
+                errors.append(f"{egress.host}:{egress.port}: {e}")
+                continue
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                if writer:
+                    writer.close()
+                self._done(egress, type(e).__name__)
+                errors.append(f"{egress.host}:{egress.port}: {e!r}")
+                continue
+            self._done(egress)
+            return reader, writer
+        raise EgressError(f"Connection to {host}:{port} failed through {len(tried)} egresses: {'; '.join(errors)}")
+
+    async def probe(self, host:str, port:int, timeout:Optional[float] = PROXY_EGRESS_TIMEOUT) -> bool | None:
+        """
+        TCP connect probe of the port through an egress.
+        :return: True if the port is open, False if it is refused, None if no egress could reach it or the proxies
+                 couldn't tell (e.g. host unreachable)
+        """
+        try:
+            _, writer = await self.open_connection(host, port, timeout)
+        except ConnectionRefusedError:
+            return False
+        except EgressError:
+            return None
+        writer.close()
+        return True
+
+    def on_close(self, closer):
+        """Registers a function, that stops the tunnels of the egresses, for close()."""
+        self._closers.append(closer)
+
+    def close(self):
+        """Disables the pool and stops the registered tunnels."""
+        self.configure([], self.strategy)
+        while self._closers:
+            self._closers.pop()()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {f"{egress.host}:{egress.port}": egress.to_dict() for egress in self.egresses}
+
+
+# Egresses of the probes of this process, the connections are direct until it is configured
+egress_pool = EgressPool()
+
+
+def _parse_endpoint(endpoint:str) -> tuple[str, int]:
+    host, _, port = endpoint.strip().rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError(f"Invalid egress '{endpoint}', expected host:port")
+    return host.strip('[]'), int(port)
+
+
+@logger(_module_name)
+def configure_egress(egress:str, strategy:str = PROXY_EGRESS_STRATEGY, rate:float = PROXY_EGRESS_RATE) -> EgressPool:
+    """
+    Configures the egresses of the probes of this process, egress_pool.close() stops them.
+    :param egress: Comma-separated SOCKS5 proxies as host:port, or 'ssh' for the SOCKS5 proxies of the SSH servers
+    :return: The configured egress_pool
+    """
+    if egress.strip() == "ssh":
+        # Imported here, the SSH manager imports paramiko and reads the proxy JSON file
+        from proxy.ssh_manager import get_ssh_manager
+        manager = get_ssh_manager()
+        manager.connect_all()
+        servers = [server for server in manager.get_all_servers() if server.is_alive()]
+        for server in servers:
+            server.start_proxy()
+        egress_pool.on_close(manager.disconnect_all)
+        endpoints = [(server.local_host, server.local_port) for server in servers]
+    else:
+        endpoints = [_parse_endpoint(endpoint) for endpoint in egress.split(',') if endpoint.strip()]
+    egress_pool.configure(endpoints, strategy, rate)
+    vsc_log.info_status_result(_module_name, "CONFIGURED", f"{len(endpoints)} egresses, {strategy}, "
+                                                          f"{f'{rate:g} connections/s each' if rate else 'unlimited rate'}")
+    return egress_pool
@@ -0,0 +1,132 @@
+import hashlib
+import os
+from typing import Callable
+
+import paramiko
+
+from _conf import PROXY_SFTP_CHUNK_SIZE, PROXY_SFTP_PREFETCH_REQUESTS
+from _log import vsc_log
+
+
+_module_name = "proxy.sftp"
+
+# Suffix of the partial files, a transfer is resumed from their size, if their content matches the source
+PARTIAL_SUFFIX = ".part"
+
+# Errors of a stalled or dropped session, the transfer is resumed in a new session
+RETRYABLE_ERRORS = (TimeoutError, ConnectionError, EOFError, paramiko.SSHException)
+
+
+def file_sha256(path:str, digest=None, end:int = None) -> 'hashlib._Hash':
+    """
+    :param digest: Hash to continue, e.g. of the preceding file part
+    :param end: Hash only the first bytes of the file (default is the whole file)
+    :return: SHA-256 hash of the local file
+    """
+    digest = digest if digest else hashlib.sha256()
+    remaining = end
+    with open(path, 'rb') as file:
+        while remaining is None or remaining > 0:
+            data = file.read(PROXY_SFTP_CHUNK_SIZE if remaining is None else min(PROXY_SFTP_CHUNK_SIZE, remaining))
+            if not data:
+                break
+            digest.update(data)
+            if remaining is not None:
+                remaining -= len(data)
+    return digest
+
+
+def _verified_offset(offset:int, local_prefix:Callable[[], str], remote_prefix:Callable[[], str | None], name:str) -> int:
+    """
+    :return: The offset, if the partial file is the start of the source, otherwise 0 to start over
+    """
+    if not offset:
+        return 0
+    remote = remote_prefix()
+    if remote is None or remote != local_prefix():
+        vsc_log.debug_status_result(_module_name, "RESTARTED", f"'{name}': partial file of {offset} bytes "
+                                                               f"{'is not verified' if remote is None else 'differs from the source'}")
+        return 0
+    return offset
+
+
+def download_file(sftp:paramiko.SFTPClient, remote_path:str, local_path:str, resume:bool = False,
+                  prefix_sha256:Callable[[str, int], str | None] = None) -> tuple[str, int]:
+    """
+    Downloads the file into a partial file next to the local path, the chunks are requested ahead (pipelined).
+    The partial file is renamed by the caller after the verification.
+    :param resume: Continue an existing partial file from its size, if prefix_sha256 confirms its content
+    :param prefix_sha256: Returns the SHA-256 of the first bytes of a remote file, None if it can't be computed.
+                          Without it a partial file isn't resumed
+    :return: SHA-256 of the downloaded file and the resumed offset
+    """
+    partial_path = f"{local_path}{PARTIAL_SUFFIX}"
+    size = sftp.stat(remote_path).st_size
+    offset = os.path.getsize(partial_path) if resume and prefix_sha256 and os.path.exists(partial_path) else 0
+    if offset > size:
+        offset = 0
+    offset = _verified_offset(offset, lambda: file_sha256(partial_path).hexdigest(), lambda: prefix_sha256(remote_path, offset), remote_path)
+    digest = file_sha256(partial_path) if offset else hashlib.sha256()
+    with sftp.open(remote_path, 'rb') as remote_file, open(partial_path, 'ab' if offset else 'wb') as local_file:
+        # All reads of the rest of the file are requested ahead at once, at most PROXY_SFTP_PREFETCH_REQUESTS at a time
+        remote_file.seek(offset)
+        remote_file.prefetch(size, PROXY_SFTP_PREFETCH_REQUESTS)
+        position = offset
+        while position < size:
+            data = remote_file.read(min(PROXY_SFTP_CHUNK_SIZE, size - position))
+            if not data:
+                raise EOFError(f"'{remote_path}' ended at {position} of {size} bytes")
+            local_file.write(data)
+            digest.update(data)
+            position += len(data)
+    if offset:
+        vsc_log.debug_status_result(_module_name, "RESUMED", f"'{remote_path}' from {offset} of {size} bytes")
+    return digest.hexdigest(), offset
+
+
+def upload_file(sftp:paramiko.SFTPClient, local_path:str, remote_path:str, resume:bool = False,
+                prefix_sha256:Callable[[str, int], str | None] = None) -> tuple[str, int]:
+    """
+    Uploads the file into a partial file next to the remote path, the writes are not waited for one by one (pipelined).
+    The partial file is renamed by the caller after the verification.
+    :param resume: Continue an existing remote partial file from its size, if prefix_sha256 confirms its content
+    :param prefix_sha256: The same as of download_file()
+    :return: SHA-256 of the uploaded file and the resumed offset
+    """
+    partial_path = f"{remote_path}{PARTIAL_SUFFIX}"
+    size = os.path.getsize(local_path)
+    offset = 0
+    if resume and prefix_sha256:
+        try:
+            offset = sftp.stat(partial_path).st_size
+        except FileNotFoundError:
+            pass
+        if offset > size:
+            offset = 0
+    offset = _verified_offset(offset, lambda: file_sha256(local_path, end=offset).hexdigest(), lambda: prefix_sha256(partial_path, offset),
+                              local_path)
+    digest = file_sha256(local_path, end=offset) if offset else hashlib.sha256()
+    with open(local_path, 'rb') as local_file, sftp.open(partial_path, 'r+b' if offset else 'wb') as remote_file:
+        remote_file.set_pipelined(True)
+        local_file.seek(offset)
+        remote_file.seek(offset)
+        while data := local_file.read(PROXY_SFTP_CHUNK_SIZE):
+            remote_file.write(data)
+            digest.update(data)
+    if offset:
+        vsc_log.debug_status_result(_module_name, "RESUMED", f"'{local_path}' from {offset} of {size} bytes")
+    return digest.hexdigest(), offset
+
+
+def finish_upload(sftp:paramiko.SFTPClient, remote_path:str):
+    """Replaces the remote file with the verified partial file."""
+    partial_path = f"{remote_path}{PARTIAL_SUFFIX}"
+    try:
+        sftp.posix_rename(partial_path, remote_path)
+    except IOError:
+        # Without the posix-rename extension the target has to be removed first
+        try:
+            sftp.remove(remote_path)
+        except FileNotFoundError:
+            pass
+        sftp.rename(partial_path, remote_path)
@@ -1,8 +1,11 @@
-import random
-from typing import List
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
+from typing import Any, Callable, Iterator, List
 
+from _conf import PROXY_BALANCER_STRATEGY, PROXY_BALANCER_ATTEMPTS, PROXY_CONNECT_TIMEOUT, PROXY_FLEET_WORKERS, PROXY_FLEET_TIMEOUT
 from _log import vsc_log, logger
-from _utils import load_external_servers
+from _utils import load_external_servers, DaemonExecutor
+from proxy.balancer import BalancerSSH
 from proxy.ssh_server import ServerSSH
 
 
@@ -12,11 +15,12 @@ _module_name = "proxy.manager"
 class ManagerSSH:
     """Manage a collection of ServerSSH instances."""
     @logger(_module_name)
-    def __init__(self, servers:List[dict]):
+    def __init__(self, servers:List[dict], strategy:str = PROXY_BALANCER_STRATEGY):
         """
         Initialize the bot-net manager with server configurations.
 
         :param servers: List of server configurations.
+        :param strategy: Balancing strategy of the server picks, 'least-load' or 'latency'.
         """
         self.ssh_servers = {
             server["host"]: ServerSSH(
@@ -27,27 +31,81 @@ class ManagerSSH:
             )
             for server in servers
         }
+        self.balancer = BalancerSSH(self.ssh_servers, strategy)
+
+    def _run_on_all(self, func:Callable[[ServerSSH], Any], timeout:float | None, max_workers:int) -> Iterator[tuple[ServerSSH, Any, Exception | None]]:
+        """
+        Runs the function for all servers in a bounded thread pool.
+        A server, that doesn't finish within the timeout since its start, is reported with a TimeoutError and not waited for.
+        :return: Server, result and error, as each server finishes
+        """
+        servers = list(self.ssh_servers.values())
+        if not servers:
+            return
+        started = {}
+
+        def run(server:ServerSSH):
+            started[server.remote_host] = time.monotonic()
+            return func(server)
+
+        # Daemon threads, so a server, that hangs after its timeout, doesn't hold up the exit of the interpreter
+        executor = DaemonExecutor(max(1, min(max_workers, len(servers))), thread_name_prefix="ssh-fleet")
+        futures = {executor.submit(run, server): server for server in servers}
+        pending = set(futures)
+        try:
+            while pending:
+                wait_timeout = None
+                if timeout:
+                    now = time.monotonic()
+                    for future in [future for future in pending if not future.done() and futures[future].remote_host in started]:
+                        if now - started[futures[future].remote_host] >= timeout:
+                            pending.discard(future)
+                            yield futures[future], None, TimeoutError(f"No result after {timeout:g}s")
+                    # Wakes up at the earliest timeout of the running servers, the queued ones haven't started their timeouts yet
+                    deadlines = [started[futures[future].remote_host] + timeout for future in pending if futures[future].remote_host in started]
+                    wait_timeout = max(0.0, min(deadlines) - now) if deadlines else timeout
+                done, pending = wait(pending, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        yield futures[future], future.result(), None
+                    except Exception as e:
+                        yield futures[future], None, e
+        finally:
+            # The timed out servers finish in the background, they are bounded by their own connection and channel timeouts
+            executor.shutdown(wait=False, cancel_futures=True)
 
     @logger(_module_name)
-    def connect_all(self):
-        """Establish SSH connections for all servers."""
-        for server in self.ssh_servers.values():
-            try:
-                server.connect()
-            except Exception as e:
-                vsc_log.error_result(_module_name, f"Failed to connect to {server.remote_host}: {e}")
+    def connect_all(self, timeout:float = PROXY_CONNECT_TIMEOUT, max_workers:int = PROXY_FLEET_WORKERS):
+        """
+        Establish SSH connections for all servers in parallel and start their health checks.
+
+        :param timeout: Timeout in seconds for connecting to each server.
+        :param max_workers: Number of servers connected at a time.
+        """
+        # Each step of the connection has the timeout, so the whole connection gets a bit more
+        for server, _, error in self._run_on_all(lambda server: server.connect(timeout), timeout * 3 if timeout else None, max_workers):
+            if error:
+                vsc_log.error_result(_module_name, f"Failed to connect to {server.remote_host}: {error}")
+        vsc_log.info_result(_module_name, f"Connected to {sum(server.is_alive() for server in self.ssh_servers.values())} "
+                                          f"of {len(self.ssh_servers)} servers")
+        self.balancer.start()
 
     @logger(_module_name)
     def disconnect_all(self):
         """Close SSH connections for all servers."""
+        self.balancer.stop()
         for server in self.ssh_servers.values():
             server.close()
 
     @logger(_module_name)
-    def get_random_server(self) -> ServerSSH:
-        if not self.ssh_servers:
+    def get_random_server(self) -> ServerSSH | None:
+        """
+        :return: The least loaded or fastest healthy server (by the balancing strategy), None if no server is available
+        """
+        server = self.balancer.pick()
+        if not server:
             vsc_log.warn_result(_module_name, "No SSH servers available.")
-        return random.choice(list(self.ssh_servers.values()))
+        return server
 
     @logger(_module_name)
     def get_all_servers(self) -> List[ServerSSH]:
@@ -56,52 +114,92 @@ class ManagerSSH:
     @logger(_module_name)
     def execute_on_random(self, command:str) -> tuple[str, tuple[str, str]] | None:
         """
-        Execute a command on a random server.
+        Execute a command on a server picked by the balancer, a failed command is retried on another server.
 
         :param command: Command to execute.
         :return: Command stdout and stderr by hostname.
         """
-        if not self.ssh_servers:
+        tried = []
+        for _ in range(PROXY_BALANCER_ATTEMPTS):
+            server = self.balancer.pick(exclude=tried)
+            if not server:
+                break
+            tried.append(server.remote_host)
+            try:
+                with self.balancer.track(server):
+                    output = server.execute_command(command)
+                    if output[0] is None:
+                        raise ConnectionError("SSH connection is not established")
+                return server.str_local, output
+            except Exception as e:
+                vsc_log.error_result(_module_name, f"Error executing command on {server.str_local}: {e}")
+        if not tried:
             vsc_log.warn_result(_module_name, "No SSH servers available.")
-            return None
+        return None
 
-        server = random.choice(list(self.ssh_servers.values()))
-        try:
-            return server.str_local, server.execute_command(command)
-        except Exception as e:
-            vsc_log.error_result(_module_name, f"Error executing command on {server.str_local}: {e}")
+    # Not auto-logged, the decorator would only see the creation of the generator; execute_on_all() is
+    def iter_execute_on_all(self, command:str, timeout:float = PROXY_FLEET_TIMEOUT,
+                            max_workers:int = PROXY_FLEET_WORKERS) -> Iterator[tuple[str, tuple[str, str] | tuple[None, None] | str]]:
+        """
+        Execute a command on all servers in parallel.
+
+        :param command: Command to execute.
+        :param timeout: Timeout in seconds for the command on each server.
+        :param max_workers: Number of servers running the command at a time.
+        :return: Hostname and command output (or the error), as each server finishes.
+        """
+        def execute(server:ServerSSH):
+            with self.balancer.track(server):
+                return server.execute_command(command, timeout=timeout)
+
+        for server, output, error in self._run_on_all(execute, timeout, max_workers):
+            yield server.str_local, f"Error: {error}" if error else output
 
     @logger(_module_name)
-    def execute_on_all(self, command:str) -> dict[str, tuple[str, str] | tuple[str, None] | None] :
+    def execute_on_all(self, command:str, timeout:float = PROXY_FLEET_TIMEOUT,
+                       max_workers:int = PROXY_FLEET_WORKERS) -> dict[str, tuple[str, str] | tuple[str, None] | None] :
         """
-        Execute a command on all servers.
+        Execute a command on all servers in parallel.
 
         :param command: Command to execute.
+        :param timeout: Timeout in seconds for the command on each server.
+        :param max_workers: Number of servers running the command at a time.
         :return: Dict of command outputs by hostname.
         """
-        results = {}
-        for server in self.ssh_servers.values():
-            try:
-                results.update({server.str_local: server.execute_command(command)})
-            except Exception as e:
-                results.update({server.str_local: f"Error: {e}"})
-        return results
+        return dict(self.iter_execute_on_all(command, timeout, max_workers))
+
+_instance_ssh_manager = None
+
+
+def get_ssh_manager() -> ManagerSSH:
+    """
+    :return: Shared manager of the SSH servers from the proxy JSON file, it is created on the first call
+    """
+    global _instance_ssh_manager
+    if _instance_ssh_manager is None:
+        _instance_ssh_manager = ManagerSSH(load_external_servers(["ssh"]))
+    return _instance_ssh_manager
+
 
-instance_ssh_manager = ManagerSSH(load_external_servers(["ssh"]))
+def __getattr__(name):
+    # instance_ssh_manager is kept for the old imports, the proxy JSON file is read on the first access
+    if name == "instance_ssh_manager":
+        return get_ssh_manager()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
+    instance_ssh_manager = get_ssh_manager()
     try:
         instance_ssh_manager.connect_all()
         # Execute the command on a random server
         host, output = instance_ssh_manager.execute_on_random("whoami")
         vsc_log.info_ip_result(_module_name, host, f"Output from random server:\n{' '.join(list(filter(None, output)))}")
 
-        # Run the command on all servers
-        all_outputs = instance_ssh_manager.execute_on_all("uptime")
+        # Run the command on all servers, the outputs are shown as each server finishes
         vsc_log.info_result(_module_name, "Outputs from all servers:")
-        for host in all_outputs:
-            vsc_log.info_ip_result(_module_name, host, f"Output:\n{' '.join(list(filter(None, all_outputs.get(host))))}")
+        for host, output in instance_ssh_manager.iter_execute_on_all("uptime"):
+            vsc_log.info_ip_result(_module_name, host, f"Output:\n{output if isinstance(output, str) else ' '.join(list(filter(None, output)))}")
 
         [srv.start_proxy() for srv in instance_ssh_manager.get_all_servers()]
 
@@ -0,0 +1,322 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import paramiko
+
+from _conf import PROXY_CONNECT_TIMEOUT, PROXY_POOL_SIZE, PROXY_POOL_MAX_SESSIONS, PROXY_POOL_KEEPALIVE, PROXY_POOL_RECONNECT_BACKOFF, \
+    PROXY_POOL_MAX_RECONNECT_BACKOFF, PROXY_SFTP_IDLE_SESSIONS, \
+    PROXY_SFTP_TIMEOUT
+from _log import vsc_log
+
+
+_module_name = "proxy.pool"
+
+
+class _PooledConnection:
+    """An authenticated SSH connection of the pool with the number of its open channels and sessions among them."""
+    __slots__ = ("client", "transport", "channels", "sessions")
+
+    def __init__(self, client:paramiko.SSHClient):
+        self.client = client
+        self.transport = client.get_transport()
+        self.channels = 0
+        self.sessions = 0
+
+    def is_active(self) -> bool:
+        return self.transport.is_active()
+
+    def close(self):
+        self.client.close()
+
+
+class PoolSSH:
+    """
+    Pool of SSH connections to a remote host.
+
+    A channel is opened on the live connection with the fewest channels. A session channel needs a connection below
+    the session limit, a new connection is added while all of them have reached it, and the caller waits for
+    a released session, when the pool is full.
+    Dead connections are dropped and replaced on the next request. A failed connection attempt blocks the next
+    one for a backoff, that doubles with each failed attempt.
+    """
+    def __init__(self, hostname:str, port:int, username:str, password:Optional[str] = None, pkey:Optional[str] = None,
+                 size:int = PROXY_POOL_SIZE, max_sessions:int = PROXY_POOL_MAX_SESSIONS, keepalive:int = PROXY_POOL_KEEPALIVE,
+                 connect_timeout:Optional[float] = PROXY_CONNECT_TIMEOUT):
+        """
+        :param size: Maximum number of connections
+        :param max_sessions: Maximum number of open session channels on each connection, OpenSSH allows 10 sessions by default
+        :param keepalive: Interval in seconds of the keepalive packets, 0 to disable them
+        :param connect_timeout: Timeout in seconds for each step of a connection: TCP connect, SSH banner and authentication
+        """
+        self.hostname = hostname
+        self.port = port
+        self.size = max(1, size)
+        self.max_sessions = max(1, max_sessions)
+        self.keepalive = keepalive
+        self.connect_timeout = connect_timeout
+        self._username = username
+        self._password = password
+        self._pkey = pkey
+
+        self._connections: List[_PooledConnection] = []
+        self._leases: Dict[paramiko.Channel, tuple[_PooledConnection, bool]] = {}
+        # Open SFTP sessions between the transfers, they keep their channels
+        self._idle_sftp: List[paramiko.SFTPClient] = []
+        self._changed = threading.Condition()
+        self._connecting = 0
+        self._failures = 0
+        self._next_attempt = 0.0
+        self._closed = False
+        self.reconnects = 0
+
+        self.str_remote = f"{self.hostname}:{self.port}"
+
+    def _connect(self) -> _PooledConnection:
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        timeouts = {"timeout": self.connect_timeout, "banner_timeout": self.connect_timeout, "auth_timeout": self.connect_timeout}
+        try:
+            if self._pkey:
+                private_key = paramiko.RSAKey.from_private_key_file(self._pkey)
+                client.connect(self.hostname, port=self.port, username=self._username, pkey=private_key, **timeouts)
+            else:
+                client.connect(self.hostname, port=self.port, username=self._username, password=self._password, **timeouts)
+        except Exception:
+            client.close()
+            raise
+        if self.keepalive:
+            client.get_transport().set_keepalive(self.keepalive)
+        return _PooledConnection(client)
+
+    def _drop_dead(self):
+        for connection in [connection for connection in self._connections if not connection.is_active()]:
+            self._connections.remove(connection)
+            connection.close()
+            vsc_log.warn_ip_status_result(_module_name, self.str_remote, "LOST", f"Connection is dropped, {len(self._connections)} left")
+
+    def _add_connection(self) -> _PooledConnection:
+        """
+        Connects outside the lock, so the other callers use the live connections meanwhile.
+        :raises ConnectionError: If the backoff of the failed attempts isn't over
+        """
+        self._connecting += 1
+        self._changed.release()
+        try:
+            delay = self._next_attempt - time.monotonic()
+            if delay > 0:
+                raise ConnectionError(f"Connection to {self.str_remote} failed, next attempt in {delay:.1f}s")
+            try:
+                connection = self._connect()
+            except Exception as e:
+                self._failures += 1
+                backoff = min(PROXY_POOL_RECONNECT_BACKOFF * 2 ** (self._failures - 1), PROXY_POOL_MAX_RECONNECT_BACKOFF)
+                self._next_attempt = time.monotonic() + backoff
+                vsc_log.warn_ip_status_result(_module_name, self.str_remote, "RETRY", f"Failed to connect ({e}), next attempt in {backoff:g}s")
+                raise ConnectionError(f"Failed to connect to {self.str_remote}: {e}") from e
+        finally:
+            self._changed.acquire()
+            self._connecting -= 1
+        if self._failures:
+            self.reconnects += 1
+            vsc_log.info_ip_status_result(_module_name, self.str_remote, "RECONNECTED", f"After {self._failures} failed attempts")
+        self._failures = 0
+        self._connections.append(connection)
+        return connection
+
+    def connect(self):
+        """
+        Opens the first connection of the pool, if there is no live one.
+        :raises ConnectionError: If the connection fails
+        """
+        with self._changed:
+            self._closed = False
+            self._drop_dead()
+            if not self._connections:
+                self._add_connection()
+                self._changed.notify_all()
+
+    def is_alive(self) -> bool:
+        """Check that the pool has a live connection."""
+        with self._changed:
+            return any(connection.is_active() for connection in self._connections)
+
+    def _lease(self, timeout:Optional[float], session:bool = True) -> _PooledConnection:
+        """
+        Reserves a channel on a connection, a dead pool is reconnected.
+        :param session: The channel counts against the session limit, the forwarded channels only spread over the connections
+        :raises ConnectionError: If there is no live connection and a new one fails
+        :raises TimeoutError: If all connections are full within the timeout
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        with self._changed:
+            while True:
+                if self._closed:
+                    raise ConnectionError(f"Pool of {self.str_remote} is closed")
+                self._drop_dead()
+                available = [connection for connection in self._connections if not session or connection.sessions < self.max_sessions]
+                if available:
+                    connection = min(available, key=lambda connection: connection.channels)
+                elif len(self._connections) + self._connecting < self.size and time.monotonic() >= self._next_attempt:
+                    try:
+                        connection = self._add_connection()
+                    except ConnectionError:
+                        if self._connections:
+                            # A full pool with live connections waits for a channel instead of failing
+                            continue
+                        raise
+                elif not self._connections and not self._connecting:
+                    raise ConnectionError(f"Connection to {self.str_remote} failed, next attempt in "
+                                          f"{self._next_attempt - time.monotonic():.1f}s")
+                else:
+                    remaining = deadline - time.monotonic() if deadline else None
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(f"All {len(self._connections)} connections to {self.str_remote} have {self.max_sessions} sessions")
+                    self._changed.wait(remaining)
+                    continue
+                connection.channels += 1
+                connection.sessions += session
+                return connection
+
+    def _unlease(self, connection:_PooledConnection, session:bool):
+        with self._changed:
+            connection.channels -= 1
+            connection.sessions -= session
+            self._changed.notify()
+
+    def open_channel(self, kind:str = "session", destination:tuple = None, source:tuple = None,
+                     timeout:Optional[float] = None) -> paramiko.Channel:
+        """
+        Opens a channel, it has to be given back with release().
+        :param kind: 'session' or 'direct-tcpip' with the destination and source addresses
+        :param timeout: Timeout in seconds for waiting for a connection and opening the channel
+        """
+        # The session limit of the server doesn't apply to the forwarded channels
+        session = kind == "session"
+        connection = self._lease(timeout, session)
+        try:
+            channel = connection.transport.open_channel(kind, destination, source, timeout=timeout)
+        except Exception:
+            self._unlease(connection, session)
+            raise
+        with self._changed:
+            self._leases[channel] = (connection, session)
+        return channel
+
+    def release(self, channel:paramiko.Channel):
+        """Closes the channel and frees its place on the connection."""
+        channel.close()
+        with self._changed:
+            lease = self._leases.pop(channel, None)
+        if lease:
+            self._unlease(*lease)
+
+    @contextmanager
+    def channel(self, kind:str = "session", destination:tuple = None, source:tuple = None,
+                timeout:Optional[float] = None) -> Iterator[paramiko.Channel]:
+        channel = self.open_channel(kind, destination, source, timeout)
+        try:
+            yield channel
+        finally:
+            self.release(channel)
+
+    def _take_sftp(self) -> paramiko.SFTPClient | None:
+        while True:
+            with self._changed:
+                if not self._idle_sftp:
+                    return None
+                sftp = self._idle_sftp.pop()
+            channel = sftp.get_channel()
+            if not channel.closed and channel.get_transport().is_active():
+                return sftp
+            self.release(channel)
+
+    def _close_sftp(self, sftp:paramiko.SFTPClient):
+        sftp.close()
+        self.release(sftp.get_channel())
+
+    @contextmanager
+    def sftp(self, timeout:Optional[float] = None) -> Iterator[paramiko.SFTPClient]:
+        """
+        SFTP session on a pooled channel. The session is kept open for the next transfers, up to
+        PROXY_SFTP_IDLE_SESSIONS sessions, so a transfer doesn't pay for opening the channel and the subsystem.
+        """
+        sftp = self._take_sftp()
+        if not sftp:
+            channel = self.open_channel(timeout=timeout)
+            try:
+                channel.invoke_subsystem("sftp")
+                sftp = paramiko.SFTPClient(channel)
+                # A stalled transfer raises instead of waiting forever
+                channel.settimeout(PROXY_SFTP_TIMEOUT)
+            except Exception:
+                self.release(channel)
+                raise
+        try:
+            yield sftp
+        except Exception:
+            # A failed transfer can leave unanswered requests in the session
+            self._close_sftp(sftp)
+            raise
+        with self._changed:
+            if not self._closed and len(self._idle_sftp) < PROXY_SFTP_IDLE_SESSIONS:
+                self._idle_sftp.append(sftp)
+                return
+        self._close_sftp(sftp)
+
+    def transport(self) -> paramiko.Transport:
+        """
+        :return: Transport of the least busy live connection, for requests without a channel
+        """
+        connection = self._lease(self.connect_timeout, session=False)
+        self._unlease(connection, session=False)
+        return connection.transport
+
+    def close(self):
+        with self._changed:
+            self._closed = True
+            for sftp in self._idle_sftp:
+                sftp.close()
+            self._idle_sftp.clear()
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+            self._leases.clear()
+            self._changed.notify_all()
+
+    def stats(self) -> dict:
+        with self._changed:
+            return {"connections": len(self._connections), "channels": sum(connection.channels for connection in self._connections),
+                    "sessions": sum(connection.sessions for connection in self._connections), "idle_sftp": len(self._idle_sftp),
+                    "reconnects": self.reconnects, "failures": self._failures}
+
+
+# Pools by the remote host and credentials, so the servers of the same host share the authenticated connections
+_pools: Dict[tuple, list] = {}
+_pools_lock = threading.Lock()
+
+
+def acquire_pool(hostname:str, port:int, username:str, password:Optional[str] = None, pkey:Optional[str] = None, **kwargs) -> PoolSSH:
+    """
+    :return: Shared pool of the remote host, it is created on the first call
+    """
+    key = (hostname, port, username, password, pkey)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = [PoolSSH(hostname, port, username, password, pkey, **kwargs), 0]
+        _pools[key][1] += 1
+        return _pools[key][0]
+
+
+def release_pool(pool:PoolSSH):
+    """Closes the pool, when its last user releases it."""
+    with _pools_lock:
+        for key, (shared_pool, users) in list(_pools.items()):
+            if shared_pool is pool:
+                if users > 1:
+                    _pools[key][1] -= 1
+                    return
+                del _pools[key]
+                break
+    pool.close()
@@ -1,20 +1,85 @@
-import select
+import asyncio
+import concurrent.futures
+import functools
+import os
+import shlex
 import socket
 import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
 import paramiko
-from typing import Optional
 
-from _conf import PROXY_HOST, TEMP_DIR
+from _conf import PROXY_HOST, PROXY_CONNECT_TIMEOUT, PROXY_BACKLOG, PROXY_BUFFER_SIZE, PROXY_CHANNEL_TIMEOUT, PROXY_CHANNEL_THREADS, \
+    PROXY_STOP_TIMEOUT, PROXY_SFTP_PARALLEL, PROXY_SFTP_ATTEMPTS, TEMP_DIR
 from _log import logger, vsc_log
-from _utils import get_random_port_from_json
-from __temp__.proxy_test_auth_data import PROXY_TEST_host, PROXY_TEST_port, PROXY_TEST_user, PROXY_TEST_password
+from _utils import get_random_port_from_json, DaemonExecutor
+from proxy.sftp import PARTIAL_SUFFIX, RETRYABLE_ERRORS, download_file, upload_file, finish_upload
+from proxy.ssh_pool import acquire_pool, release_pool
 
 
 _module_name = "proxy.server"
 
+# SOCKS5 replies with a zero bound address
+_SOCKS5_REPLY_SUCCEEDED = b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00"
+_SOCKS5_REPLY_GENERAL_FAILURE = b"\x05\x01\x00\x01\x00\x00\x00\x00\x00\x00"
+_SOCKS5_REPLY_HOST_UNREACHABLE = b"\x05\x04\x00\x01\x00\x00\x00\x00\x00\x00"
+_SOCKS5_REPLY_REFUSED = b"\x05\x05\x00\x01\x00\x00\x00\x00\x00\x00"
+_SOCKS5_REPLY_COMMAND_NOT_SUPPORTED = b"\x05\x07\x00\x01\x00\x00\x00\x00\x00\x00"
+_SOCKS5_REPLY_ADDRESS_NOT_SUPPORTED = b"\x05\x08\x00\x01\x00\x00\x00\x00\x00\x00"
+
+# Threads of the SOCKS5 proxies of all servers, that wait for the SSH server: the channel opens and the sends to a channel
+# with a full window. They aren't limited by the default executor and a stalled wait doesn't hold up the exit
+channel_executor = DaemonExecutor(PROXY_CHANNEL_THREADS, thread_name_prefix="ssh-channel")
+
+
+def _wait_send_window(channel, timeout:float):
+    """
+    Blocks until the remote side opens the SSH window of the channel, the channel is closed or the timeout passes.
+    paramiko notifies the condition of the channel on every window adjustment and on close.
+    """
+    with channel.out_buffer_cv:
+        channel.out_buffer_cv.wait_for(lambda: channel.out_window_size > 0 or channel.closed or channel.eof_sent, timeout)
+
+
+def _open_failure_reply(error:Exception) -> bytes:
+    """
+    :return: SOCKS5 reply for a failed channel open. Only a refusal of the target is 'connection refused', the clients
+             take it as a closed port. OpenSSH reports the error of its connect() in the text of CONNECT_FAILED
+    """
+    if isinstance(error, paramiko.ChannelException) and error.code == paramiko.OPEN_FAILED_CONNECT_FAILED:
+        return _SOCKS5_REPLY_REFUSED if "refused" in (error.text or "").lower() else _SOCKS5_REPLY_HOST_UNREACHABLE
+    return _SOCKS5_REPLY_GENERAL_FAILURE
+
+
+class _Socks5Connection:
+    """State of a relayed client connection, each client has its own channel."""
+    __slots__ = ("client", "writer", "destination", "channel", "task", "readable", "bytes_up", "bytes_down")
+
+    def __init__(self, writer:asyncio.StreamWriter):
+        self.client = writer.get_extra_info("peername")
+        self.writer = writer
+        self.destination = None
+        self.channel = None
+        self.task = None
+        self.readable = asyncio.Event()
+        self.bytes_up = 0
+        self.bytes_down = 0
+
+    def close(self):
+        if self.channel:
+            self.channel.close()
+
+    def abort(self):
+        """Drops the client and the channel, the handler of the connection finishes on its own."""
+        self.writer.transport.abort()
+        self.close()
+        # A closed channel doesn't always signal its file descriptor, the relay finds the channel closed on its own
+        self.readable.set()
+
 
 class ServerSSH:
-    def __init__(self, hostname:str, port:int, username:str, password:Optional[str] = None, pkey:Optional[str] = None, local_host: str = PROXY_HOST, local_port: int = get_random_port_from_json()):
+    def __init__(self, hostname:str, port:int, username:str, password:Optional[str] = None, pkey:Optional[str] = None, local_host: str = PROXY_HOST, local_port: Optional[int] = None):
         """
         Initialize SSH Server.
         :param hostname: SSH server address
@@ -23,19 +88,24 @@ class ServerSSH:
         :param password: SSH password (if any)
         :param pkey: Path to private key (if any)
         :param local_host: Local proxy address
-        :param local_port: Local proxy port
+        :param local_port: Local proxy port (default is a random port from the proxy JSON file)
         """
         self.remote_host = hostname
         self.remote_port = port
         self.local_host = local_host
-        self.local_port = local_port
+        # Chosen per server, a default argument would give all servers the same port
+        self.local_port = local_port if local_port is not None else get_random_port_from_json()
         self._username = username
         self._password = password
         self._pkey = pkey
 
-        self._client = None
-        self._channel = None
-        self._tunnel_thread = None
+        self._pool = None
+        self._proxy_loop = None
+        self._proxy_thread = None
+        self._proxy_server = None
+        self._connections = set()
+        # Totals of the finished connections, the live ones are added by proxy_stats()
+        self._finished = {"connections": 0, "bytes_up": 0, "bytes_down": 0}
 
         self.str_remote = f"{self.remote_host}:{self.remote_port}"
         self.str_local = f"{self.local_host}:{self.local_port}"
@@ -49,178 +119,414 @@ class ServerSSH:
         )
 
     @logger(_module_name)
-    def connect(self):
-        """Establish an SSH connection."""
+    def connect(self, timeout:Optional[float] = PROXY_CONNECT_TIMEOUT):
+        """
+        Establish an SSH connection. The connections are pooled per remote host and shared by its servers,
+        a lost connection is re-established on the next request.
+        :param timeout: Timeout in seconds for each step of the connection: TCP connect, SSH banner and authentication
+        """
         try:
-            self._client = paramiko.SSHClient()
-            self._client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            if self._pkey:
-                private_key = paramiko.RSAKey.from_private_key_file(self._pkey)
-                self._client.connect(self.remote_host, port=self.remote_port, username=self._username, pkey=private_key)
-            else:
-                self._client.connect(self.remote_host, port=self.remote_port, username=self._username, password=self._password)
+            if not self._pool:
+                self._pool = acquire_pool(self.remote_host, self.remote_port, self._username, self._password, self._pkey,
+                                          connect_timeout=timeout)
+            self._pool.connect()
             vsc_log.info_ip_result(_module_name, self.local_port, "Connection successful!")
         except Exception as e:
             vsc_log.error_result(_module_name, f"Failed to connect to {self.remote_host}:{self.remote_port}: {e}")
 
     @logger(_module_name)
-    def execute_command(self, command:str) -> tuple[str, str] | tuple[None, None]:
+    def is_alive(self) -> bool:
+        """Check that the SSH connection is established and its transport is active."""
+        return bool(self._pool and self._pool.is_alive())
+
+    @logger(_module_name)
+    def ping(self, timeout:Optional[float] = None) -> float | None:
+        """
+        Measure the round trip time by opening a session channel, so a server, that doesn't accept new channels, fails the check.
+        :param timeout: Timeout in seconds for opening the channel
+        :return: Round trip time in seconds, None if the connection is lost or the channel isn't opened
+        """
+        if not self.is_alive():
+            return None
+        started = time.perf_counter()
+        try:
+            channel = self._pool.open_channel(timeout=timeout)
+        except Exception as e:
+            vsc_log.debug_status_result(_module_name, "PING", f"{self.str_remote} doesn't open a channel: {e}")
+            return None
+        rtt = time.perf_counter() - started
+        self._pool.release(channel)
+        return rtt
+
+    @property
+    def active_connections(self) -> int:
+        """Number of the client connections relayed by the SOCKS5 proxy."""
+        return len(self._connections)
+
+    @logger(_module_name)
+    def execute_command(self, command:str, timeout:Optional[float] = None) -> tuple[str, str] | tuple[None, None]:
         """
         Execute a command on the remote server.
         :param command: Command to execute
+        :param timeout: Timeout of the command channel in seconds (if any)
         :return: Command output
         """
-        if not self._client:
+        if not self._pool:
             vsc_log.warn_result(_module_name, "SSH connection is not established.")
         else:
-            stdin, stdout, stderr = self._client.exec_command(command)
-            return stdout.read().decode(), stderr.read().decode()
+            with self._pool.channel(timeout=timeout) as channel:
+                channel.settimeout(timeout)
+                channel.exec_command(command)
+                stdout, stderr = channel.makefile("rb"), channel.makefile_stderr("rb")
+                return stdout.read().decode(), stderr.read().decode()
         return None, None
 
+    def iter_command(self, command:str, timeout:Optional[float] = None) -> Iterator[str]:
+        """
+        Execute a command on the remote server and stream its output.
+        :param timeout: Timeout in seconds of waiting for the next output line (if any)
+        :return: Lines of the stdout (without the line ends), as the command prints them
+        :raises ConnectionError: If the SSH connection is not established
+        :raises RuntimeError: If the command exits with an error, with its stderr
+        """
+        if not self._pool:
+            raise ConnectionError(f"SSH connection to {self.str_remote} is not established")
+        with self._pool.channel(timeout=timeout) as channel:
+            channel.settimeout(timeout)
+            channel.exec_command(command)
+            for line in channel.makefile("rb"):
+                yield line.decode().rstrip("\r\n")
+            exit_status = channel.recv_exit_status()
+            if exit_status:
+                stderr = channel.makefile_stderr("rb").read().decode().strip()
+                raise RuntimeError(f"Command exited with {exit_status} on {self.str_remote}: {stderr}")
+
+    def _remote_sha256(self, remote_path:str, end:int = None) -> str | None:
+        """
+        :param end: Hash only the first bytes of the file (default is the whole file)
+        :return: SHA-256 of the remote file, None if the server has no sha256sum or the file can't be read
+        """
+        quoted = shlex.quote(remote_path)
+        stdout, _ = self.execute_command(f"sha256sum -- {quoted}" if end is None else f"head -c {int(end)} -- {quoted} | sha256sum")
+        return stdout.split()[0] if stdout and stdout.strip() else None
+
+    def _transfer(self, transfer, source:str, target:str, resume:bool) -> str:
+        """
+        Runs the transfer in a pooled SFTP session, a stalled or dropped transfer is resumed in a new session.
+        A partial file is resumed only if its content is verified with sha256sum on the server.
+        :return: SHA-256 of the transferred file
+        """
+        for attempt in range(1, PROXY_SFTP_ATTEMPTS + 1):
+            try:
+                with self._pool.sftp() as sftp:
+                    checksum, _ = transfer(sftp, source, target, resume or attempt > 1, self._remote_sha256)
+                    return checksum
+            except RETRYABLE_ERRORS as e:
+                if attempt == PROXY_SFTP_ATTEMPTS:
+                    raise
+                vsc_log.warn_ip_result(_module_name, self.str_remote, f"Transfer of '{source}' is interrupted ({e!r}), resuming")
+
     @logger(_module_name)
-    def sftp_upload(self, local_path:str, remote_path:str):
+    def sftp_upload(self, local_path:str, remote_path:str, resume:bool = False, verify:bool = True) -> str | None:
         """
         Upload a file via SFTP.
         :param local_path: Path to local file
         :param remote_path: Path on remote server
+        :param resume: Continue a partial upload of an earlier call, if its content matches the start of the local file
+        :param verify: Compare the SHA-256 of the uploaded file on the server, the server needs sha256sum
+        :return: SHA-256 of the file
+        :raises ValueError: If the checksums differ or the uploaded file can't be verified, the partial file is removed
         """
-        if not self._client:
+        if not self._pool:
             vsc_log.warn_ip_result(_module_name, self.str_local, "SSH connection is not established.")
-        else:
-            sftp = self._client.open_sftp()
-            sftp.put(local_path, remote_path)
-            sftp.close()
+            return None
+        checksum = self._transfer(upload_file, local_path, remote_path, resume)
+        partial_path = f"{remote_path}{PARTIAL_SUFFIX}"
+        remote_checksum = self._remote_sha256(partial_path) if verify else None
+        with self._pool.sftp() as sftp:
+            if verify and remote_checksum != checksum:
+                sftp.remove(partial_path)
+                raise ValueError(f"Checksum of the uploaded '{remote_path}' differs: {remote_checksum} instead of {checksum}" if remote_checksum
+                                 else f"Uploaded '{remote_path}' can't be verified, sha256sum failed on {self.str_remote}")
+            finish_upload(sftp, remote_path)
+        return checksum
 
     @logger(_module_name)
-    def sftp_download(self, remote_path:str, local_path:str):
+    def sftp_download(self, remote_path:str, local_path:str, resume:bool = False, verify:bool = True) -> str | None:
         """
         Download a file via SFTP.
         :param remote_path: Path on remote server
         :param local_path: Path to local file
+        :param resume: Continue a partial download of an earlier call, if its content matches the start of the remote file
+        :param verify: Compare the SHA-256 of the downloaded file with the remote file, the server needs sha256sum
+        :return: SHA-256 of the file
+        :raises ValueError: If the checksums differ or the remote file can't be hashed, the partial file is removed
         """
-        if not self._client:
+        if not self._pool:
             vsc_log.warn_ip_result(_module_name, self.str_local, "SSH connection is not established.")
-        else:
-            sftp = self._client.open_sftp()
-            sftp.get(remote_path, local_path)
-            sftp.close()
+            return None
+        checksum = self._transfer(download_file, remote_path, local_path, resume)
+        partial_path = f"{local_path}{PARTIAL_SUFFIX}"
+        remote_checksum = self._remote_sha256(remote_path) if verify else None
+        if verify and remote_checksum != checksum:
+            os.remove(partial_path)
+            raise ValueError(f"Checksum of the downloaded '{remote_path}' differs: {checksum} instead of {remote_checksum}" if remote_checksum
+                             else f"Downloaded '{remote_path}' can't be verified, sha256sum failed on {self.str_remote}")
+        os.replace(partial_path, local_path)
+        return checksum
+
+    def _sftp_batch(self, transfer, files:List[tuple[str, str]], parallel:int, **kwargs) -> Dict[str, str | Exception]:
+        results = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(parallel, len(files) or 1)), thread_name_prefix="sftp") as executor:
+            futures = {executor.submit(transfer, source, target, **kwargs): source for source, target in files}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    vsc_log.error_ip_result(_module_name, self.str_remote, f"Transfer of '{futures[future]}' failed: {e}")
+                    results[futures[future]] = e
+        return results
+
+    @logger(_module_name)
+    def sftp_upload_batch(self, files:List[tuple[str, str]], parallel:int = PROXY_SFTP_PARALLEL, **kwargs) -> Dict[str, str | Exception]:
+        """
+        Upload files in parallel SFTP sessions.
+        :param files: Local and remote paths
+        :param parallel: Number of files transferred at a time
+        :return: SHA-256 or the error of each local path
+        """
+        return self._sftp_batch(self.sftp_upload, files, parallel, **kwargs)
+
+    @logger(_module_name)
+    def sftp_download_batch(self, files:List[tuple[str, str]], parallel:int = PROXY_SFTP_PARALLEL, **kwargs) -> Dict[str, str | Exception]:
+        """
+        Download files in parallel SFTP sessions.
+        :param files: Remote and local paths
+        :param parallel: Number of files transferred at a time
+        :return: SHA-256 or the error of each remote path
+        """
+        return self._sftp_batch(self.sftp_download, files, parallel, **kwargs)
 
     @logger(_module_name)
     def start_proxy(self):
         """Setup a local SOCKS5 tunnel through the given SSH server."""
         try:
             vsc_log.info_ip_result(_module_name, self.str_local, f"Attempting to establish a tunnel.")
-            transport = self._client.get_transport()
-            transport.set_keepalive(180)
-            # Setup dynamic forwarding (SOCKS5 Proxy)
-            threading.Thread(target=self._start_socks5_server).start()
-
+            if not self._pool:
+                raise ConnectionError("SSH connection is not established")
+            # Setup dynamic forwarding (SOCKS5 Proxy): all clients are relayed by one event loop in its own thread
+            self._proxy_loop = asyncio.new_event_loop()
+            started = concurrent.futures.Future()
+            self._proxy_thread = threading.Thread(target=self._run_proxy_loop, args=(started,), name=f"socks5-{self.local_port}", daemon=True)
+            self._proxy_thread.start()
+            # Waits until the proxy is listening, so the caller can connect right away
+            started.result()
         except Exception as e:
+            self._proxy_loop = self._proxy_thread = None
             vsc_log.warn_ip_result(
                 _module_name, self.str_local,
                 f"Unable to establish a tunnel. Exception:\n{e}"
             )
 
-    @logger(_module_name)
-    def _start_socks5_server(self):
-        server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_sock.bind((self.local_host, self.local_port))
-        server_sock.listen(5)
-
+    def _run_proxy_loop(self, started:concurrent.futures.Future):
+        asyncio.set_event_loop(self._proxy_loop)
+        try:
+            self._proxy_server = self._proxy_loop.run_until_complete(asyncio.start_server(
+                self._handle_client, self.local_host, self.local_port, backlog=PROXY_BACKLOG, limit=PROXY_BUFFER_SIZE))
+        except Exception as e:
+            started.set_exception(e)
+            self._proxy_loop.close()
+            return
         vsc_log.info_ip_result(_module_name, self.str_local, "SOCKS5 proxy starts")
+        started.set_result(True)
+        try:
+            self._proxy_loop.run_forever()
+        finally:
+            self._proxy_loop.close()
 
-        while True:
-            client_sock, client_addr = server_sock.accept()
-            threading.Thread(target=self._handle_client, args=(client_sock,)).start()
-
-    @logger(_module_name)
-    def _handle_client(self, client_sock):
+    async def _read_request(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter) -> tuple[str, int] | None:
+        """
+        SOCKS5 handshake without authentication and the CONNECT request.
+        :return: Destination address and port, None if the request isn't supported (the client is answered)
+        """
+        version, methods_count = await reader.readexactly(2)
+        methods = await reader.readexactly(methods_count)
+        if version != 0x05:
+            return None
+        if 0x00 not in methods:
+            writer.write(b"\x05\xff")
+            return None
+        writer.write(b"\x05\x00")
+
+        _, command, _, addr_type = await reader.readexactly(4)
+        if addr_type == 0x01:  # IPv4
+            dest_addr = socket.inet_ntop(socket.AF_INET, await reader.readexactly(4))
+        elif addr_type == 0x03:  # Domain name
+            dest_addr = (await reader.readexactly((await reader.readexactly(1))[0])).decode()
+        elif addr_type == 0x04:  # IPv6
+            dest_addr = socket.inet_ntop(socket.AF_INET6, await reader.readexactly(16))
+        else:
+            writer.write(_SOCKS5_REPLY_ADDRESS_NOT_SUPPORTED)
+            return None
+        dest_port = int.from_bytes(await reader.readexactly(2), "big")
+        if command != 0x01:  # Only CONNECT is supported
+            writer.write(_SOCKS5_REPLY_COMMAND_NOT_SUPPORTED)
+            return None
+        return dest_addr, dest_port
+
+    async def _handle_client(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
         """Handling client connection and proxying through SSH tunnel."""
-        vsc_log.info_ip_result(_module_name, self.str_local, "New request received")
+        pool = self._pool
+        connection = _Socks5Connection(writer)
+        self._connections.add(connection)
+        connection.task = asyncio.current_task()
         try:
-            # Acceptance of SOCKS5 handshake
-            client_request = client_sock.recv(262)
-            if client_request[0] != 0x05:  # Check SOCKS5 version
-                client_sock.close()
+            destination = await self._read_request(reader, writer)
+            if destination is None:
                 return
-
-            # Send SOCKS5 support confirmation without authentication
-            client_sock.sendall(b"\x05\x00")
-
-            # Receiving a connection request
-            client_request = client_sock.recv(4)
-            if client_request[1] != 0x01:  # Only CONNECT is supported
-                client_sock.close()
-                return
-
-            # Parse address and port of destination
-            addr_type = client_request[3]
-            if addr_type == 0x01:  # IPv4
-                dest_addr = socket.inet_ntoa(client_sock.recv(4))
-            elif addr_type == 0x03:  # Domain name
-                domain_length = client_sock.recv(1)[0]
-                dest_addr = client_sock.recv(domain_length).decode()
-            else:
-                client_sock.close()
+            connection.destination = destination
+            vsc_log.debug_status_result(_module_name, "CONNECT", f"{self.str_local} -> {destination[0]}:{destination[1]}")
+
+            # Opening waits for the answer of the SSH server, so it runs in a thread
+            try:
+                connection.channel = await asyncio.get_running_loop().run_in_executor(channel_executor, functools.partial(
+                    pool.open_channel, "direct-tcpip", destination, (self.local_host, self.local_port), timeout=PROXY_CHANNEL_TIMEOUT))
+            except Exception as e:
+                vsc_log.debug_status_result(_module_name, "REFUSED", f"{destination[0]}:{destination[1]} through {self.str_remote}: {e}")
+                writer.write(_open_failure_reply(e))
                 return
-
-            dest_port = int.from_bytes(client_sock.recv(2), "big")
-
-            # Set the SSH channel for direct connection
-            transport = self._client.get_transport()
-            self._channel = transport.open_channel(
-                kind="direct-tcpip",
-                dest_addr=(dest_addr, dest_port),
-                src_addr=(self.local_host, self.local_port),
-            )
-
-            # Send confirmation to the client
-            client_sock.sendall(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00")
-
-            # Redirecting data
-            while True:
-                read_sockets, _, _ = select.select([client_sock, self._channel], [], [])
-                for sock in read_sockets:
-                    data = sock.recv(1024)
-                    if not data:
-                        return
-                    if sock is client_sock:
-                        self._channel.send(data)
-                    else:
-                        client_sock.send(data)
+            # Non-blocking channel, the loop is woken up by its file descriptor
+            connection.channel.settimeout(0)
+            writer.write(_SOCKS5_REPLY_SUCCEEDED)
+
+            # Each direction stops reading, while the other side doesn't take the data (backpressure)
+            upstream = asyncio.ensure_future(self._client_to_channel(reader, connection))
+            try:
+                await self._channel_to_client(writer, connection)
+            finally:
+                upstream.cancel()
+                await asyncio.gather(upstream, return_exceptions=True)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
         except Exception as e:
             vsc_log.warn_ip_result(_module_name, self.str_local, f"Error in SOCKS5 proxy handler:\n{e}")
         finally:
-            client_sock.close()
-            if self._channel:
-                self._channel.close()
+            self._connections.discard(connection)
+            self._finished["connections"] += 1
+            self._finished["bytes_up"] += connection.bytes_up
+            self._finished["bytes_down"] += connection.bytes_down
+            if connection.channel:
+                # Frees the place of the channel on its pooled connection
+                pool.release(connection.channel)
+            writer.close()
+
+    async def _client_to_channel(self, reader:asyncio.StreamReader, connection:'_Socks5Connection'):
+        loop = asyncio.get_running_loop()
+        channel = connection.channel
+        try:
+            while data := await reader.read(PROXY_BUFFER_SIZE):
+                while data:
+                    try:
+                        sent = channel.send(data)
+                    except socket.timeout:
+                        # The SSH window is full, the client isn't read until the remote side takes the data
+                        await loop.run_in_executor(channel_executor, _wait_send_window, channel, PROXY_CHANNEL_TIMEOUT)
+                        continue
+                    if not sent:
+                        return
+                    connection.bytes_up += sent
+                    data = data[sent:]
+            channel.shutdown_write()
+        except (ConnectionError, OSError):
+            # A closed channel wakes up the other direction, that finishes the connection
+            channel.close()
+
+    async def _channel_to_client(self, writer:asyncio.StreamWriter, connection:'_Socks5Connection'):
+        loop = asyncio.get_running_loop()
+        channel = connection.channel
+        readable = connection.readable
+        channel_fd = channel.fileno()
+        while True:
+            # The reader is removed while writing, so a channel with buffered data doesn't wake the loop up in vain
+            loop.add_reader(channel_fd, readable.set)
+            try:
+                await readable.wait()
+            finally:
+                loop.remove_reader(channel_fd)
+            readable.clear()
+            try:
+                data = channel.recv(PROXY_BUFFER_SIZE)
+            except socket.timeout:
+                continue
+            if not data:
+                break
+            connection.bytes_down += len(data)
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+
+    async def _shutdown_proxy(self):
+        self._proxy_server.close()
+        tasks = [connection.task for connection in self._connections]
+        for connection in list(self._connections):
+            connection.abort()
+        if tasks:
+            # A handler, that waits for its channel to open, finishes after the channel timeout at the latest
+            _, pending = await asyncio.wait(tasks, timeout=PROXY_STOP_TIMEOUT)
+            for task in pending:
+                task.cancel()
+        await self._proxy_server.wait_closed()
+
+    @logger(_module_name)
+    def proxy_stats(self) -> dict:
+        """
+        :return: Number of the open ('active_connections') and of all relayed connections since the start, and the bytes
+                 transferred by all of them
+        """
+        connections = list(self._connections)
+        finished = dict(self._finished)
+        return {"active_connections": len(connections), "connections": finished["connections"] + len(connections),
+                "bytes_up": finished["bytes_up"] + sum(connection.bytes_up for connection in connections),
+                "bytes_down": finished["bytes_down"] + sum(connection.bytes_down for connection in connections)}
 
     @logger(_module_name)
     def stop_proxy(self):
-        if self._tunnel_thread:
-            self._tunnel_thread.join()
-            vsc_log.log_ip_result(_module_name, self.str_local, f"SOCKS5 proxy stopped.")
+        """Stops accepting, closes the relayed connections with their channels and stops the thread of the proxy."""
+        if not self._proxy_thread:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown_proxy(), self._proxy_loop).result(PROXY_STOP_TIMEOUT)
+        except Exception as e:
+            vsc_log.warn_ip_result(_module_name, self.str_local, f"SOCKS5 proxy didn't stop cleanly: {e}")
+        self._proxy_loop.call_soon_threadsafe(self._proxy_loop.stop)
+        self._proxy_thread.join(PROXY_STOP_TIMEOUT)
+        self._proxy_loop = self._proxy_thread = self._proxy_server = None
+        vsc_log.info_ip_result(_module_name, self.str_local, f"SOCKS5 proxy stopped.")
 
     @logger(_module_name)
     def port_forward(self):
         """Set up local port forwarding."""
-        if not self._client:
+        if not self._pool:
             vsc_log.warn_ip_result(_module_name, self.str_local, "SSH connection is not established.")
+            return
 
-        transport = self._client.get_transport()
+        transport = self._pool.transport()
         transport.request_port_forward("", self.local_port, self.remote_host, self.remote_port)
 
     @logger(_module_name)
     def close(self):
         """Close the SSH connection."""
-        if self._client:
-            self._client.close()
         self.stop_proxy()
+        if self._pool:
+            release_pool(self._pool)
+            self._pool = None
 
 
 # Пример использования
 if __name__ == "__main__":
+    from __temp__.proxy_test_auth_data import PROXY_TEST_host, PROXY_TEST_port, PROXY_TEST_user, PROXY_TEST_password
+
     server = ServerSSH(
         hostname=PROXY_TEST_host,
         port=PROXY_TEST_port,
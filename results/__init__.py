@@ -0,0 +1 @@
+from .store import *
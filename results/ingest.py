@@ -0,0 +1,23 @@
+import argparse
+
+from _conf import RESULTS_DB, RESULTS_BATCH_SIZE, NMAP_OUTPUT_FOLDER, BRUTEFORCE_OUTPUT_FOLDER
+from _log import logger
+from results.store import ResultsStore
+
+
+_module_name = "results.ingest"
+
+
+@logger(_module_name)
+def main(remaining_args):
+    parser = argparse.ArgumentParser(description="Adds the nmap XML results and the domain results to the results store")
+    parser.add_argument('-iF', '--input', default=f"{NMAP_OUTPUT_FOLDER},{BRUTEFORCE_OUTPUT_FOLDER}",
+                        help=f"Comma-separated result files or folders (default is '{NMAP_OUTPUT_FOLDER},{BRUTEFORCE_OUTPUT_FOLDER}')")
+    parser.add_argument('-db', '--database', default=RESULTS_DB,
+                        help=f"Path to the results store (default is '{RESULTS_DB}')")
+    parser.add_argument('-bS', '--batch-size', type=int, default=RESULTS_BATCH_SIZE,
+                        help=f"Number of hosts or resolutions written in one transaction (default is {RESULTS_BATCH_SIZE})")
+    args = parser.parse_args(remaining_args)
+
+    with ResultsStore(args.database, args.batch_size) as store:
+        store.ingest([path for path in args.input.split(',') if path])
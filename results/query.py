@@ -0,0 +1,55 @@
+import argparse
+import json
+
+from _conf import RESULTS_DB
+from _log import vsc_log, logger
+from results.store import ResultsStore
+
+
+_module_name = "results.query"
+
+
+@logger(_module_name)
+def main(remaining_args):
+    parser = argparse.ArgumentParser(description="Queries the results store, e.g. all hosts with port 443 serving a domain")
+    parser.add_argument('-d', '--domain', default=None,
+                        help="Hosts, that the domain or its subdomains were resolved to")
+    parser.add_argument('-eD', '--exact-domain', action='store_true',
+                        help="Don't include the subdomains of the domain")
+    parser.add_argument('-p', '--port', type=int, default=None,
+                        help="Port number")
+    parser.add_argument('-pR', '--protocol', default=None,
+                        help="Port protocol, e.g. 'tcp'")
+    parser.add_argument('-sN', '--service', default=None,
+                        help="Service name, e.g. 'https'")
+    parser.add_argument('-sC', '--script', default=None,
+                        help="Only ports with a finding of the nmap script, e.g. 'ssl-heartbleed'")
+    parser.add_argument('-ip', '--ip-address', default=None,
+                        help="IP address of the host")
+    parser.add_argument('-aS', '--all-states', action='store_true',
+                        help="Include closed and filtered ports")
+    parser.add_argument('-l', '--limit', type=int, default=None,
+                        help="Maximum number of results")
+    parser.add_argument('-oFmt', '--output-format', choices=['text', 'json'], default='text',
+                        help="Output format: 'text' or 'json' lines (default: 'text')")
+    parser.add_argument('-db', '--database', default=RESULTS_DB,
+                        help=f"Path to the results store (default is '{RESULTS_DB}')")
+    parser.add_argument('--stats', action='store_true',
+                        help="Show the number of stored domains, resolutions, hosts, ports and findings")
+    args = parser.parse_args(remaining_args)
+
+    with ResultsStore(args.database) as store:
+        if args.stats:
+            print(json.dumps(store.stats()))
+            return
+        count = 0
+        for result in store.query(args.domain, args.port, args.protocol, args.service, args.script, args.ip_address,
+                                  include_subdomains=not args.exact_domain, open_only=not args.all_states, limit=args.limit):
+            count += 1
+            if args.output_format == 'json':
+                print(json.dumps(result))
+            else:
+                banner = ' '.join(filter(None, (result["service"], result["product"], result["version"])))
+                print(f"{result['ip']}\t{result['port']}/{result['protocol']}\t{result['state']}\t{banner}\t"
+                      f"{','.join(result['domains'])}\t{','.join(result['findings'])}")
+        vsc_log.info_status_result(_module_name, "FOUND", f"{count} ports")
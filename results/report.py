@@ -0,0 +1,197 @@
+import argparse
+import csv
+import html
+import json
+import os
+import tempfile
+from datetime import datetime
+from typing import Iterator, List
+
+from _conf import RESULTS_DB, RESULTS_REPORT_FOLDER, RESULTS_REPORT_FORMATS, ensure_dir
+from _log import vsc_log, logger
+from nmap.baseline import load_baseline
+from nmap.nmap_xml import service_banner
+from results.store import ResultsStore
+
+
+_module_name = "results.report"
+
+# Sections of the report with their columns
+SECTIONS = {
+    "vulnerable_services": ("ip", "port", "service", "domains", "script", "output"),
+    "new_exposures": ("ip", "port", "service", "domains", "reason"),
+    "domain_rollups": ("domain", "ips", "open_ports", "vulnerabilities"),
+}
+
+
+class _JsonReport:
+    def __init__(self, output_prefix:str):
+        self.files = [f"{output_prefix}.json"]
+        self._file = open(self.files[0], 'w')
+        self._file.write(f'{{"generated": {json.dumps(datetime.now().isoformat(timespec="seconds"))}')
+        self._first_row = True
+
+    def section(self, name:str, columns:tuple):
+        self._columns = columns
+        self._file.write(f', {json.dumps(name)}: [')
+        self._first_row = True
+
+    def row(self, values:tuple):
+        self._file.write(f'{"" if self._first_row else ","}\n{json.dumps(dict(zip(self._columns, values)))}')
+        self._first_row = False
+
+    def end_section(self, count:int):
+        self._file.write('\n]')
+
+    def close(self):
+        self._file.write('}\n')
+        self._file.close()
+
+
+class _CsvReport:
+    """
+    A CSV file per section.
+    """
+    def __init__(self, output_prefix:str):
+        self.output_prefix = output_prefix
+        self.files = []
+        self._file = None
+        self._writer = None
+
+    def section(self, name:str, columns:tuple):
+        self.files.append(f"{self.output_prefix} {name}.csv")
+        self._file = open(self.files[-1], 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(columns)
+
+    def row(self, values:tuple):
+        self._writer.writerow(values)
+
+    def end_section(self, count:int):
+        self._file.close()
+
+    def close(self):
+        pass
+
+
+class _HtmlReport:
+    def __init__(self, output_prefix:str):
+        self.files = [f"{output_prefix}.html"]
+        self._file = open(self.files[0], 'w')
+        self._file.write("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>VulnScan report</title><style>"
+                         "body{font-family:sans-serif}table{border-collapse:collapse;margin-bottom:2em}"
+                         "td,th{border:1px solid #ccc;padding:2px 6px;vertical-align:top}pre{margin:0;white-space:pre-wrap}"
+                         "</style></head><body>\n"
+                         f"<h1>VulnScan report</h1><p>Generated {html.escape(datetime.now().isoformat(timespec='seconds'))}</p>\n")
+
+    def section(self, name:str, columns:tuple):
+        self._file.write(f"<h2>{html.escape(name.replace('_', ' ').capitalize())}</h2>\n<table><tr>"
+                         f"{''.join(f'<th>{html.escape(column)}</th>' for column in columns)}</tr>\n")
+
+    def row(self, values:tuple):
+        cells = ''.join(f"<td><pre>{html.escape(str(value))}</pre></td>" if isinstance(value, str) and '\n' in value
+                        else f"<td>{html.escape(str(value))}</td>" for value in values)
+        self._file.write(f"<tr>{cells}</tr>\n")
+
+    def end_section(self, count:int):
+        self._file.write(f"</table><p>{count} rows</p>\n")
+
+    def close(self):
+        self._file.write("</body></html>\n")
+        self._file.close()
+
+
+_REPORTS = {"json": _JsonReport, "csv": _CsvReport, "html": _HtmlReport}
+
+
+def _exposure_reason(ip:str, port:str, baseline:dict) -> str | None:
+    """
+    The store has the ports of the deep scans (all ports), the baseline the ones of the verification sweep (top ports)
+    and of the last deep scan of each host, a port is known, if one of them has seen it.
+    :return: Why the open port is a new exposure against the baseline, None if it is known
+    """
+    fingerprint = baseline["hosts"].get(ip)
+    if fingerprint is None:
+        return "new host"
+    if port not in fingerprint["ports"] and port not in fingerprint.get("deep_ports", []):
+        return "new port"
+    return None
+
+
+def _sections_from_store(store:ResultsStore, baseline:dict | None) -> Iterator[tuple[str, Iterator[tuple]]]:
+    yield "vulnerable_services", ((row["ip"], f"{row['port']}/{row['protocol']}" if row["port"] is not None else "",
+                                   service_banner(row), row["domains"] or "", row["script"], row["output"]) for row in store.vulnerable_findings())
+    if baseline is not None:
+        def exposures():
+            for row in store.open_ports():
+                reason = _exposure_reason(row["ip"], f"{row['port']}/{row['protocol']}", baseline)
+                if reason:
+                    yield row["ip"], f"{row['port']}/{row['protocol']}", service_banner(row), row["domains"] or "", reason
+        yield "new_exposures", exposures()
+    yield "domain_rollups", ((row["domain"], row["ips"], row["open_ports"], row["vulnerabilities"]) for row in store.domain_rollups())
+
+
+def _sections_from_files(paths:List[str], baseline:dict | None) -> Iterator[tuple[str, Iterator[tuple]]]:
+    """
+    Ingests the result files into a temporary store, so the domains of the IPs and the per-domain counters are kept
+    on disk instead of in memory and the report is the same as the one of a store with these files.
+    """
+    with tempfile.TemporaryDirectory(prefix="vsc-report-") as folder, ResultsStore(os.path.join(folder, "results.db")) as store:
+        store.ingest(paths)
+        yield from _sections_from_store(store, baseline)
+
+
+@logger(_module_name)
+def write_report(output_format:str, output_folder:str = RESULTS_REPORT_FOLDER, database:str = None, paths:List[str] = None,
+                 baseline_path:str = None) -> List[str]:
+    """
+    Streams the results of the store or of the result files into the report.
+    :param output_format: 'html', 'csv' or 'json'
+    :param database: Path to the results store
+    :param paths: Result files or folders, they are used instead of the store
+    :param baseline_path: Baseline JSON file of nmap.async_nmap, the open ports missing in its sweep and deep scan ports
+        are new exposures
+    :return: Paths to the report files
+    """
+    baseline = load_baseline(baseline_path) if baseline_path else None
+    report = _REPORTS[output_format](f"{ensure_dir(output_folder)}report {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    store = None if paths else ResultsStore(database)
+    try:
+        sections = _sections_from_files(paths, baseline) if paths else _sections_from_store(store, baseline)
+        for name, rows in sections:
+            report.section(name, SECTIONS[name])
+            count = 0
+            for row in rows:
+                report.row(row)
+                count += 1
+            report.end_section(count)
+            vsc_log.info_status_result(_module_name, "SECTION", f"{name}: {count} rows")
+    finally:
+        report.close()
+        if store:
+            store.close()
+    vsc_log.info_status_result(_module_name, "COMPLETE", f"Report saved to: {', '.join(report.files)}")
+    return report.files
+
+
+@logger(_module_name)
+def main(remaining_args):
+    parser = argparse.ArgumentParser(description="Report of the vulnerable services, new exposures and per-domain rollups")
+    parser.add_argument('-oFmt', '--output-format', choices=RESULTS_REPORT_FORMATS, default='html',
+                        help="Output format: 'html', 'csv' or 'json' (default: 'html')")
+    parser.add_argument('-oF', '--output-folder', default=RESULTS_REPORT_FOLDER,
+                        help=f"Folder path for the report (default is the '{RESULTS_REPORT_FOLDER}' folder)")
+    parser.add_argument('-db', '--database', default=RESULTS_DB,
+                        help=f"Path to the results store (default is '{RESULTS_DB}')")
+    parser.add_argument('-iF', '--input', default=None,
+                        help="Comma-separated nmap XML and domain result files or folders, read instead of the results store")
+    parser.add_argument('-bL', '--baseline', default=None,
+                        help="Path to the baseline JSON file, the open ports missing in the ports of its verification sweep (top ports) "
+                             "and of its last deep scan of each host are reported as new exposures")
+    args = parser.parse_args(remaining_args)
+
+    if not args.input and not os.path.exists(args.database):
+        vsc_log.error_status_result(_module_name, "ERROR", f"No results store '{args.database}', ingest the results or use -iF")
+        return
+    write_report(args.output_format, args.output_folder, args.database,
+                 [path for path in args.input.split(',') if path] if args.input else None, args.baseline)
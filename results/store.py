@@ -0,0 +1,325 @@
+import glob
+import json
+import os
+import re
+import sqlite3
+from datetime import datetime
+from typing import Iterator, List
+
+from _conf import RESULTS_DB, RESULTS_BATCH_SIZE, ensure_dir
+from _log import vsc_log, logger
+from nmap.nmap_xml import iter_hosts
+
+
+_module_name = "results.store"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS domains (
+    name TEXT PRIMARY KEY,
+    rname TEXT NOT NULL,
+    last_seen TEXT
+);
+CREATE INDEX IF NOT EXISTS domains_rname ON domains (rname);
+
+CREATE TABLE IF NOT EXISTS resolutions (
+    domain TEXT NOT NULL,
+    ip TEXT NOT NULL,
+    first_seen TEXT,
+    last_seen TEXT,
+    PRIMARY KEY (domain, ip)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS resolutions_ip ON resolutions (ip);
+
+CREATE TABLE IF NOT EXISTS hosts (
+    ip TEXT PRIMARY KEY,
+    state TEXT,
+    hostnames TEXT,
+    scanned_at TEXT,
+    source TEXT
+);
+
+CREATE TABLE IF NOT EXISTS ports (
+    ip TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    protocol TEXT NOT NULL,
+    state TEXT,
+    service TEXT,
+    product TEXT,
+    version TEXT,
+    extrainfo TEXT,
+    PRIMARY KEY (ip, port, protocol)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ports_port ON ports (port, state);
+CREATE INDEX IF NOT EXISTS ports_service ON ports (service);
+
+CREATE TABLE IF NOT EXISTS findings (
+    ip TEXT NOT NULL,
+    port INTEGER,
+    protocol TEXT,
+    script TEXT NOT NULL,
+    output TEXT
+);
+CREATE INDEX IF NOT EXISTS findings_ip ON findings (ip, port);
+CREATE INDEX IF NOT EXISTS findings_script ON findings (script);
+"""
+
+
+# Vulnerability scripts report 'State: VULNERABLE' or 'LIKELY VULNERABLE', but not 'NOT VULNERABLE'
+_VULNERABLE_PATTERN = re.compile(r"(?<!NOT )\bVULNERABLE\b")
+
+
+def is_vulnerable(script_output:str) -> bool:
+    """
+    :return: The output of an nmap script reports a vulnerability
+    """
+    return bool(script_output) and _VULNERABLE_PATTERN.search(script_output) is not None
+
+
+def find_result_files(paths:List[str]) -> List[str]:
+    """
+    :param paths: Result files or folders, a folder is searched for 'nmap.*finished_*.xml' and 'domain.subdomain *.txt' files,
+                  without the 'nmap.sweep_finished_*.xml' files of the verification sweep
+    :return: Paths to the result files
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            # The sweep scans only the top ports without the scripts, it would replace the deep scan of its host
+            files += sorted(file for file in glob.glob(os.path.join(path, "nmap.*finished_*.xml"))
+                            if not os.path.basename(file).startswith("nmap.sweep_"))
+            files += sorted(glob.glob(os.path.join(path, "domain.subdomain *.txt")))
+        else:
+            files.append(path)
+    return files
+
+
+def _reversed_name(domain:str) -> str:
+    # 'www.example.com' is stored as 'moc.elpmaxe.www', so all subdomains of a domain are one index range
+    return '.'.join(reversed(domain.lower().strip('.').split('.')))
+
+
+class ResultsStore:
+    """
+    SQLite store of the domains, their resolutions, the scanned hosts with their ports and services and the findings
+    of the nmap scripts. The rows are inserted in batches, call flush() or close() (or use the store as a context
+    manager) to write the rest.
+    """
+    def __init__(self, path:str = RESULTS_DB, batch_size:int = RESULTS_BATCH_SIZE):
+        """
+        :param path: Path to the SQLite database, it is created if it doesn't exist
+        :param batch_size: Number of hosts or resolutions written in one transaction
+        """
+        self.path = path
+        self.batch_size = batch_size
+        ensure_dir(os.path.dirname(path))
+        self._connection = sqlite3.connect(path)
+        self._connection.row_factory = sqlite3.Row
+        # WAL keeps the queries working while a scan writes to the store
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+        self._connection.create_function("vulnerable", 1, is_vulnerable, deterministic=True)
+        self._resolutions = []
+        # Host row, port rows and findings of each pending host, a later scan of the host in the same batch replaces them
+        self._hosts = {}
+
+    def add_resolutions(self, domain:str, ips:List[str], seen_at:str = None):
+        seen_at = seen_at or datetime.now().isoformat(timespec='seconds')
+        domain = domain.lower().strip('.')
+        self._resolutions.extend((domain, ip, seen_at) for ip in ips)
+        if len(self._resolutions) >= self.batch_size:
+            self.flush()
+
+    def add_host(self, host:dict, source:str = None, scanned_at:str = None):
+        """
+        Adds the host, a host, that is already stored, is replaced with its ports and findings.
+        :param host: Host dict of nmap_xml.iter_hosts()
+        :param source: Result file of the host
+        """
+        ip = host["ip"]
+        scanned_at = scanned_at or datetime.now().isoformat(timespec='seconds')
+        ports, findings = [], []
+        for port_key, port in host["ports"].items():
+            number, _, protocol = port_key.partition('/')
+            ports.append((ip, int(number), protocol, port["state"], port["service"], port["product"], port["version"], port["extrainfo"]))
+            findings.extend((ip, int(number), protocol, script, output) for script, output in port["scripts"].items())
+        findings.extend((ip, None, None, script, output) for script, output in host["scripts"].items())
+        self._hosts.pop(ip, None)
+        self._hosts[ip] = ((ip, host["state"], json.dumps(host["hostnames"]), scanned_at, source), ports, findings)
+        # The names, that the host was scanned by, map it to its domains like the resolutions. The reverse DNS (PTR)
+        # names of the host aren't domains of the targets, they would mix e.g. the names of a cloud provider into the rollups
+        for hostname in host["user_hostnames"]:
+            self.add_resolutions(hostname, [ip], scanned_at)
+        if len(self._hosts) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not (self._resolutions or self._hosts):
+            return
+        with self._connection:
+            if self._resolutions:
+                domains = {domain: seen_at for domain, _, seen_at in self._resolutions}
+                self._connection.executemany(
+                    "INSERT INTO domains (name, rname, last_seen) VALUES (?, ?, ?) ON CONFLICT (name) DO UPDATE SET last_seen = excluded.last_seen",
+                    ((domain, _reversed_name(domain), seen_at) for domain, seen_at in domains.items()))
+                self._connection.executemany(
+                    "INSERT INTO resolutions (domain, ip, first_seen, last_seen) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (domain, ip) DO UPDATE SET last_seen = excluded.last_seen",
+                    ((domain, ip, seen_at, seen_at) for domain, ip, seen_at in self._resolutions))
+            if self._hosts:
+                ips = [(ip,) for ip in self._hosts]
+                # The ports and findings of a rescanned host are replaced, the ones, that are gone, aren't kept
+                self._connection.executemany("DELETE FROM ports WHERE ip = ?", ips)
+                self._connection.executemany("DELETE FROM findings WHERE ip = ?", ips)
+                self._connection.executemany(
+                    "INSERT INTO hosts (ip, state, hostnames, scanned_at, source) VALUES (?, ?, ?, ?, ?) ON CONFLICT (ip) DO UPDATE SET "
+                    "state = excluded.state, hostnames = excluded.hostnames, scanned_at = excluded.scanned_at, source = excluded.source",
+                    (row for row, _, _ in self._hosts.values()))
+                self._connection.executemany(
+                    "INSERT INTO ports (ip, port, protocol, state, service, product, version, extrainfo) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (ip, port, protocol) DO UPDATE SET state = excluded.state, service = excluded.service, "
+                    "product = excluded.product, version = excluded.version, extrainfo = excluded.extrainfo",
+                    (port for _, ports, _ in self._hosts.values() for port in ports))
+                self._connection.executemany("INSERT INTO findings VALUES (?, ?, ?, ?, ?)",
+                                             (finding for _, _, findings in self._hosts.values() for finding in findings))
+        self._resolutions, self._hosts = [], {}
+
+    def close(self):
+        self.flush()
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @logger(_module_name)
+    def ingest_nmap_xml(self, xml_file:str) -> int:
+        """
+        :return: Number of the added hosts
+        """
+        scanned_at = datetime.fromtimestamp(os.path.getmtime(xml_file)).isoformat(timespec='seconds')
+        count = 0
+        for host in iter_hosts(xml_file):
+            if host["ip"]:
+                self.add_host(host, xml_file, scanned_at)
+                count += 1
+        return count
+
+    @logger(_module_name)
+    def ingest_domain_file(self, domain_file:str) -> int:
+        """
+        Adds the resolutions of a 'domain-ip' result file of domain.subdomain ('<domain> - <ip>, <ip>' lines).
+        :return: Number of the added domains
+        """
+        seen_at = datetime.fromtimestamp(os.path.getmtime(domain_file)).isoformat(timespec='seconds')
+        count = 0
+        with open(domain_file, 'r') as file:
+            for line in file:
+                domain, separator, ips = line.strip().partition(' - ')
+                if separator:
+                    self.add_resolutions(domain, [ip.strip() for ip in ips.split(',') if ip.strip()], seen_at)
+                    count += 1
+        return count
+
+    @logger(_module_name)
+    def ingest(self, paths:List[str]) -> dict:
+        """
+        Adds the nmap XML files and the domain result files, see find_result_files().
+        :return: Number of the ingested 'files', 'hosts' and 'domains'
+        """
+        files = find_result_files(paths)
+        counts = {"files": 0, "hosts": 0, "domains": 0}
+        for file in files:
+            if file.endswith(".xml"):
+                counts["hosts"] += self.ingest_nmap_xml(file)
+            else:
+                counts["domains"] += self.ingest_domain_file(file)
+            counts["files"] += 1
+        self.flush()
+        vsc_log.info_status_result(_module_name, "INGESTED", f"{counts['hosts']} hosts and {counts['domains']} domains "
+                                                             f"from {counts['files']} files to '{self.path}'")
+        return counts
+
+    def query(self, domain:str = None, port:int = None, protocol:str = None, service:str = None, script:str = None,
+              ip:str = None, include_subdomains:bool = True, open_only:bool = True, limit:int = None) -> Iterator[dict]:
+        """
+        Finds the ports of the hosts by the domain (the IPs it was resolved to), port, service, script or IP.
+        :param domain: Domain, its subdomains are included unless include_subdomains is False
+        :param service: Service name, e.g. 'https'
+        :param script: ID of the nmap script with a finding on the port, e.g. 'ssl-heartbleed'
+        :return: Dicts with 'ip', 'port', 'protocol', 'state', 'service', 'product', 'version', 'domains' and 'findings' (by script)
+        """
+        conditions, params = [], []
+        if domain:
+            rname = _reversed_name(domain)
+            domain_condition = "d.rname = ?" + (" OR (d.rname > ? AND d.rname < ?)" if include_subdomains else "")
+            conditions.append(f"p.ip IN (SELECT r.ip FROM domains d JOIN resolutions r ON r.domain = d.name WHERE {domain_condition})")
+            # '/' follows '.', so the range holds all names starting with '<rname>.'
+            params += [rname, f"{rname}.", f"{rname}/"] if include_subdomains else [rname]
+        for column, value in (("p.port", port), ("p.protocol", protocol), ("p.service", service), ("p.ip", ip)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if open_only:
+            conditions.append("p.state = 'open'")
+        if script:
+            conditions.append("EXISTS (SELECT 1 FROM findings f WHERE f.ip = p.ip AND f.port = p.port AND f.script = ?)")
+            params.append(script)
+        sql = (f"SELECT p.* FROM ports p {'WHERE ' + ' AND '.join(conditions) if conditions else ''} "
+               f"ORDER BY p.ip, p.port{' LIMIT ?' if limit else ''}")
+        if limit:
+            params.append(limit)
+
+        self.flush()
+        for row in self._connection.execute(sql, params):
+            result = dict(row)
+            result["domains"] = [domain_row[0] for domain_row in self._connection.execute(
+                "SELECT domain FROM resolutions WHERE ip = ? ORDER BY domain", (row["ip"],))]
+            result["findings"] = {finding[0]: finding[1] for finding in self._connection.execute(
+                "SELECT script, output FROM findings WHERE ip = ? AND port = ? AND protocol = ?", (row["ip"], row["port"], row["protocol"]))}
+            yield result
+
+    def stats(self) -> dict:
+        """
+        :return: Number of rows by table
+        """
+        self.flush()
+        return {table: self._connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("domains", "resolutions", "hosts", "ports", "findings")}
+
+    def vulnerable_findings(self) -> Iterator[dict]:
+        """
+        :return: Findings of the scripts, that report a vulnerability on an open port or the host, with the service and
+                 the domains of the host, by IP and port
+        """
+        self.flush()
+        yield from map(dict, self._connection.execute(
+            "SELECT f.ip, f.port, f.protocol, p.service, p.product, p.version, p.extrainfo, f.script, f.output, "
+            "(SELECT group_concat(r.domain, ',') FROM resolutions r WHERE r.ip = f.ip) AS domains "
+            "FROM findings f LEFT JOIN ports p ON p.ip = f.ip AND p.port = f.port AND p.protocol = f.protocol "
+            "WHERE (f.port IS NULL OR p.state = 'open') AND vulnerable(f.output) ORDER BY f.ip, f.port"))
+
+    def open_ports(self) -> Iterator[dict]:
+        """
+        :return: Open ports with the service and the domains of the host, by IP and port
+        """
+        self.flush()
+        yield from map(dict, self._connection.execute(
+            "SELECT p.ip, p.port, p.protocol, p.service, p.product, p.version, p.extrainfo, "
+            "(SELECT group_concat(r.domain, ',') FROM resolutions r WHERE r.ip = p.ip) AS domains "
+            "FROM ports p WHERE p.state = 'open' ORDER BY p.ip, p.port"))
+
+    def domain_rollups(self) -> Iterator[dict]:
+        """
+        :return: Number of the IPs, open ports and vulnerability findings of the hosts of each domain
+        """
+        self.flush()
+        yield from map(dict, self._connection.execute(
+            "SELECT d.domain, "
+            "(SELECT COUNT(*) FROM resolutions r WHERE r.domain = d.domain) AS ips, "
+            "(SELECT COUNT(*) FROM resolutions r JOIN ports p ON p.ip = r.ip WHERE r.domain = d.domain AND p.state = 'open') AS open_ports, "
+            "(SELECT COUNT(*) FROM resolutions r JOIN findings f ON f.ip = r.ip LEFT JOIN ports p ON p.ip = f.ip AND p.port = f.port AND p.protocol = f.protocol "
+            "WHERE r.domain = d.domain AND (f.port IS NULL OR p.state = 'open') AND vulnerable(f.output)) AS vulnerabilities "
+            "FROM (SELECT name AS domain FROM domains ORDER BY rname) d"))
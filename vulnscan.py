@@ -1,16 +1,29 @@
 import argparse
 import importlib
 
-from _conf import BANNER
-from _log import vsc_log, LogLevel, logger
+from _conf import BANNER, METRICS_HOST, PROFILE_MODES, PROFILE_SAMPLE_INTERVAL, PROFILE_TRACEMALLOC_INTERVAL
+from _log import vsc_log, LogLevel, logger, metrics, start_metrics_server, tracer
 
 
 @logger("main")
 def vuln_scan():
     vsc_log.log(LogLevel.INFO, f"{BANNER}")
-    parser = argparse.ArgumentParser(description="Vulnerability Scanner with multiple scan modes.")
+    # No abbreviations, so the options of the command modules are never taken for the global ones
+    parser = argparse.ArgumentParser(description="Vulnerability Scanner with multiple scan modes.", allow_abbrev=False)
     parser.add_argument('module', help="Module to execute, e.g., 'help', 'nmap', 'domain'")
     parser.add_argument('command', help="Command to execute within the module, e.g., 'async_nmap', 'subdomain")
+    parser.add_argument('--metrics', action='store_true',
+                        help="Collect call counts, errors and latencies of the functions and save them to the metrics folder at exit")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help=f"Serve the metrics in the Prometheus text format on http://{METRICS_HOST}:<port>/metrics during the run")
+    parser.add_argument('--trace', action='store_true',
+                        help="Record the lifecycle of each target and save it as a Chrome trace / Perfetto JSON file to the trace folder at exit")
+    parser.add_argument('--profile', choices=PROFILE_MODES, default=None,
+                        help="Run the command under cProfile or the sampling profiler and save the results to the profile folder")
+    parser.add_argument('--profile-interval', type=float, default=PROFILE_SAMPLE_INTERVAL,
+                        help=f"Interval in seconds between the stack samples of the sampling profiler (default is {PROFILE_SAMPLE_INTERVAL})")
+    parser.add_argument('--tracemalloc-interval', type=float, default=PROFILE_TRACEMALLOC_INTERVAL,
+                        help=f"Interval in seconds between the tracemalloc snapshots (default is {PROFILE_TRACEMALLOC_INTERVAL})")
     known_args, remaining_args = parser.parse_known_args()
 
     # Dynamically load the selected module of the command
@@ -28,9 +41,30 @@ def vuln_scan():
 
     vsc_log.log_settings()
 
+    if known_args.trace:
+        tracer.enable()
+    if known_args.metrics or known_args.metrics_port:
+        metrics.enable()
+    if known_args.metrics_port:
+        start_metrics_server(known_args.metrics_port)
+        vsc_log.log(LogLevel.INFO, f"Metrics are served on http://{METRICS_HOST}:{known_args.metrics_port}/metrics")
+
     # Pass the remaining arguments to the command module
     vsc_log.log(LogLevel.INFO, f"Starting scan with {known_args.module}.{known_args.command} module.")
-    command_module.main(remaining_args)
+    profiler = None
+    if known_args.profile or known_args.tracemalloc_interval:
+        # Imported here, the utilities are loaded by the command modules anyway
+        from _utils import Profiler
+        profiler = Profiler(known_args.profile, known_args.profile_interval, known_args.tracemalloc_interval).start()
+    try:
+        command_module.main(remaining_args)
+    finally:
+        if profiler:
+            profiler.stop()
+        if metrics.enabled:
+            vsc_log.log(LogLevel.INFO, f"Metrics saved to '{metrics.dump()}', the slowest functions:\n{metrics.summary()}")
+        if tracer.enabled:
+            vsc_log.log(LogLevel.INFO, f"Trace saved to '{tracer.export()}'")
     return 0
 
 